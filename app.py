@@ -1,27 +1,253 @@
 import streamlit as st
 import pandas as pd
+import copy
+import hashlib
+import io
 import sys
 import os
+import threading
+from collections import OrderedDict
+from contextlib import redirect_stdout
+from typing import Callable, Dict, Hashable, List, Tuple
 
 # Dynamiskt lägg till "src" i Python-sökvägen
 sys.path.append(os.path.join(os.path.dirname(__file__), "src"))
 
 # Importera LTVexploratory från exploratory.py
 from exploratory import LTVexploratory
+from readers import read_table_file
 
-# Funktion för att säkerställa kompatibilitet
-def ensure_compatible_data(data):
+# Kolumnerna i den uppladdade filen för varje indata till LTVexploratory
+COLUMNS = {
+    "uuid_col": "UUID",
+    "registration_time_col": "timestamp_registration",
+    "event_time_col": "timestamp_event",
+    "event_name_col": "event_name",
+    "value_col": "purchase_value",
+}
+# Minne (MB) för de inlästa och förberedda uppladdningarna i cachen. De som använts minst nyligen tas bort först
+CACHE_BUDGET_MB = 4096
+# Minne (MB) för resultaten av analyserna (ett per analys och parametrar) i cachen
+ANALYSIS_CACHE_BUDGET_MB = 512
+HASH_CHUNK_BYTES = 8 * 2**20
+
+# Kör bara om en del av sidan när dess parametrar ändras (om streamlit stödjer det)
+fragment = getattr(st, "fragment", lambda function: function)
+
+
+class SizeBoundedCache:
+    """
+    Cache som delas mellan alla sessioner och som håller högst [budget_mb] MB. Värdena som använts minst nyligen
+    tas bort när ett nytt värde inte får plats, och ett värde som är större än hela budgeten sparas inte
+    """
+
+    def __init__(self, budget_mb: float) -> None:
+        self.budget = int(budget_mb * 2**20)
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> object:
+        """
+        Värdet med nyckeln [key], eller None om det inte finns i cachen
+        """
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def put(self, key: Hashable, value: object, nbytes: int) -> bool:
+        """
+        Sparar ett värde som använder [nbytes] byte. Returnerar om det sparades
+        """
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            if nbytes > self.budget:
+                return False
+            while self.size + nbytes > self.budget:
+                self.size -= self.entries.popitem(last=False)[1][1]
+            self.entries[key] = (value, nbytes)
+            self.size += nbytes
+            return True
+
+
+@st.cache_resource
+def upload_cache() -> SizeBoundedCache:
+    return SizeBoundedCache(CACHE_BUDGET_MB)
+
+
+@st.cache_resource
+def analysis_cache() -> SizeBoundedCache:
+    return SizeBoundedCache(ANALYSIS_CACHE_BUDGET_MB)
+
+
+def nbytes(value: object) -> int:
     """
-    Säkerställ att alla kolumner har kompatibla datatyper.
+    Ungefärligt minne (byte) för ett värde i cachen: dataframes (inklusive strängarnas innehåll), arrayer,
+    den förberedda datan i LTVexploratory och behållare av dem
     """
-    for col in data.columns:
-        if data[col].dtype == 'O':  # Objektkolumner
-            data[col] = data[col].astype(str).fillna("")
-        elif pd.api.types.is_numeric_dtype(data[col]):
-            data[col] = pd.to_numeric(data[col], errors="coerce").fillna(0)
-        elif pd.api.types.is_datetime64_any_dtype(data[col]):
-            data[col] = pd.to_datetime(data[col], errors="coerce").fillna(pd.Timestamp("1970-01-01"))
-    return data
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, LTVexploratory):
+        return nbytes(value.data_customers) + nbytes(value.data_events) + value.prepared.nbytes
+    if isinstance(value, dict):
+        return sum(nbytes(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(nbytes(item) for item in value)
+    return getattr(value, "nbytes", sys.getsizeof(value))
+
+
+def content_hash(uploaded_file) -> str:
+    """
+    Hash av filens innehåll. Den beräknas en gång per uppladdning och används som nyckel i cachen,
+    så att samma fil inte läses in och förbereds igen vid varje omkörning av sidan
+    """
+    hashes = st.session_state.setdefault("content_hashes", {})
+    file_id = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+    if file_id not in hashes:
+        digest = hashlib.blake2b(digest_size=16)
+        uploaded_file.seek(0)
+        for chunk in iter(lambda: uploaded_file.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+        uploaded_file.seek(0)
+        hashes.clear()
+        hashes[file_id] = digest.hexdigest()
+    return hashes[file_id]
+
+
+def load_data(
+    file_hash: str,
+    columns: Tuple[Tuple[str, str], ...],
+    time_format: str,
+    uploaded_file,
+    progress: Callable[[float], None],
+) -> Tuple[pd.DataFrame, List[str]]:
+    """
+    Läser in bara de mappade kolumnerna med deklarerade datatyper (CSV, CSV.GZ eller Parquet).
+    Tidsformatet upptäcks automatiskt om time_format är None.
+    Returnerar datan och varningarna från konverteringen. Resultatet delas mellan omkörningar och får inte ändras
+    """
+    key = ("data", file_hash, columns, time_format)
+    cached = upload_cache().get(key)
+    if cached is not None:
+        return cached
+    columns = dict(columns)
+    data = read_table_file(
+        uploaded_file,
+        uploaded_file.name,
+        string_cols=[columns["uuid_col"], columns["event_name_col"]],
+        time_cols=[columns["registration_time_col"], columns["event_time_col"]],
+        numeric_cols=[columns["value_col"]],
+        progress=progress,
+        time_format=time_format,
+    )
+    warnings = []
+
+    # ogiltiga tidpunkter blir NaT
+    for col in [columns["registration_time_col"], columns["event_time_col"]]:
+        if data[col].isnull().any():
+            warnings.append(f"Ogiltiga värden i `{col}` har ersatts med NaT.")
+
+    # purchase_value utan värde blir 0
+    data[columns["value_col"]] = data[columns["value_col"]].fillna(0)
+    if not upload_cache().put(key, (data, warnings), nbytes(data)):
+        warnings.append("Filen är för stor för cachen och läses in igen när sidan körs om.")
+    return data, warnings
+
+
+def prepare_analysis(file_hash: str, columns: Tuple[Tuple[str, str], ...], data: pd.DataFrame) -> LTVexploratory:
+    """
+    Skapar LTVexploratory-objektet en gång per fil och kolumnmappning. Filen har en rad per händelse,
+    så kunddatan härleds ur samma tabell utan att tabellen kopplas ihop med sig själv
+    """
+    key = ("prepared", file_hash, columns)
+    ltv = upload_cache().get(key)
+    if ltv is None:
+        with st.spinner("Förbereder analysen..."):
+            ltv = LTVexploratory.from_single_table(data, **dict(columns))
+        upload_cache().put(key, ltv, nbytes(ltv))
+    return ltv
+
+
+def analysis_data(
+    file_hash: str, columns: Tuple[Tuple[str, str], ...], name: str, params: Dict[str, object], ltv: LTVexploratory
+) -> object:
+    """
+    Beräknar datan för en analys. Den beräknas bara igen när filen eller analysens egna parametrar ändras.
+    En kopia returneras, så att den som använder datan kan ändra den
+    """
+    key = (file_hash, columns, name, repr(sorted(params.items())))
+    data = analysis_cache().get(key)
+    if data is None:
+        with st.spinner("Beräknar..."):
+            data = ltv.run_all({name: copy.deepcopy(params)}, n_jobs=1)[name]
+        analysis_cache().put(key, data, nbytes(data))
+    return copy.deepcopy(data)
+
+
+def show_output(output) -> None:
+    """
+    Visar figuren (matplotlib, seaborn eller plotly) och tabellen som en plot-metod returnerar
+    """
+    if output is None:
+        return
+    if isinstance(output, pd.DataFrame):
+        st.dataframe(output)
+        return
+    figure = output[0] if isinstance(output, tuple) else output
+    if hasattr(figure, "to_plotly_json"):
+        st.plotly_chart(figure)
+    else:
+        # seaborn returnerar ett grid som innehåller figuren
+        st.pyplot(figure.figure)
+    if isinstance(output, tuple):
+        st.dataframe(output[1])
+
+
+def analysis_section(
+    ltv: LTVexploratory, file_hash: str, columns: Tuple[Tuple[str, str], ...], name: str, title: str, params: Dict[str, object]
+) -> None:
+    """
+    Visar en analys med de givna parametrarna, inklusive texten som analysen skriver ut
+    """
+    st.subheader(title)
+    try:
+        data = analysis_data(file_hash, columns, name, params, ltv)
+        with redirect_stdout(io.StringIO()) as printed:
+            output = getattr(ltv, ltv.ANALYSES[name][1])(data, **copy.deepcopy(params))
+        if printed.getvalue().strip():
+            st.markdown(printed.getvalue())
+        show_output(output)
+    except Exception as e:
+        st.error(f"Ett fel uppstod vid generering av analysen: {e}")
+
+
+@fragment
+def revenue_pareto_section(ltv: LTVexploratory, file_hash: str, columns: Tuple[Tuple[str, str], ...]) -> None:
+    days_limit = st.number_input("Antal dagar", min_value=1, value=60, key="pareto_days_limit")
+    analysis_section(ltv, file_hash, columns, "plot_revenue_pareto", "Intäktskoncentration (Pareto)", {"days_limit": days_limit})
+
+
+@fragment
+def purchases_distribution_section(ltv: LTVexploratory, file_hash: str, columns: Tuple[Tuple[str, str], ...]) -> None:
+    days_limit = st.number_input("Antal dagar", min_value=1, value=60, key="purchases_days_limit")
+    analysis_section(
+        ltv, file_hash, columns, "plot_purchases_distribution", "Fördelning av antal köp", {"days_limit": days_limit}
+    )
+
+
+@fragment
+def ltv_impact_section(ltv: LTVexploratory, file_hash: str, columns: Tuple[Tuple[str, str], ...]) -> None:
+    days_limit = st.number_input("Antal dagar", min_value=1, value=60, key="impact_days_limit")
+    early_limit = st.number_input("Tidiga dagar", min_value=1, value=7, key="impact_early_limit")
+    is_mobile = st.checkbox("Mobilapp", value=True, key="impact_is_mobile")
+    params = {"days_limit": days_limit, "early_limit": early_limit, "spending_breaks": {}, "is_mobile": is_mobile}
+    analysis_section(ltv, file_hash, columns, "estimate_ltv_impact", "Uppskattad effekt av pLTV", params)
+
 
 # Titel och introduktion
 st.title("LTVision Streamlit App")
@@ -29,63 +255,45 @@ st.write("Analysera kundens livstidsvärde (LTV) med hjälp av LTVexploratory.")
 
 # Steg 1: Ladda upp data
 st.header("Steg 1: Ladda upp din data")
-uploaded_file = st.file_uploader("Ladda upp en CSV-fil", type=["csv"])
+uploaded_file = st.file_uploader("Ladda upp en CSV-, CSV.GZ- eller Parquet-fil", type=["csv", "gz", "parquet"])
 
 if uploaded_file:
-    # Läs in data
-    data = pd.read_csv(uploaded_file)
-    st.write("Kolumner direkt från filen:", data.columns.tolist())
-
-    # Hantera datatyper och konvertera explicit
+    # Läs in data (från cachen om filen redan har lästs in)
+    file_hash = content_hash(uploaded_file)
+    columns = tuple(COLUMNS.items())
+    # behövs bara när datumen kan läsas både som månad/dag och dag/månad
+    time_format = st.text_input("Tidsformat (valfritt, t.ex. %d/%m/%Y)", value="").strip() or None
+    progress_bar = st.progress(0.0, text="Läser in data...")
     try:
-        # UUID som sträng
-        if "UUID" in data.columns:
-            data["UUID"] = data["UUID"].astype(str)
-
-        # timestamp_registration som datetime
-        if "timestamp_registration" in data.columns:
-            data["timestamp_registration"] = pd.to_datetime(data["timestamp_registration"], errors="coerce")
-            if data["timestamp_registration"].isnull().any():
-                st.warning("Ogiltiga värden i `timestamp_registration` har ersatts med NaT.")
-
-        # timestamp_event som datetime
-        if "timestamp_event" in data.columns:
-            data["timestamp_event"] = pd.to_datetime(data["timestamp_event"], errors="coerce")
-            if data["timestamp_event"].isnull().any():
-                st.warning("Ogiltiga värden i `timestamp_event` har ersatts med NaT.")
-
-        # event_name som sträng
-        if "event_name" in data.columns:
-            data["event_name"] = data["event_name"].astype(str)
-
-        # purchase_value som numerisk
-        if "purchase_value" in data.columns:
-            data["purchase_value"] = pd.to_numeric(data["purchase_value"], errors="coerce").fillna(0)
-
-        st.success("Datan har konverterats framgångsrikt.")
+        data, warnings = load_data(file_hash, columns, time_format, uploaded_file, progress_bar.progress)
     except Exception as e:
-        st.error(f"Fel vid konvertering av datatyper: {e}")
+        st.error(f"Fel vid inläsning av filen: {e}")
         st.stop()
+    finally:
+        progress_bar.empty()
+    st.write("Inlästa kolumner:", data.columns.tolist())
+    for warning in warnings:
+        st.warning(warning)
+    st.success("Datan har konverterats framgångsrikt.")
+    # den inlästa datan beror på filen och på tidsformatet
+    data_hash = file_hash if time_format is None else f"{file_hash}:{time_format}"
 
     # Kontrollera datatyper innan analys
     st.write("Kolumner och datatyper efter konvertering:")
     st.write(data.dtypes)
 
-    # Knapp för att fortsätta till analys
+    # Knapp för att fortsätta till analys. Valet sparas så att analysen visas även när parametrarna ändras
+    if st.session_state.get("analysis_file") != data_hash:
+        st.session_state["analysis_file"] = None
     if st.button("Fortsätt till analys"):
+        st.session_state["analysis_file"] = data_hash
+
+    if st.session_state["analysis_file"] == data_hash:
         st.header("Steg 2: Generera analys och visualiseringar")
 
-        # Skapa LTVexploratory-objekt
+        # Skapa LTVexploratory-objekt (från cachen om filen och kolumnerna inte har ändrats)
         try:
-            ltv = LTVexploratory(
-                data_customers=data,
-                data_events=data,
-                uuid_col="UUID",
-                registration_time_col="timestamp_registration",
-                event_time_col="timestamp_event",
-                event_name_col="event_name",
-                value_col="purchase_value",
-            )
+            ltv = prepare_analysis(data_hash, columns, data)
             st.success("LTVexploratory har initierats framgångsrikt.")
         except KeyError as e:
             st.error(f"Ett fel uppstod vid hantering av kolumner: {e}")
@@ -95,10 +303,9 @@ if uploaded_file:
             st.stop()
 
         # Generera analys
-        st.subheader("Sammanfattning av data")
-        try:
-            ltv.summary()
-        except Exception as e:
-            st.error(f"Ett fel uppstod vid generering av sammanfattning: {e}")
+        analysis_section(ltv, data_hash, columns, "summary", "Sammanfattning av data", {})
+        revenue_pareto_section(ltv, data_hash, columns)
+        purchases_distribution_section(ltv, data_hash, columns)
+        ltv_impact_section(ltv, data_hash, columns)
 else:
-    st.info("Ladda upp en CSV-fil för att börja.")
+    st.info("Ladda upp en CSV-, CSV.GZ- eller Parquet-fil för att börja.")
@@ -0,0 +1,55 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Benchmark of the classification of customers into spending classes, comparing the previous
+per-customer classification with the vectorised one used by _group_users_by_spend.
+Run from the root of the repository with: python -m benchmarks.spend_classification [n_customers]
+"""
+import sys
+import time
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+from src.exploratory import LTVexploratory
+
+
+SPENDING_BREAKS = {"No spend": 0, "Low spend": 5, "Medium spend": 20, "High spend": 10000}
+
+
+def classify_per_customer(x: float, spending_breaks: Dict[str, float]) -> str:
+    # classification previously applied to each customer
+    key = np.argmax(x <= np.array(list(spending_breaks.values())))
+    return list(spending_breaks.keys())[key]
+
+
+def run(n_customers: int, seed: int = 42) -> Dict[str, float]:
+    rng = np.random.default_rng(seed)
+    revenue = pd.Series(
+        np.where(rng.random(n_customers) < 0.3, 0, rng.lognormal(2, 1.5, n_customers))
+    )
+
+    start = time.perf_counter()
+    expected = revenue.apply(lambda x: classify_per_customer(x, SPENDING_BREAKS))
+    per_customer = time.perf_counter() - start
+
+    start = time.perf_counter()
+    classes = LTVexploratory._classify_spend(revenue.to_numpy(), SPENDING_BREAKS)
+    vectorised = time.perf_counter() - start
+
+    assert (expected.to_numpy() == classes).all(), "The classes of the two methods differ"
+    return {
+        "customers": n_customers,
+        "per_customer_seconds": per_customer,
+        "vectorised_seconds": vectorised,
+        "speedup": per_customer / vectorised,
+    }
+
+
+if __name__ == "__main__":
+    n_customers = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    for name, value in run(n_customers).items():
+        print(f"{name}: {value:,.4f}" if isinstance(value, float) else f"{name}: {value:,d}")
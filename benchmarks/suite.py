@@ -0,0 +1,302 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Benchmark suite of the synthetic data generation and of all public methods of LTVexploratory.
+Run from the root of the repository:
+    python -m benchmarks.suite run --sizes 10000 100000 --output results.json
+    python -m benchmarks.suite compare baseline.json results.json --threshold 0.1
+Each size runs in a fresh process. The memory of a step is the peak of the resident memory during the step above
+the resident memory before it: on linux the high-water mark of the process is reset before each step, elsewhere
+the peak of the memory traced by tracemalloc (python objects and numpy arrays only) is used
+"""
+import argparse
+import copy
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+from src.exploratory import LTVexploratory  # noqa: E402
+from src.synth_data import LTVSyntheticData  # noqa: E402
+from src.synth_scenarios import IAPAppScenario  # noqa: E402
+
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+START_DATE = "2020-01-01"
+END_DATE = "2022-12-31"
+SPENDING_BREAKS = {"No spend": 0, "Low spend": 5, "Medium spend": 20, "High spend": 10000}
+COLUMNS = dict(
+    uuid_col="UUID",
+    registration_time_col="registration_date",
+    event_time_col="event_date",
+    event_name_col="event_name",
+    value_col="value",
+    segment_feature_cols=["country", "device"],
+)
+# segment feature of the by= steps
+BY = "country"
+# inputs of each analysis of LTVexploratory.ANALYSES (default: none)
+FLOW_INPUTS = dict(days_limit=60, early_limit=7)
+ANALYSIS_INPUTS = {
+    "plot_purchases_distribution": dict(days_limit=60),
+    "plot_revenue_pareto": dict(days_limit=60),
+    "plot_customers_histogram_per_conversion_day": dict(days_limit=60),
+    "plot_early_late_revenue_correlation": dict(days_limit=70),
+    "plot_paying_customers_flow": dict(**FLOW_INPUTS, spending_breaks={}, end_spending_breaks={}),
+    "estimate_ltv_impact": dict(**FLOW_INPUTS, spending_breaks=SPENDING_BREAKS, is_mobile=True),
+}
+# the events of the last days (and the customers registered in them) are added with append_customers and append_events
+APPEND_DAYS = 1
+# public methods of LTVexploratory that are not timed, as they only read or change settings
+NOT_BENCHMARKED = ["profile", "profiling", "save_trace", "revenue_matrix", "analysis_by_segment"]
+
+
+def _proc_status_mb(field: str) -> float:
+    """
+    Value of a memory [field] of /proc/self/status (e.g. VmRSS), in MB
+    """
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 2**10
+    raise KeyError(field)
+
+
+def _reset_peak_rss() -> bool:
+    """
+    Resets the high-water mark of the resident memory of this process to its current value. Only linux supports it,
+    returns whether it was reset
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def time_step(
+    n_users: int, step: str, rows: int, function: Callable[[], object]
+) -> Tuple[object, Dict[str, object]]:
+    """
+    Runs a step of the benchmark and returns its output and its measurements. [rows] is the number of
+    input rows processed by the step, used to calculate the throughput. [memory_mb] is the peak memory of the step
+    above the memory before it, and [peak_rss_mb] the peak resident memory during the step (None if not on linux)
+    """
+    rss = _reset_peak_rss()
+    if rss:
+        start_memory = _proc_status_mb("VmRSS")
+    else:
+        tracemalloc.start()
+        start_memory = tracemalloc.get_traced_memory()[0] / 2**20
+    start = time.perf_counter()
+    output = function()
+    seconds = time.perf_counter() - start
+    if rss:
+        peak = _proc_status_mb("VmHWM")
+    else:
+        peak = tracemalloc.get_traced_memory()[1] / 2**20
+        tracemalloc.stop()
+    plt.close("all")
+    return output, {
+        "n_users": n_users,
+        "step": step,
+        "seconds": seconds,
+        "rows": rows,
+        "rows_per_second": rows / seconds if seconds > 0 else None,
+        "memory_mb": peak - start_memory,
+        "peak_rss_mb": peak if rss else None,
+    }
+
+
+def benchmark_size(n_users: int, random_seed: int = 42) -> List[Dict[str, object]]:
+    """
+    Generates a synthetic dataset of [n_users] customers and times every step on it: the data generation, each
+    public method of LTVexploratory (each analysis of ANALYSES, also by segment, and the other methods) and
+    run_all with and without result cache
+    """
+    records = []
+
+    def step(name: str, rows: int, function: Callable[[], object]) -> object:
+        output, record = time_step(n_users, name, rows, function)
+        records.append(record)
+        print(f"{n_users:>12,d} {name:<60} {record['seconds']:>10.3f}s {record['memory_mb']:>10.0f}MB")
+        return output
+
+    synthetic_data = LTVSyntheticData(
+        n_users=n_users,
+        start_date=START_DATE,
+        end_date=END_DATE,
+        synthetic_scenario=IAPAppScenario(n_users, START_DATE, END_DATE, random_seed),
+        event_sampling="direct",
+    )
+    customers = step("get_customers_data", n_users, synthetic_data.get_customers_data)
+    events = step("get_events_data", n_users, synthetic_data.get_events_data)
+    n_events = len(events)
+
+    # the instance is created without the last days, which are then appended
+    cutoff = pd.Timestamp(END_DATE) - pd.Timedelta(days=APPEND_DAYS - 1)
+    new_customers = customers[COLUMNS["registration_time_col"]] >= cutoff
+    new_events = events[COLUMNS["event_time_col"]] >= cutoff
+    ltv = step(
+        "LTVexploratory",
+        int((~new_events).sum()),
+        lambda: LTVexploratory(customers[~new_customers], events[~new_events], **COLUMNS, rounding_precision=2),
+    )
+    step("append_customers", int(new_customers.sum()), lambda: ltv.append_customers(customers[new_customers]))
+    step("append_events", int(new_events.sum()), lambda: ltv.append_events(events[new_events]))
+    step("cohort_cube", n_events, lambda: ltv.cohort_cube)
+    step(f"segment_cube({BY})", n_events, lambda: ltv.segment_cube(BY))
+
+    for name in LTVexploratory.ANALYSES:
+        inputs = ANALYSIS_INPUTS.get(name, {})
+        step(name, n_events, lambda: getattr(ltv, name)(**copy.deepcopy(inputs)))
+    for name in LTVexploratory.ANALYSES:
+        inputs = ANALYSIS_INPUTS.get(name, {})
+        step(f"{name}(by={BY})", n_events, lambda: getattr(ltv, name)(**copy.deepcopy(inputs), by=BY))
+    step(
+        "sweep_ltv_impact",
+        n_events,
+        lambda: ltv.sweep_ltv_impact([30, 60, 90], [3, 7, 14], [{}, SPENDING_BREAKS], True),
+    )
+    step(
+        "estimate_ltv_impact_ci",
+        n_events,
+        lambda: ltv.estimate_ltv_impact_ci(
+            **FLOW_INPUTS, spending_breaks=SPENDING_BREAKS, is_mobile=True
+        ),
+    )
+    config = {name: ANALYSIS_INPUTS.get(name, {}) for name in LTVexploratory.ANALYSES}
+    step("run_all", n_events, lambda: ltv.run_all(copy.deepcopy(config)))
+
+    with tempfile.TemporaryDirectory() as path:
+        step("set_result_cache", 0, lambda: ltv.set_result_cache(os.path.join(path, "cache")))
+        step("run_all(result cache, cold)", n_events, lambda: ltv.run_all(copy.deepcopy(config)))
+        step("run_all(result cache, warm)", n_events, lambda: ltv.run_all(copy.deepcopy(config)))
+        ltv.set_result_cache(None)
+        step("save_state", n_events, lambda: ltv.save_state(os.path.join(path, "state")))
+        step("load_state", n_events, lambda: LTVexploratory.load_state(os.path.join(path, "state")))
+        step(
+            "download_data",
+            n_events,
+            lambda: ltv.download_data(events, path=path, overwrite=True),
+        )
+
+    timed = {record["step"].split("(")[0] for record in records}
+    missing = [
+        name for name in dir(LTVexploratory)
+        if not name.startswith("_") and name not in timed and name not in NOT_BENCHMARKED and name.islower()
+    ]
+    if len(missing) > 0:
+        print(f"Warning: the public methods {missing} are not benchmarked")
+    return records
+
+
+def run(sizes: List[int], output: str, random_seed: int = 42) -> Dict[str, object]:
+    """
+    Runs the benchmark for each of the sizes and writes the results to [output] (json)
+    """
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for n_users in sizes:
+        with context.Pool(1) as pool:
+            results += pool.apply(benchmark_size, (n_users, random_seed))
+    report = {
+        "environment": {
+            "created": pd.Timestamp.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "random_seed": random_seed,
+        },
+        "results": results,
+    }
+    with open(output, "w") as file:
+        json.dump(report, file, indent=2)
+    return report
+
+
+def compare(
+    baseline: str, candidate: str, threshold: float = 0.1, min_seconds: float = 0.05, min_mb: float = 10
+) -> pd.DataFrame:
+    """
+    Compares two results files, step by step. A step is flagged as a regression when its wall time
+    or its memory in [candidate] is more than [threshold] (relative) above [baseline]. Differences
+    of wall time below [min_seconds] and of memory below [min_mb] are considered noise
+    """
+    frames = []
+    for path in [baseline, candidate]:
+        with open(path) as file:
+            frames.append(pd.DataFrame(json.load(file)["results"]))
+    data = pd.merge(
+        frames[0], frames[1], on=["n_users", "step"], suffixes=("_baseline", "_candidate")
+    )
+    data["time_ratio"] = data["seconds_candidate"] / data["seconds_baseline"]
+    data["memory_ratio"] = data["memory_mb_candidate"] / data["memory_mb_baseline"]
+    slower = (data["time_ratio"] > 1 + threshold) & (
+        data["seconds_candidate"] - data["seconds_baseline"] > min_seconds
+    )
+    larger = (data["memory_ratio"] > 1 + threshold) & (
+        data["memory_mb_candidate"] - data["memory_mb_baseline"] > min_mb
+    )
+    data["regression"] = slower | larger
+    return data[
+        [
+            "n_users",
+            "step",
+            "seconds_baseline",
+            "seconds_candidate",
+            "time_ratio",
+            "memory_mb_baseline",
+            "memory_mb_candidate",
+            "memory_ratio",
+            "regression",
+        ]
+    ]
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="run the benchmark and write a results file")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--random-seed", type=int, default=42)
+    compare_parser = commands.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    compare_parser.add_argument("--min-seconds", type=float, default=0.05)
+    compare_parser.add_argument("--min-mb", type=float, default=10)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        run(args.sizes, args.output, args.random_seed)
+        return 0
+    data = compare(args.baseline, args.candidate, args.threshold, args.min_seconds, args.min_mb)
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(data.round(3).to_string(index=False))
+    regressions = data[data["regression"]]
+    print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
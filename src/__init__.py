@@ -2,5 +2,7 @@
 
 # This source code is licensed under the BSD-style license found in the
 # LICENSE file in the root directory of this source tree.
+from src.cube import CohortCube  # noqa: F401
 from src.exploratory import LTVexploratory  # noqa: F401
 from src.synth_data import LTVSyntheticData  # noqa: F401
+from src.writers import write_synthetic_data  # noqa: F401
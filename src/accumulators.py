@@ -0,0 +1,58 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Module providing mergeable accumulators to calculate statistics over data streamed in chunks"""
+import numpy as np
+
+
+class CorrelationAccumulator:
+    """
+    Accumulates the mean and the centered Gram matrix (sum of outer products of deviations from the mean)
+    of a set of columns, receiving the rows in chunks. Only O(columns^2) memory is used, independently of
+    the number of rows. Chunks are merged with the pairwise update of Chan et al., which is numerically
+    stable even when the values are large compared to their variance.
+    """
+
+    def __init__(self, n_columns: int) -> None:
+        self.count = 0
+        self.mean = np.zeros(n_columns)
+        self.gram = np.zeros((n_columns, n_columns))
+
+    def update(self, rows: np.ndarray) -> "CorrelationAccumulator":
+        """
+        Adds a chunk of rows (2d-array with one column per variable) to the accumulator
+        """
+        chunk = CorrelationAccumulator(rows.shape[1])
+        chunk.count = rows.shape[0]
+        if chunk.count > 0:
+            chunk.mean = rows.mean(axis=0)
+            centered = rows - chunk.mean
+            chunk.gram = centered.T @ centered
+        return self.merge(chunk)
+
+    def merge(self, other: "CorrelationAccumulator") -> "CorrelationAccumulator":
+        """
+        Combines the statistics of another accumulator into this one
+        """
+        count = self.count + other.count
+        if other.count == 0:
+            return self
+        delta = other.mean - self.mean
+        self.gram = (
+            self.gram
+            + other.gram
+            + np.outer(delta, delta) * (self.count * other.count / count)
+        )
+        self.mean = self.mean + delta * (other.count / count)
+        self.count = count
+        return self
+
+    def correlation(self) -> np.ndarray:
+        """
+        Pearson correlation matrix of the accumulated columns. Columns without variance get NaN
+        """
+        std = np.sqrt(np.diag(self.gram))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.gram / np.outer(std, std)
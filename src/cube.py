@@ -0,0 +1,237 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Module providing a pre-aggregated cube of the revenue of the cohorts of customers"""
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+from src.prepared import MISSING_DAYS, PreparedData
+
+
+class CohortCube:
+    """
+    Dense aggregates of the events by registration day x days since registration (dsi) x segment, where the segment
+    is the combination of the values of the segment features of the cube (if any). Only the segments with customers
+    are part of the cube, so its size grows with the segments that occur and not with all their combinations.
+    Each cell holds:
+        - revenue: sum of the revenue of the customers of the cell on that day since registration
+        - purchases: number of purchases
+        - first_purchases: number of customers whose first purchase was on that day since registration
+    and customers holds the number of customers of each registration day and segment.
+    Registration days are counted back from the last event of the data (the axis [ages] is the age of the customers,
+    in full days), so the customers that are at least N days old are exactly the cells with age >= N.
+    The size of the cube depends on the date range and the segments, but not on the number of events or customers,
+    so cohort level analyses on it take the same time for any volume of data
+    """
+
+    ARRAYS = ["revenue", "purchases", "first_purchases", "customers", "ages", "days", "segment_codes"]
+
+    def __init__(
+        self,
+        revenue: np.ndarray,
+        purchases: np.ndarray,
+        first_purchases: np.ndarray,
+        customers: np.ndarray,
+        ages: np.ndarray,
+        days: np.ndarray,
+        segment_codes: np.ndarray,
+        end_events_date: pd.Timestamp,
+        segment_cols: List[str],
+        segment_categories: Dict[str, List[object]],
+    ) -> None:
+        self.revenue = revenue
+        self.purchases = purchases
+        self.first_purchases = first_purchases
+        self.customers = customers
+        self.ages = ages
+        self.days = days
+        # code of each segment, combining the codes of its value of each segment feature (missing values are the last code)
+        self.segment_codes = segment_codes
+        self.end_events_date = end_events_date
+        self.segment_cols = segment_cols
+        self.segment_categories = segment_categories
+
+    @property
+    def shape(self) -> tuple:
+        return self.revenue.shape
+
+    @property
+    def registration_days(self) -> pd.DatetimeIndex:
+        """
+        Latest registration time of the customers of each registration day (i.e. of each age)
+        """
+        return self.end_events_date - pd.to_timedelta(self.ages, unit="D")
+
+    @property
+    def segments(self) -> pd.DataFrame:
+        """
+        Values of the segment features of each segment, in the order of the last axis of the cube.
+        Missing values are None
+        """
+        codes = np.asarray(self.segment_codes, dtype=np.int64)
+        values = {}
+        for col in reversed(self.segment_cols):
+            categories = list(self.segment_categories[col]) + [None]
+            values[col] = [categories[code] for code in codes % len(categories)]
+            codes = codes // len(categories)
+        return pd.DataFrame({col: values[col] for col in self.segment_cols}, index=range(len(self.segment_codes)))
+
+    @classmethod
+    def from_prepared(cls, prepared: PreparedData, segment_cols: List[str] = None) -> "CohortCube":
+        """
+        Builds the cube from the prepared data, reading each entry of the revenue matrix once.
+        Customers without registration time are not part of any cohort and are left out
+        Inputs
+            - prepared: prepared data of the analyses
+            - segment_cols: segment features of the cube (none by default, i.e. a single segment with all customers)
+        """
+        segment_cols = [] if segment_cols is None else list(segment_cols)
+        matrix = prepared.matrix
+        age = matrix.customer_age
+        valid = age != MISSING_DAYS
+
+        # combined code of the segment of each customer (missing values are the last code of each feature)
+        code = np.zeros(matrix.n_customers, dtype=np.int64)
+        for col in segment_cols:
+            categorical = prepared.segments[col]
+            n_codes = len(categorical.categories) + 1
+            code = code * n_codes + np.where(categorical.codes < 0, n_codes - 1, categorical.codes)
+        # only the segments of the customers in the cohorts get a position in the last axis
+        segment_codes, positions = np.unique(code[valid], return_inverse=True)
+        if len(segment_cols) == 0:
+            segment_codes = np.zeros(1, dtype=np.int64)
+        segment = np.zeros(matrix.n_customers, dtype=np.int64)
+        segment[valid] = positions.reshape(-1)
+        n_segments = len(segment_codes)
+
+        entries = valid[matrix.rows]
+        if valid.any():
+            ages = np.arange(age[valid].min(), age[valid].max() + 1)
+        else:
+            ages = np.zeros(0, dtype=np.int64)
+        if entries.any():
+            days = np.arange(matrix.days[entries].min(), matrix.days[entries].max() + 1)
+        else:
+            days = np.zeros(0, dtype=np.int64)
+        shape = (len(ages), len(days), n_segments)
+
+        # cell of each entry of the matrix and of the first purchase of each customer
+        rows = matrix.rows[entries]
+        cells = np.ravel_multi_index(
+            (age[rows] - ages[:1].sum(), matrix.days[entries] - days[:1].sum(), segment[rows]), shape
+        ) if len(rows) > 0 else np.zeros(0, dtype=np.int64)
+        first_day = matrix.first_day(matrix.purchases)
+        converted = np.flatnonzero(valid & (first_day != np.iinfo(np.int32).max))
+        first_cells = np.ravel_multi_index(
+            (age[converted] - ages[:1].sum(), first_day[converted] - days[:1].sum(), segment[converted]), shape
+        ) if len(converted) > 0 else np.zeros(0, dtype=np.int64)
+        customer_cells = (age[valid] - ages[:1].sum()) * n_segments + segment[valid]
+
+        size = int(np.prod(shape))
+        return cls(
+            revenue=np.bincount(cells, weights=matrix.revenue[entries], minlength=size).reshape(shape),
+            purchases=np.bincount(cells, weights=matrix.purchases[entries], minlength=size).astype(np.int64).reshape(shape),
+            first_purchases=np.bincount(first_cells, minlength=size).reshape(shape),
+            customers=np.bincount(customer_cells, minlength=len(ages) * n_segments).reshape(len(ages), n_segments),
+            ages=ages,
+            days=days,
+            segment_codes=segment_codes,
+            end_events_date=prepared.end_events_date,
+            segment_cols=segment_cols,
+            segment_categories={
+                col: prepared.segments[col].categories.tolist() for col in segment_cols
+            },
+        )
+
+    def _cohort(self, days_limit: int) -> slice:
+        """
+        Registration days (first axis) of the customers that are at least [days_limit] days old
+        """
+        return slice(int(np.searchsorted(self.ages, days_limit)), None)
+
+    def first_purchase_counts(self, days_limit: int, cohort_days: int = None) -> pd.Series:
+        """
+        Number of customers by the day since registration of their first purchase, until [days_limit].
+        Only days with first purchases are included
+        Inputs
+            days_limit: last day since registration to be included
+            cohort_days: minimum age of the customers to be included (default: days_limit)
+        """
+        cohort_days = days_limit if cohort_days is None else cohort_days
+        days = self.days <= days_limit
+        counts = self.first_purchases[self._cohort(cohort_days), days].sum(axis=(0, 2))
+        nonzero = np.flatnonzero(counts)
+        return pd.Series(counts[nonzero], index=pd.Index(self.days[days][nonzero], name="dsi"))
+
+    def cohort_curve(self, days_limit: int, by_segment: bool = False) -> pd.DataFrame:
+        """
+        Revenue, purchases and first purchases of the customers at least [days_limit] days old on each day since
+        registration until [days_limit], with the cumulative revenue per customer and the cumulative share of
+        customers that purchased. With [by_segment], there is one curve per segment
+        """
+        cohort = self._cohort(days_limit)
+        day_range = (self.days >= 0) & (self.days <= days_limit)
+        data = {
+            "revenue": self.revenue[cohort, day_range].sum(axis=0),
+            "purchases": self.purchases[cohort, day_range].sum(axis=0),
+            "first_purchases": self.first_purchases[cohort, day_range].sum(axis=0),
+        }
+        customers = self.customers[cohort].sum(axis=0)
+        if by_segment:
+            segments = self.segments
+        else:
+            data = {name: values.sum(axis=1, keepdims=True) for name, values in data.items()}
+            customers = customers.sum(keepdims=True)
+            segments = pd.DataFrame(index=[0])
+        curves = []
+        for i in range(len(customers)):
+            curve = pd.DataFrame(
+                {
+                    **{col: segments[col].iloc[i] for col in segments},
+                    "dsi": self.days[day_range],
+                    **{name: values[:, i] for name, values in data.items()},
+                    "customers": customers[i],
+                }
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                curve["cumulative_revenue_per_customer"] = curve["revenue"].cumsum() / customers[i]
+                curve["cumulative_conversion"] = curve["first_purchases"].cumsum() / customers[i]
+            curves.append(curve)
+        if len(curves) == 0:
+            return pd.DataFrame(columns=list(segments) + ["dsi", *data, "customers"])
+        return pd.concat(curves, ignore_index=True)
+
+    def save(self, path: str) -> None:
+        """
+        Writes the cube to the directory [path], each array in its own .npy file and the remaining information in a
+        json file, which can be read with CohortCube.load without the data it was built from
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(path, f"{name}.npy"), getattr(self, name))
+        meta = {
+            "end_events_date": self.end_events_date.isoformat(),
+            "segment_cols": self.segment_cols,
+            "segment_categories": self.segment_categories,
+        }
+        with open(os.path.join(path, "meta.json"), "w") as file:
+            json.dump(meta, file, default=str)
+
+    @classmethod
+    def load(cls, path: str) -> "CohortCube":
+        """
+        Reads a cube written by save. As for PreparedData.load, the arrays are memory-mapped and not read
+        """
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file)
+        return cls(
+            **{name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r").view(np.ndarray) for name in cls.ARRAYS},
+            end_events_date=pd.Timestamp(meta["end_events_date"]),
+            segment_cols=meta["segment_cols"],
+            segment_categories=meta["segment_categories"],
+        )
@@ -2,12 +2,69 @@
 
 # This source code is licensed under the BSD-style license found in the
 # LICENSE file in the root directory of this source tree.
-from typing import Dict
+from typing import Callable, Dict
 import pandas as pd
 import numpy as np
 from scipy.stats import logistic
 
 
+class CategoricalFeature():
+    """
+    Maps each category of a feature to its contribution, e.g. CategoricalFeature({'ios': 0.5}, default=0).
+    It is evaluated as a lookup table indexed by the codes of the categories, instead of once per row
+    """
+
+    def __init__(self, mapping: Dict[object, float], default: float = 0) -> None:
+        self.mapping = mapping
+        self.default = default
+
+    def __call__(self, x: object) -> float:
+        return self.mapping.get(x, self.default)
+
+    def evaluate(self, values: np.ndarray) -> np.ndarray:
+        return _evaluate_by_category(self, values)
+
+
+class NumericFeature():
+    """
+    Maps a numeric feature to its contribution with a function that operates on whole arrays, e.g. NumericFeature(np.log)
+    """
+
+    def __init__(self, function: Callable[[np.ndarray], np.ndarray] = None) -> None:
+        self.function = function
+
+    def __call__(self, x: float) -> float:
+        return x if self.function is None else self.function(x)
+
+    def evaluate(self, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        return values if self.function is None else self.function(values)
+
+
+def _evaluate_by_category(function: Callable[[object], float], values: np.ndarray) -> np.ndarray:
+    """
+    Evaluates a function once per distinct value and looks up the result of each row by the code of its value
+    """
+    codes, categories = pd.factorize(values, use_na_sentinel=False)
+    table = np.array([function(category) for category in categories], dtype=np.float64)
+    return table[codes]
+
+
+def compile_features_map(features_map: Dict[str, object]) -> Dict[str, Callable[[np.ndarray], np.ndarray]]:
+    """
+    Turns each function of a features map into a function of whole arrays (kernel). CategoricalFeature and NumericFeature
+    provide their own kernel. Any other function is assumed to depend only on the value, so it is evaluated once per distinct
+    value, as for CategoricalFeature
+    """
+    kernels = {}
+    for feature, function in features_map.items():
+        if isinstance(function, (CategoricalFeature, NumericFeature)):
+            kernels[feature] = function.evaluate
+        else:
+            kernels[feature] = lambda values, function=function: _evaluate_by_category(function, values)
+    return kernels
+
+
 class EventGenerator():
     """
     This class takes as unique input a map that indicates the relevance of a feature
@@ -33,11 +90,22 @@ class EventGenerator():
         - seed: defines the random-seed for pseudo-random number generator, which is used to generate the samples
         """
         self.features_map = features_map
+        self.kernels = compile_features_map(features_map)
         self.scale = scale if scale is not None else 1
         self.baseline = baseline
         self.rng = seed if isinstance(
             seed, np.random.Generator) else np.random.default_rng(seed)
 
+    def __getstate__(self) -> Dict[str, object]:
+        # kernels may be lambdas, which can not be pickled (e.g. to send the generator to another process)
+        state = self.__dict__.copy()
+        del state['kernels']
+        return state
+
+    def __setstate__(self, state: Dict[str, object]) -> None:
+        self.__dict__.update(state)
+        self.kernels = compile_features_map(self.features_map)
+
     def _sample_from_distribution(
             self,
             locs: np.ndarray,
@@ -47,6 +115,16 @@ class EventGenerator():
         """
         raise NotImplementedError
 
+    def get_locs(self, data: pd.DataFrame) -> pd.Series:
+        """
+        Sum of the contributions of all features, plus the baseline, for each row of the dataframe. Features are evaluated
+        with the compiled kernels, over whole columns. Missing contributions count as 0
+        """
+        contributions = np.zeros((len(self.kernels), len(data)))
+        for i, (feature, kernel) in enumerate(self.kernels.items()):
+            contributions[i] = kernel(data[feature].to_numpy())
+        return pd.Series(np.nansum(contributions, axis=0), index=data.index) + self.baseline
+
     def generate_events(self, data: pd.DataFrame, scale: float = None):
         """
         Applies the mapping of features->value for each row in the dataframe and sum all contributions together.
@@ -57,7 +135,7 @@ class EventGenerator():
             - scale: a float, pd.Series or np.ndarray which tweaks the distribution in consideration. For Binomial distributions.
                     it defines the number of samples per user. For log-normal distribution, it sets the variance of the final distribution
         """
-        locs = data.apply(self.features_map).sum(axis=1) + self.baseline
+        locs = self.get_locs(data)
         scale = scale if scale is not None else self.scale
         return self._sample_from_distribution(locs, scale)
 
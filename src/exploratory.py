@@ -4,15 +4,20 @@
 # LICENSE file in the root directory of this source tree.
 
 """Module providing a class for initial analysis"""
+import copy
+import json
 import math
 import os
+import shutil
 from itertools import product
-from typing import Dict, List
+from typing import Dict, Iterable, List, Tuple, Union
 
 import matplotlib.pyplot as plt
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
 import seaborn as sns
 from pandas.api.types import (
     is_any_real_numeric_dtype,
@@ -20,7 +25,17 @@ from pandas.api.types import (
     is_dtype_equal,
     is_object_dtype,
 )
-from src.graph import Graph, InteractiveChart
+from src.cube import CohortCube
+from src.graph import Graph, InteractiveChart, save_plot
+from src.parallel import run_parallel
+from src.prepared import BYTES_PER_EVENT, DatasetStats, PreparedData, RevenueMatrix
+from src.profiling import Profiler, profiled
+from src.result_cache import ResultCache, cached, result_key
+from src.readers import (
+    read_customers_dataset,
+    read_event_files,
+    scan_events_dataset,
+)
 
 
 sns.set_style("whitegrid")
@@ -29,10 +44,39 @@ sns.set_style("whitegrid")
 class LTVexploratory:
     """This class helps to perform som initial analysis"""
 
+    # data and render steps of each analysis, see run_all
+    ANALYSES = {
+        "summary": ("_summary_data", "_render_summary"),
+        "plot_customers_intersection": (
+            "_customers_intersection_data",
+            "_render_customers_intersection",
+        ),
+        "plot_purchases_distribution": (
+            "_purchases_distribution_data",
+            "_render_purchases_distribution",
+        ),
+        "plot_revenue_pareto": ("_revenue_pareto_data", "_render_revenue_pareto"),
+        "plot_customers_histogram_per_conversion_day": (
+            "_customers_histogram_data",
+            "_render_customers_histogram",
+        ),
+        "plot_early_late_revenue_correlation": (
+            "_revenue_correlation_data",
+            "_render_revenue_correlation",
+        ),
+        "plot_paying_customers_flow": (
+            "_group_users_by_spend",
+            "_render_paying_customers_flow",
+        ),
+        "estimate_ltv_impact": ("_ltv_impact_data", "_render_ltv_impact"),
+    }
+    # number of segments from which analysis_by_segment runs in worker processes by default
+    MIN_PARALLEL_SEGMENTS = 8
+
     def __init__(
         self,
         data_customers: pd.DataFrame,
-        data_events: pd.DataFrame,
+        data_events: Union[pd.DataFrame, Iterable[Union[pd.DataFrame, pa.RecordBatch]]],
         uuid_col: str = "UUID",
         registration_time_col: str = "timestamp_registration",
         event_time_col: str = "timestamp_event",
@@ -40,9 +84,55 @@ class LTVexploratory:
         value_col: str = "purchase_value",
         segment_feature_cols: List[str] = None,
         rounding_precision: int = 5,
+        memory_budget_mb: int = 1024,
+        profiling: bool = False,
     ):
+        """
+        Inputs
+            - data_customers: dataframe with one row per customer and their registration time
+            - data_events: dataframe with the events of the customers, or an iterable of dataframes or arrow record batches (chunks) with the same columns.
+                Chunks are processed one at a time and never held in memory together, so the events data can be bigger than the memory
+            - memory_budget_mb: approximate memory (in MB) used to process events data, independently of the size of the data
+            - profiling: whether to record the time and memory of each stage of the analyses, see the profile property
+        """
         self.data_customers = data_customers
-        self.data_events = data_events
+        # events passed in chunks are consumed when preparing the data and not kept
+        self.data_events = data_events if isinstance(data_events, pd.DataFrame) else None
+        self._event_chunks = None if self.data_events is not None else data_events
+        self._configure(
+            uuid_col=uuid_col,
+            registration_time_col=registration_time_col,
+            event_time_col=event_time_col,
+            event_name_col=event_name_col,
+            value_col=value_col,
+            segment_feature_cols=segment_feature_cols,
+            rounding_precision=rounding_precision,
+            memory_budget_mb=memory_budget_mb,
+            profiling=profiling,
+        )
+        # run auxiliar methods
+        rows_in = len(self.data_events) if self.data_events is not None else None
+        with self.profiler.stage("__init__", rows_in=rows_in) as stage:
+            self._validate_datasets()
+            self._prep_df()
+            stage.rows_out = len(self.prepared.matrix.days)
+
+    def _configure(
+        self,
+        uuid_col: str,
+        registration_time_col: str,
+        event_time_col: str,
+        event_name_col: str,
+        value_col: str,
+        segment_feature_cols: List[str],
+        rounding_precision: int,
+        memory_budget_mb: int,
+        profiling: bool = False,
+        result_cache: ResultCache = None,
+    ) -> None:
+        self.profiler = Profiler(enabled=profiling)
+        self.result_cache = result_cache
+        self.memory_budget_mb = memory_budget_mb
         self._period = 7
         self._period_for_ltv = 7 * 10
         self.graph = Graph()
@@ -58,10 +148,253 @@ class LTVexploratory:
         self.segment_feature_cols = (
             [] if segment_feature_cols is None else segment_feature_cols
         )
-        # run auxiliar methods
-        self._validate_datasets()
-        self._prep_df()
 
+    def _settings(self) -> Dict[str, object]:
+        """
+        Inputs of the instance other than the data, used to rebuild it in other processes
+        """
+        return dict(
+            uuid_col=self.uuid_col,
+            registration_time_col=self.registration_time_col,
+            event_time_col=self.event_time_col,
+            event_name_col=self.event_name_col,
+            value_col=self.value_col,
+            segment_feature_cols=self.segment_feature_cols,
+            rounding_precision=self.rounding_precision,
+            memory_budget_mb=self.memory_budget_mb,
+            profiling=self.profiler.enabled,
+            result_cache=self.result_cache,
+        )
+
+    @classmethod
+    def _from_prepared(cls, prepared: PreparedData, **settings) -> "LTVexploratory":
+        """
+        Creates an instance over already prepared (and validated) data, without the input dataframes
+        """
+        ltv = cls.__new__(cls)
+        ltv.data_customers = None
+        ltv.data_events = None
+        ltv._event_chunks = None
+        ltv._configure(**settings)
+        ltv.prepared = prepared
+        return ltv
+
+    def set_result_cache(self, path: str = None, max_size_mb: float = 1024) -> None:
+        """
+        Stores the data of the analyses (the dataframes of the plot methods, analysis_by_segment and run_all) as parquet
+        files in the directory [path], keyed by a hash of the prepared data, the analysis and its inputs. Repeated calls,
+        also from other instances or processes over the same data, read the data instead of calculating it again.
+        The least recently used files are deleted when they take more than [max_size_mb] MB. With path=None, the cache
+        is not used anymore
+        """
+        self.result_cache = None if path is None else ResultCache(path, max_size_mb)
+
+    @profiled
+    def save_state(self, path: str, overwrite: bool = False) -> None:
+        """
+        Writes the prepared data (and the cohort cube, if it was built) to the directory [path] in a binary columnar
+        format, so that the analysis can be reopened with load_state without reading and preparing the input data again.
+        Raises a ValueError if [path] is not empty, unless [overwrite] is True
+        """
+        if os.path.exists(path) and len(os.listdir(path)) > 0:
+            if not overwrite:
+                raise ValueError(f"{path} is not empty. Use overwrite=True to replace it")
+            shutil.rmtree(path)
+        self.prepared.save(path)
+        settings = self._settings()
+        # the result cache is a setting of the session, not of the data
+        settings.pop("result_cache")
+        with open(os.path.join(path, "settings.json"), "w") as file:
+            json.dump(settings, file)
+        if getattr(self, "_cohort_cube", None) is not None:
+            self._cohort_cube.save(os.path.join(path, "cohort_cube"))
+
+    @classmethod
+    def load_state(cls, path: str, profiling: bool = None) -> "LTVexploratory":
+        """
+        Opens an analysis saved with save_state. The arrays of the prepared data are memory-mapped, so opening it takes a
+        time independent of the size of the data and processes that open the same files share them in memory.
+        The input dataframes are not saved, so the new instance only has the prepared data. New data can still be added
+        with append_customers and append_events
+        Inputs
+            - path: directory written by save_state
+            - profiling: whether to profile the analyses. If None, the setting of the saved instance is used
+        """
+        with open(os.path.join(path, "settings.json")) as file:
+            settings = json.load(file)
+        if profiling is not None:
+            settings["profiling"] = profiling
+        ltv = cls._from_prepared(PreparedData.load(path), **settings)
+        cube_path = os.path.join(path, "cohort_cube")
+        if os.path.exists(cube_path):
+            ltv._cohort_cube = CohortCube.load(cube_path)
+        return ltv
+
+    @classmethod
+    def from_single_table(
+        cls,
+        data: pd.DataFrame,
+        uuid_col: str = "UUID",
+        registration_time_col: str = "timestamp_registration",
+        event_time_col: str = "timestamp_event",
+        event_name_col: str = "event_name",
+        value_col: str = "purchase_value",
+        segment_feature_cols: List[str] = None,
+        rounding_precision: int = 5,
+        memory_budget_mb: int = 1024,
+        profiling: bool = False,
+    ) -> "LTVexploratory":
+        """
+        Creates an instance from a single table with one row per event, which also has the registration time (and
+        segment features) of the customer of each event. The customers data is derived in one pass, keeping the first
+        row of each customer, so the table is never joined with itself and memory and time are linear in the number of events.
+        As for events passed in chunks, the events are not kept (data_events is None)
+        Inputs
+            - data: dataframe with the columns of both the customers and the events data
+            - the remaining inputs are the same as for the constructor
+        """
+        segment_feature_cols = (
+            [] if segment_feature_cols is None else segment_feature_cols
+        )
+        data_customers = data.loc[
+            data[uuid_col].notna(), [uuid_col, registration_time_col] + segment_feature_cols
+        ].drop_duplicates(subset=uuid_col)
+        # the events are passed as chunks of the columns of the events, so only one chunk at a time is copied
+        # and the instance keeps no events dataframe
+        chunk_rows = max(1, memory_budget_mb * 2**20 // BYTES_PER_EVENT)
+        event_chunks = (
+            data.iloc[start:start + chunk_rows][[uuid_col, event_time_col, event_name_col, value_col]]
+            for start in range(0, max(1, len(data)), chunk_rows)
+        )
+        return cls(
+            data_customers,
+            event_chunks,
+            uuid_col=uuid_col,
+            registration_time_col=registration_time_col,
+            event_time_col=event_time_col,
+            event_name_col=event_name_col,
+            value_col=value_col,
+            segment_feature_cols=segment_feature_cols,
+            rounding_precision=rounding_precision,
+            memory_budget_mb=memory_budget_mb,
+            profiling=profiling,
+        )
+
+    @classmethod
+    def from_files(
+        cls,
+        data_customers: pd.DataFrame,
+        events_path: str,
+        uuid_col: str = "UUID",
+        registration_time_col: str = "timestamp_registration",
+        event_time_col: str = "timestamp_event",
+        event_name_col: str = "event_name",
+        value_col: str = "purchase_value",
+        segment_feature_cols: List[str] = None,
+        rounding_precision: int = 5,
+        memory_budget_mb: int = 1024,
+    ) -> "LTVexploratory":
+        """
+        Creates an instance reading the events data from a parquet/csv file or a directory of them, one chunk
+        at a time, so that the events data can be bigger than the memory.
+        Inputs
+            - events_path: path to a file or directory (read recursively) of .parquet, .csv or .csv.gz files
+            - memory_budget_mb: approximate memory (in MB) used to read and process each chunk of events
+            - the remaining inputs are the same as for the constructor
+        """
+        return cls(
+            data_customers,
+            read_event_files(
+                events_path,
+                uuid_col=uuid_col,
+                event_time_col=event_time_col,
+                event_name_col=event_name_col,
+                value_col=value_col,
+                chunk_rows=max(1, memory_budget_mb * 2**20 // BYTES_PER_EVENT),
+            ),
+            uuid_col=uuid_col,
+            registration_time_col=registration_time_col,
+            event_time_col=event_time_col,
+            event_name_col=event_name_col,
+            value_col=value_col,
+            segment_feature_cols=segment_feature_cols,
+            rounding_precision=rounding_precision,
+            memory_budget_mb=memory_budget_mb,
+        )
+
+    @classmethod
+    def from_arrow_dataset(
+        cls,
+        customers_dataset: ds.Dataset,
+        events_dataset: ds.Dataset,
+        uuid_col: str = "UUID",
+        registration_time_col: str = "timestamp_registration",
+        event_time_col: str = "timestamp_event",
+        event_name_col: str = "event_name",
+        value_col: str = "purchase_value",
+        segment_feature_cols: List[str] = None,
+        rounding_precision: int = 5,
+        memory_budget_mb: int = 1024,
+        registration_date_range: Tuple[str, str] = None,
+        event_date_range: Tuple[str, str] = None,
+    ) -> "LTVexploratory":
+        """
+        Creates an instance from arrow datasets of customers and events data. Only the necessary columns are read
+        and the date filters are pushed down to the scans. Events are aggregated directly from the arrow record
+        batches, one batch at a time, without converting them to dataframes.
+        Inputs
+            - customers_dataset: arrow dataset with the customers data
+            - events_dataset: arrow dataset with the events data
+            - registration_date_range: (start, end) of the registration time of the customers to be read. Start is
+                inclusive, end is exclusive and any of them can be None
+            - event_date_range: (start, end) of the time of the events to be read, same as registration_date_range
+            - the remaining inputs are the same as for the constructor
+        """
+        segment_feature_cols = (
+            [] if segment_feature_cols is None else segment_feature_cols
+        )
+        return cls(
+            read_customers_dataset(
+                customers_dataset,
+                uuid_col=uuid_col,
+                registration_time_col=registration_time_col,
+                segment_feature_cols=segment_feature_cols,
+                date_range=registration_date_range,
+            ),
+            scan_events_dataset(
+                events_dataset,
+                uuid_col=uuid_col,
+                event_time_col=event_time_col,
+                event_name_col=event_name_col,
+                value_col=value_col,
+                chunk_rows=max(1, memory_budget_mb * 2**20 // BYTES_PER_EVENT),
+                date_range=event_date_range,
+            ),
+            uuid_col=uuid_col,
+            registration_time_col=registration_time_col,
+            event_time_col=event_time_col,
+            event_name_col=event_name_col,
+            value_col=value_col,
+            segment_feature_cols=segment_feature_cols,
+            rounding_precision=rounding_precision,
+            memory_budget_mb=memory_budget_mb,
+        )
+
+    @classmethod
+    def from_parquet(
+        cls, customers_path: str, events_path: str, **kwargs
+    ) -> "LTVexploratory":
+        """
+        Creates an instance from parquet files (or directories of them, hive partitioned or not) with the
+        customers and events data. See from_arrow_dataset for the other inputs
+        """
+        return cls.from_arrow_dataset(
+            ds.dataset(customers_path, format="parquet", partitioning="hive"),
+            ds.dataset(events_path, format="parquet", partitioning="hive"),
+            **kwargs,
+        )
+
+    @profiled
     def _validate_datasets(self) -> None:
         """
         This method perform the following checks for the input datasets:
@@ -83,145 +416,280 @@ class LTVexploratory:
         """
 
         # customers dataset checks
+        self._validate_customers(self.data_customers)
+
+        # events dataset checks. Chunks are checked while they are processed
+        if self.data_events is not None:
+            self._validate_events(self.data_events)
+
+    def _validate_customers(self, data_customers: pd.DataFrame) -> pd.DataFrame:
+        """
+        Checks a dataframe of customers data, as described in _validate_datasets
+        """
         assert isinstance(
-            self.data_customers[self.uuid_col].dtype, pd.StringDtype
+            data_customers[self.uuid_col].dtype, pd.StringDtype
         ) or is_object_dtype(
-            self.data_customers[self.uuid_col]
-        ), f"The column [{self.uuid_col}] referencing to the customer-id in the customers dataset was expected to be of data pd.StringDtype or object. But it is of type {self.data_customers[self.uuid_col].dtype}"
+            data_customers[self.uuid_col]
+        ), f"The column [{self.uuid_col}] referencing to the customer-id in the customers dataset was expected to be of data pd.StringDtype or object. But it is of type {data_customers[self.uuid_col].dtype}"
         assert is_datetime64_any_dtype(
-            self.data_customers[self.registration_time_col]
-        ), f"The column [{self.registration_time_col}] referencing to the registrationtime in the customers dataset was expected to be of type [datetime]. But it is of type {self.data_customers[self.registration_time_col].dtype}"
+            data_customers[self.registration_time_col]
+        ), f"The column [{self.registration_time_col}] referencing to the registrationtime in the customers dataset was expected to be of type [datetime]. But it is of type {data_customers[self.registration_time_col].dtype}"
+        return data_customers
 
-        # events dataset checks
+    def _validate_events(
+        self, data_events: Union[pd.DataFrame, pa.RecordBatch]
+    ) -> Union[pd.DataFrame, pa.RecordBatch]:
+        """
+        Checks a dataframe (or chunk) of events data, as described in _validate_datasets
+        """
+        if isinstance(data_events, pa.RecordBatch):
+            # only the types of the columns are checked, so an empty dataframe is enough
+            self._validate_events(
+                data_events.schema.empty_table().to_pandas(coerce_temporal_nanoseconds=True)
+            )
+            return data_events
         assert isinstance(
-            self.data_events[self.uuid_col].dtype, pd.StringDtype
+            data_events[self.uuid_col].dtype, pd.StringDtype
         ) or is_object_dtype(
-            self.data_events[self.uuid_col]
-        ), f"The column [{self.uuid_col}] referencing to the customer-id in the events dataset was expected to be of data pd.StringDtype or object. But it is of type {self.data_events[self.uuid_col].dtype}"
+            data_events[self.uuid_col]
+        ), f"The column [{self.uuid_col}] referencing to the customer-id in the events dataset was expected to be of data pd.StringDtype or object. But it is of type {data_events[self.uuid_col].dtype}"
         assert is_datetime64_any_dtype(
-            self.data_events[self.event_time_col]
-        ), f"The column [{self.event_time_col}] referencing to the time in the events dataset was expected to be of type [datetime]. But it is of type {self.data_events[self.event_time_col].dtype}"
+            data_events[self.event_time_col]
+        ), f"The column [{self.event_time_col}] referencing to the time in the events dataset was expected to be of type [datetime]. But it is of type {data_events[self.event_time_col].dtype}"
         assert is_any_real_numeric_dtype(
-            self.data_events[self.value_col]
-        ), f"The column [{self.value_col}] referencing value of a transaction in the events dataset was expected to be of numeric. But it is of type {self.data_events[self.value_col].dtype}"
+            data_events[self.value_col]
+        ), f"The column [{self.value_col}] referencing value of a transaction in the events dataset was expected to be of numeric. But it is of type {data_events[self.value_col].dtype}"
 
-        # consistency checks
+        # consistency checks (the customers data is not kept by instances created over prepared data)
+        if self.data_customers is None:
+            return data_events
         assert is_dtype_equal(
-            self.data_customers[self.uuid_col], self.data_events[self.uuid_col]
-        ), f"The customer-id columns of the two input datasets are not the same. In the customers dataset it is of type [{self.data_customers[self.uuid_col].dtype}], while in the events dataset it is of type [{self.data_customers[self.uuid_col].dtype}]"
+            self.data_customers[self.uuid_col], data_events[self.uuid_col]
+        ), f"The customer-id columns of the two input datasets are not the same. In the customers dataset it is of type [{self.data_customers[self.uuid_col].dtype}], while in the events dataset it is of type [{data_events[self.uuid_col].dtype}]"
         assert is_dtype_equal(
             self.data_customers[self.registration_time_col],
-            self.data_events[self.event_time_col],
-        ), f"The timestamp columns of the two input datasets are not the same. In the customers dataset it is of type [{self.data_customers[self.registration_time_col].dtype}], while in the events dataset it is of type [{self.data_customers[self.event_time_col].dtype}]"
+            data_events[self.event_time_col],
+        ), f"The timestamp columns of the two input datasets are not the same. In the customers dataset it is of type [{self.data_customers[self.registration_time_col].dtype}], while in the events dataset it is of type [{data_events[self.event_time_col].dtype}]"
+        return data_events
+
+    @profiled
+    def _prep_df(self) -> None:
+        # Build the columnar store used by all analyses. Customers are encoded as integers and events
+        # are reduced into revenue per customer and day since registration, which is equivalent to
+        # a left join of customers and events data, but without materialising it
+        columns = dict(
+            uuid_col=self.uuid_col,
+            registration_time_col=self.registration_time_col,
+            event_time_col=self.event_time_col,
+            event_name_col=self.event_name_col,
+            value_col=self.value_col,
+            segment_feature_cols=self.segment_feature_cols,
+            memory_budget=self.memory_budget_mb * 2**20,
+        )
+        if self.data_events is not None:
+            self.prepared = PreparedData.from_frames(
+                self.data_customers, self.data_events, **columns
+            )
+        else:
+            self.prepared = PreparedData.from_chunks(
+                self.data_customers,
+                (self._validate_events(chunk) for chunk in self._event_chunks),
+                **columns,
+            )
+            self._event_chunks = None
 
         # check the date range of the data, warn if it is too short
-        if (
-            self.data_customers[self.registration_time_col].max()
-            - self.data_customers[self.registration_time_col].min()
-        ).days < 90:
+        stats = self.prepared.stats
+        if (stats["registration_end"] - stats["registration_start"]).days < 90:
             print(
                 "Warning: The date range of the customers data is too short. The analysis may not be accurate and some plots may not be generated."
             )
-        if (
-            self.data_events[self.event_time_col].max()
-            - self.data_events[self.event_time_col].min()
-        ).days < 90:
+        if (stats["event_end"] - stats["event_start"]).days < 90:
             print(
                 "Warning: The date range of the events data is too short. The analysis may not be accurate and some plots may not be generated."
             )
 
-    def _prep_df(self) -> None:
-        # Left join customers and events data, so that you have a dataframe with all customers and their events (if no event, then timestamp is null)
-        # just select some columns to make it easier to understand what is the
-        # information that is used and avoid join complications caused by the
-        # name of other columns
-        self.joined_df = pd.merge(
-            self.data_customers,
-            self.data_events,
-            on=self.uuid_col,
-            how="left",
-            suffixes=["_registration", "_event"],
-        )[
-            [
-                self.uuid_col,
-                self.registration_time_col,
-                self.event_time_col,
-                self.event_name_col,
-                self.value_col,
-            ]
-            + self.segment_feature_cols
-        ]
+    @property
+    def profile(self) -> pd.DataFrame:
+        """
+        Wall time, CPU time, rows in/out and peak allocated memory (in MB) of each stage run while profiling was on.
+        Stages are the public methods and their internal steps; depth and parent show how they are nested
+        """
+        return self.profiler.table()
 
-        # Calculate how many days since install an event happend
-        self.joined_df["days_since_registration"] = self.joined_df.apply(
-            lambda row: (
-                row[self.event_time_col] - row[self.registration_time_col]
-            ).days,
-            axis=1,
+    def profiling(self):
+        """
+        Context manager that turns profiling on while it is open, e.g.
+            with ltv.profiling():
+                ltv.plot_revenue_pareto(60)
+            ltv.profile
+        """
+        return self.profiler.session()
+
+    def save_trace(self, path: str) -> None:
+        """
+        Writes the stages recorded while profiling to a json file in the Chrome Trace Event format, to be opened
+        in chrome://tracing or ui.perfetto.dev. Each stage is a span, nested in the stage that called it
+        """
+        self.profiler.save_chrome_trace(path)
+
+    def save_plot(self, fig, file_path: str, dpi: int = 200) -> None:
+        """
+        Saves a figure returned by the analyses to [file_path], measured as the stage 'save_plot' while profiling.
+        See graph.save_plot
+        """
+        save_plot(fig, file_path, dpi=dpi, profiler=self.profiler)
+
+    @property
+    def revenue_matrix(self) -> RevenueMatrix:
+        """
+        Revenue per customer per day since registration, shared by all analyses
+        """
+        return self.prepared.matrix
+
+    @profiled
+    def append_customers(self, data_customers: pd.DataFrame) -> int:
+        """
+        Adds new customers to the prepared data in place, e.g. the customers registered since the last refresh, so that
+        the analyses do not need to prepare all the data again. Customers that are already known are ignored. Events of
+        unknown customers are discarded, so new customers must be appended before their events, see append_events.
+        Returns the number of customers added
+        Inputs
+            - data_customers: dataframe with the same columns as the customers data of the instance
+        """
+        added = self.prepared.append_customers(
+            self._validate_customers(data_customers),
+            uuid_col=self.uuid_col,
+            registration_time_col=self.registration_time_col,
+            segment_feature_cols=self.segment_feature_cols,
         )
+        self._cohort_cube = None
+        return added
+
+    @profiled
+    def append_events(
+        self, data_events: Union[pd.DataFrame, Iterable[Union[pd.DataFrame, pa.RecordBatch]]]
+    ) -> int:
+        """
+        Adds new events to the prepared data in place, e.g. the events of the last day. Only the new events are processed:
+        they are aggregated and merged into the revenue per customer and day since registration, and the statistics of
+        summary are updated. The age of the customers is updated if the new events are later than the previous ones, so
+        the analyses include the customers that became old enough. Returns the number of events added
+        Inputs
+            - data_events: dataframe with the same columns as the events data of the instance, or an iterable of dataframes
+                or arrow record batches (chunks)
+        """
+        chunks = [data_events] if isinstance(data_events, pd.DataFrame) else data_events
+        added = self.prepared.append_events(self._validate_events(chunk) for chunk in chunks)
+        self._cohort_cube = None
+        return added
+
+    @property
+    def cohort_cube(self) -> CohortCube:
+        """
+        Revenue, purchases and first purchases by registration day x day since registration of all customers (without
+        segments), built on first use and again after data is appended. See segment_cube for a cube by segment
+        """
+        if getattr(self, "_cohort_cube", None) is None:
+            with self.profiler.stage("cohort_cube", rows_in=len(self.revenue_matrix.days)) as stage:
+                self._cohort_cube = CohortCube.from_prepared(self.prepared)
+                stage.rows_out = self._cohort_cube.revenue.size
+        return self._cohort_cube
 
-    # Analysis Plots
-    def summary(self):
-        data_customers = self.joined_df[
-            [self.uuid_col, self.registration_time_col]
-        ].drop_duplicates()
-        print(
-            f"""
-    **Customer Data Table**
-    - Date start:    {data_customers[self.registration_time_col].min()}
-    - Date end:      {data_customers[self.registration_time_col].max()}
-    - Period:        {(data_customers[self.registration_time_col].max()-data_customers[self.registration_time_col].min()).days/365:.2f} years
-    - Total Customers: {data_customers[self.uuid_col].nunique():,d} customers.
-    - Total Events: {data_customers.shape[0]:,d} events.
-    """
-        )
-        data_events = self.joined_df[~self.joined_df[self.event_time_col].isnull()]
-        unique_event_types = data_events[self.event_name_col].nunique()
-        event_list = list(data_events[self.event_name_col].unique())
-
-        print(
-            f"""
-    **Event Data Table**
-    - Date start:    {data_events[self.event_time_col].min()}
-    - Date end:      {data_events[self.event_time_col].max()}
-    - Period:        {(data_events[self.event_time_col].max()-data_events[self.event_time_col].min()).days/365:.2f} years
-    - Total Customers: {data_events[self.uuid_col].nunique():,d} customers.
-    - Total Events: {data_events.shape[0]:,d} events.
-    - Unique Event Types: {unique_event_types}.
-    - Event list: {event_list}
-    - Average Events per Customer: {(data_events.shape[0] / data_events[self.uuid_col].nunique()):.2f} events/customer.
-    """
+    def segment_cube(self, by: Union[str, List[str]]) -> CohortCube:
+        """
+        Revenue, purchases and first purchases by registration day x day since registration x segment, where the segments
+        are the combinations of values of the segment features [by] that occur in the data. It is built on request, as its
+        size grows with the number of segments
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        unknown = [col for col in by if col not in self.segment_feature_cols]
+        assert (
+            len(by) > 0 and len(unknown) == 0
+        ), f"by must be a non-empty list of segment_feature_cols {self.segment_feature_cols}, not {by}"
+        with self.profiler.stage("segment_cube", rows_in=len(self.revenue_matrix.days)) as stage:
+            cube = CohortCube.from_prepared(self.prepared, by)
+            stage.rows_out = cube.revenue.size
+        return cube
+
+    @profiled
+    def _customer_purchases(self, days_limit: int) -> pd.DataFrame:
+        """
+        Returns the revenue (sum) and number of purchases (count) of each paying customer until [days_limit]
+        days after registration, only for customers that are at least [days_limit] days old, so that all
+        customers have the same opportunity window. Customers are identified by their integer code
+        """
+        matrix = self.revenue_matrix
+        purchases = matrix.row_totals(matrix.purchases, days_limit)
+        paying = np.flatnonzero(purchases)
+        return pd.DataFrame(
+            {
+                self.uuid_col: paying,
+                "sum": matrix.row_totals(matrix.revenue, days_limit)[paying],
+                "count": purchases[paying].astype(np.int64),
+            }
         )
 
+    # Analysis Plots. Each analysis is split into a data step, which calculates the data of the
+    # analysis from the prepared data, and a render step, which plots or prints it. Both steps take
+    # the inputs of the public method, so that run_all can calculate the data in worker processes
+    @profiled
+    def summary(self, by: Union[str, List[str]] = None) -> Union[DatasetStats, pd.DataFrame]:
+        """
+        Prints the statistics of the customers and events data and returns them. They are calculated
+        while the data is prepared, so the summary does not scan the data again.
+        With [by] (segment features), returns the statistics of the customers of each segment, see analysis_by_segment
+        """
+        if by is not None:
+            return self.analysis_by_segment("summary", by)
+        return self._render_summary(self._summary_data())
+
+    @profiled
+    def _summary_data(self) -> DatasetStats:
+        return DatasetStats(self.prepared.stats)
+
+    @profiled
+    def _render_summary(self, stats: DatasetStats) -> DatasetStats:
+        print(stats.describe())
+        return stats
+
     # All plot methods
-    def plot_customers_intersection(self):
+    @profiled
+    def plot_customers_intersection(self, by: Union[str, List[str]] = None):
         """
         Plot the interection between customers in the two input data
         We expect that all customers in events data are also in customers data.
-        The inverse can be true, as there may be customers who never sent an event
+        The inverse can be true, as there may be customers who never sent an event.
+        With [by] (segment features), returns the data of each segment instead, see analysis_by_segment
         """
+        if by is not None:
+            return self.analysis_by_segment("plot_customers_intersection", by)
+        return self._render_customers_intersection(self._customers_intersection_data())
 
-        # Get uuids from each input data
-        customers_uuids = pd.DataFrame(
-            {self.uuid_col: self.data_customers[self.uuid_col].unique()}
-        )
-        customers_uuids["customers"] = "Present in Customers"
-        events_uuids = pd.DataFrame(
-            {self.uuid_col: self.data_events[self.uuid_col].unique()}
-        )
-        events_uuids["events"] = "Present in Events"
-
+    @profiled
+    @cached
+    def _customers_intersection_data(self) -> pd.DataFrame:
         # Calculate how many customers are in each category
-        cross_uuid = pd.merge(
-            customers_uuids, events_uuids, on=self.uuid_col, how="outer"
-        )
-        cross_uuid["customers"] = cross_uuid["customers"].fillna(
-            "Not in customers")
-        cross_uuid["events"] = cross_uuid["events"].fillna("Not in Events")
-        cross_uuid = (
-            cross_uuid.groupby(["customers", "events"])[self.uuid_col]
-            .count()
-            .reset_index()
+        stats = self.prepared.stats
+        customers_with_events = stats["customers_with_events"]
+        cross_uuid = pd.DataFrame(
+            {
+                "customers": [
+                    "Present in Customers",
+                    "Present in Customers",
+                    "Not in customers",
+                ],
+                "events": [
+                    "Present in Events",
+                    "Not in Events",
+                    "Present in Events",
+                ],
+                self.uuid_col: [
+                    customers_with_events,
+                    self.prepared.n_customers - customers_with_events,
+                    stats["unknown_event_customers"],
+                ],
+            }
         )
 
         # Create a dataframe containing all combinations for the visualization
@@ -241,19 +709,25 @@ class LTVexploratory:
                 ],
             }
         )
-        complete_data = pd.merge(
-            complete_data, cross_uuid, on=["customers", "events"], how="left"
-        )
+        with self.profiler.stage("merge", rows_in=len(complete_data)):
+            complete_data = pd.merge(
+                complete_data, cross_uuid, on=["customers", "events"], how="left"
+            )
         complete_data = complete_data.fillna(0)
         complete_data[self.uuid_col] = complete_data[self.uuid_col] / np.sum(
             complete_data[self.uuid_col]
         )
+        return complete_data
+
+    @profiled
+    def _render_customers_intersection(self, complete_data: pd.DataFrame):
         fig = self.graph.grid_plot(
             complete_data, "customers", "events", self.uuid_col)
         return fig, complete_data
 
+    @profiled
     def plot_purchases_distribution(
-        self, days_limit: int, truncate_share: float = 0.99
+        self, days_limit: int, truncate_share: float = 0.99, by: Union[str, List[str]] = None
     ):
         """
         Plots an histogram of the number of people by how many purchases they had until [days_limit] after their registration
@@ -263,38 +737,39 @@ class LTVexploratory:
         Input
             days_limit: number of days of the event since registration.
             truncate_share: share of total customers/revenue until where the plot shows values
+            by: segment features. If given, returns the data of each segment instead of the plot, see analysis_by_segment
         """
-        # Select only customers that are at least [days_limit] days old
-        end_events_date = self.joined_df[self.event_time_col].max()
-        data = self.joined_df[
-            (end_events_date -
-             self.joined_df[self.registration_time_col]).dt.days
-            >= days_limit
-        ].copy()
-
-        # Remove customers who never had a purchase and ensure all customers
-        # have the same opportunity window
-        data = data[
-            (data[self.event_time_col] -
-             data[self.registration_time_col]).dt.days
-            <= days_limit
-        ]
+        if by is not None:
+            return self.analysis_by_segment(
+                "plot_purchases_distribution", by, days_limit=days_limit, truncate_share=truncate_share
+            )
+        data = self._purchases_distribution_data(days_limit, truncate_share)
+        return self._render_purchases_distribution(data, days_limit, truncate_share)
 
-        # Count how many purchase customers had (defined by value > 0) and then
-        # how many customers are in each place
-        data = data[data[self.value_col] > 0]
-        data = (
-            data.groupby(self.uuid_col)[self.value_col]
-            .agg(["sum", "count"])
-            .reset_index()
-        )
+    @profiled
+    @cached
+    def _purchases_distribution_data(
+        self, days_limit: int, truncate_share: float = 0.99
+    ) -> pd.DataFrame:
+        # Count how many purchase (defined by value > 0) customers had until [days_limit] days after
+        # registration, only for customers that are at least [days_limit] days old, so all customers
+        # have the same opportunity window. Then count how many customers are in each place
+        data = self._customer_purchases(days_limit)
         data = data.drop(self.uuid_col, axis=1)
         data = data.rename(columns={"count": "purchases"})
-        data = data.groupby("purchases")["sum"].agg(
-            ["sum", "count"]).reset_index()
+        with self.profiler.stage("groupby", rows_in=len(data)) as stage:
+            data = data.groupby("purchases")["sum"].agg(
+                ["sum", "count"]).reset_index()
+            stage.rows_out = len(data)
         # Calculate the share
         data["sum"] = data["sum"] / data["sum"].sum()
         data["count"] = data["count"] / data["count"].sum()
+        return data
+
+    @profiled
+    def _render_purchases_distribution(
+        self, data: pd.DataFrame, days_limit: int, truncate_share: float = 0.99
+    ):
         # Find treshold truncation
         customers_truncation = data["count"].cumsum() <= truncate_share
         # plot distribution by customers
@@ -320,7 +795,10 @@ class LTVexploratory:
             )
         return grid, data
 
-    def plot_revenue_pareto(self, days_limit: int, granularity: int = 1000):
+    @profiled
+    def plot_revenue_pareto(
+        self, days_limit: int, granularity: int = 1000, by: Union[str, List[str]] = None
+    ):
         """
         Plots the - cumulative - share of revenue (Y) versus the share of customers (X), with customers ordered by revenue in descending order
         This plots how concentrated the revenue is. Base of customers is only of spending customers (so customers who never spent anything are ignored)
@@ -328,30 +806,27 @@ class LTVexploratory:
         Input
             days_limit: number of days of the event since registration.
             granularity: number of steps in the plot
+            by: segment features. If given, returns the data of each segment instead of the plot, see analysis_by_segment
         """
-        # Select only customers that are at least [days_limit] days old
-        end_events_date = self.joined_df[self.event_time_col].max()
-        data = self.joined_df[
-            (end_events_date -
-             self.joined_df[self.registration_time_col]).dt.days
-            >= days_limit
-        ].copy()
+        if by is not None:
+            return self.analysis_by_segment(
+                "plot_revenue_pareto", by, days_limit=days_limit, granularity=granularity
+            )
+        data = self._revenue_pareto_data(days_limit, granularity)
+        return self._render_revenue_pareto(data, days_limit, granularity)
 
-        # Remove customers who never had a purchase and ensure all customers
+    @profiled
+    @cached
+    def _revenue_pareto_data(
+        self, days_limit: int, granularity: int = 1000
+    ) -> pd.DataFrame:
+        # Sum the purchases (defined by value > 0) of each customer until [days_limit] days after
+        # registration, only for customers that are at least [days_limit] days old, so all customers
         # have the same opportunity window
-        data = data[
-            (data[self.event_time_col] -
-             data[self.registration_time_col]).dt.days
-            <= days_limit
-        ]
-
-        # Count how many purchase customers had (defined by value > 0) and then
-        # how many customers are in each place
-        data = data[data[self.value_col] > 0]
         data = (
-            data.groupby(self.uuid_col)[self.value_col]
-            .sum()
-            .reset_index()
+            self._customer_purchases(days_limit)
+            .drop("count", axis=1)
+            .rename(columns={"sum": self.value_col})
             .sort_values(self.value_col, ascending=False)
         )
 
@@ -359,18 +834,24 @@ class LTVexploratory:
         # granilarity
         total_revenue = data[self.value_col].sum()
         total_customers = data.shape[0]
-        data["cshare_customers"] = [
-            (i + 1) / total_customers for i in range(total_customers)
-        ]
-        data["cshare_revenue"] = data[self.value_col].cumsum() / total_revenue
-        data["group"] = data["cshare_customers"].apply(
-            lambda x: np.ceil(x * granularity)
-        )
-        data = (
-            data.groupby("group")[["cshare_customers", "cshare_revenue"]]
-            .max()
-            .reset_index()
+        data["cshare_customers"] = (
+            np.arange(1, total_customers + 1) / total_customers
         )
+        data["cshare_revenue"] = data[self.value_col].cumsum() / total_revenue
+        data["group"] = np.ceil(data["cshare_customers"] * granularity)
+        with self.profiler.stage("groupby", rows_in=len(data)) as stage:
+            data = (
+                data.groupby("group")[["cshare_customers", "cshare_revenue"]]
+                .max()
+                .reset_index()
+            )
+            stage.rows_out = len(data)
+        return data
+
+    @profiled
+    def _render_revenue_pareto(
+        self, data: pd.DataFrame, days_limit: int, granularity: int = 1000
+    ):
         # Create the plot using the existing graphing method
         fig = self.graph.line_plot(
             data,
@@ -427,8 +908,13 @@ class LTVexploratory:
         return fig, data
         """
 
+    @profiled
     def plot_customers_histogram_per_conversion_day(
-        self, days_limit: int = 60, optimization_window: int = 7, truncate_share=1.0
+        self,
+        days_limit: int = 60,
+        optimization_window: int = 7,
+        truncate_share=1.0,
+        by: Union[str, List[str]] = None,
     ) -> None:
         """
         Plots the distribution of all customers that converted until (days_limit) days after registration per conversion day
@@ -436,44 +922,65 @@ class LTVexploratory:
             days_limit: number of days of the event since registration.
             optimization_window: the number of days since registration of a customer that matters for the optimization of campaigns
             truncate_share: the total share of purchasing customers that the histogram includes
+            by: segment features. If given, returns the data of each segment instead of the plot, see analysis_by_segment
         """
+        if by is not None:
+            return self.analysis_by_segment(
+                "plot_customers_histogram_per_conversion_day",
+                by,
+                days_limit=days_limit,
+                optimization_window=optimization_window,
+                truncate_share=truncate_share,
+            )
+        data = self._customers_histogram_data(
+            days_limit, optimization_window, truncate_share
+        )
+        return self._render_customers_histogram(
+            data, days_limit, optimization_window, truncate_share
+        )
 
-        end_events_date = self.joined_df[self.event_time_col].max()
-        data = self.joined_df[
-            (end_events_date -
-             self.joined_df[self.registration_time_col]).dt.days
-            >= days_limit
-        ].copy()
+    @profiled
+    @cached
+    def _customers_histogram_data(
+        self, days_limit: int = 60, optimization_window: int = 7, truncate_share=1.0
+    ) -> pd.DataFrame:
+        cohort_days = days_limit
 
         # hard cap the histogram to 60 days
-        if days_limit > 60:
-            print("Warning: the histogram is based on the first 60 days of the data.")
-            days_limit = 60
-
-        # Remove customers who never had a purchase and ensure all customers
-        # have the same opportunity window
-        data = data[data[self.value_col] > 0]
-        data["dsi"] = (
-            (data[self.event_time_col] -
-             data[self.registration_time_col]).dt.days
-        ).fillna(0)
-        data = data[data["dsi"] <= days_limit]
-
-        # calculate data for the histogram
-        data = (
-            data.groupby(self.uuid_col)["dsi"]
-            .min()
-            .reset_index()
-            .groupby("dsi")[self.uuid_col]
-            .count()
-            .reset_index()
+        days_limit = min(days_limit, 60)
+
+        # Count customers by day of first purchase, among the customers that have
+        # the same opportunity window
+        matrix = self.revenue_matrix
+        first_day = matrix.first_day(matrix.purchases)
+        days, counts = np.unique(
+            first_day[(matrix.customer_age >= cohort_days) & (first_day <= days_limit)], return_counts=True
+        )
+        data = pd.DataFrame(
+            {
+                "dsi": days.astype(np.float64),
+                self.uuid_col: counts.astype(np.int64),
+            }
         )
 
         # calculate the share of customers instead of absolute numbers and
         # numbers for the title
         data[self.uuid_col] = data[self.uuid_col] / data[self.uuid_col].sum()
         data = data[data[self.uuid_col].cumsum() < truncate_share]
+        return data
 
+    @profiled
+    def _render_customers_histogram(
+        self,
+        data: pd.DataFrame,
+        days_limit: int = 60,
+        optimization_window: int = 7,
+        truncate_share=1.0,
+    ):
+        # the data is capped to the first 60 days
+        if days_limit > 60:
+            print("Warning: the histogram is based on the first 60 days of the data.")
+            days_limit = 60
         share_customers_within_window = data[data["dsi"] <= optimization_window][
             self.uuid_col
         ].sum()
@@ -521,8 +1028,14 @@ class LTVexploratory:
         return fig, data
         """
 
+    @profiled
     def plot_early_late_revenue_correlation(
-        self, days_limit: int, optimization_window: int = 7, interval_size: int = None
+        self,
+        days_limit: int,
+        optimization_window: int = 7,
+        interval_size: int = None,
+        chunk_size: int = 100000,
+        by: Union[str, List[str]] = None,
     ) -> None:
         """
         Calculates and plots correlation between customer-level revenue
@@ -533,59 +1046,32 @@ class LTVexploratory:
              - days_limit: max number of days after registration to be considered in the analysis
              - optimization_window: number of days from registration that the optimization of the marketing campaigns are operated
              - interval_size: number of days between two values shown in the correlation matrix. If None, the method finds the best interval based in the data size
+             - chunk_size: number of customers whose cumulative revenue is held in memory at once while the correlation is calculated
+             - by: segment features. If given, returns the correlation matrix of each segment instead of the plot, see analysis_by_segment
         """
-        # Filters customers to ensure that all have the same opportunity to
-        # generate revenue until [days_limits] after registration
-        end_events_date = self.joined_df[self.event_time_col].max()
-        cohort_filter = (
-            end_events_date - self.joined_df[self.registration_time_col]
-        ).dt.days >= days_limit  # ensure to only gets cohorts that are 'days_limit' old
-        opportunity_filter = (
-            self.joined_df[self.event_time_col]
-            - self.joined_df[self.registration_time_col]
-        ).dt.days <= days_limit  # only consider the first 'days_limit' days of a customer
-        customer_revenue_data = self.joined_df[
-            cohort_filter & opportunity_filter
-        ].copy()
-
-        # Create a new dataframe for cross join, so we can ensure that all
-        # customers have (days_limit + 1) days to calculate correlation
-        days_data = pd.DataFrame(
-            {
-                "days_since_install": np.linspace(
-                    optimization_window,
-                    days_limit,
-                    days_limit - optimization_window + 1,
-                ).astype(np.int32)
-            }
+        if by is not None:
+            return self.analysis_by_segment(
+                "plot_early_late_revenue_correlation",
+                by,
+                days_limit=days_limit,
+                optimization_window=optimization_window,
+                interval_size=interval_size,
+                chunk_size=chunk_size,
+            )
+        data = self._revenue_correlation_data(
+            days_limit, optimization_window, interval_size, chunk_size
         )
-        days_data["key"] = 1
-        customer_revenue_data["key"] = 1
-        customer_revenue_data = pd.merge(
-            customer_revenue_data, days_data, on="key"
-        ).drop("key", axis=1)
-
-        # Calculates the revenue of each customer until N days after
-        # registration (as the customer doesn't necessarily spend on all days)
-        customer_revenue_data[self.value_col] = (
-            customer_revenue_data["days_since_registration"]
-            <= customer_revenue_data["days_since_install"]
-        ) * customer_revenue_data[self.value_col]
-        customer_revenue_data = (
-            customer_revenue_data.groupby([self.uuid_col, "days_since_install"])[
-                self.value_col
-            ]
-            .sum()
-            .reset_index()
+        return self._render_revenue_correlation(
+            data, days_limit, optimization_window, interval_size, chunk_size
         )
-        # Calculate correlation, extract the correlation only for the 'early
-        # revenue' and plot it
-        customer_revenue_data = customer_revenue_data.pivot(
-            index=self.uuid_col, columns="days_since_install", values=self.value_col
-        ).reset_index()
-        customer_revenue_data = customer_revenue_data.drop(
-            self.uuid_col, axis=1).corr()
 
+    @staticmethod
+    def _correlation_days(
+        days_limit: int, optimization_window: int, interval_size: int = None
+    ) -> Tuple[int, List[int]]:
+        """
+        Returns the interval between the days shown in the correlation matrix and the days themselves
+        """
         # Filter out only some of the days, otherwise there will have too much
         # granularity for visualization
         interval_size = (
@@ -593,15 +1079,58 @@ class LTVexploratory:
             if interval_size is not None
             else np.round((days_limit - optimization_window) / 20)
         )
-        # doesn't work if applied directly on the output of np.round for some
-        # reason
-        interval_size = interval_size.astype(int)
+        interval_size = int(interval_size)
         days_of_interest = list(
             range(optimization_window, days_limit, interval_size))
+        return interval_size, days_of_interest
 
-        customer_revenue_data = customer_revenue_data[days_of_interest][
-            customer_revenue_data.index.isin(days_of_interest)
-        ]
+    @profiled
+    @cached
+    def _revenue_correlation_data(
+        self,
+        days_limit: int,
+        optimization_window: int = 7,
+        interval_size: int = None,
+        chunk_size: int = 100000,
+    ) -> pd.DataFrame:
+        _, days_of_interest = self._correlation_days(
+            days_limit, optimization_window, interval_size
+        )
+
+        # Filters customers to ensure that all have the same opportunity to
+        # generate revenue until [days_limits] after registration and only keep
+        # customers with at least one event in that period
+        matrix = self.revenue_matrix
+        events = matrix.row_totals(np.ones_like(matrix.value), days_limit)
+        customers = np.flatnonzero(events)
+
+        # Calculate the correlation between the revenue of each customer until N days after
+        # registration (as the customer doesn't necessarily spend on all days), only
+        # for the days of interest and streaming customers in chunks
+        days = pd.Index(
+            np.array(days_of_interest, dtype=np.int32), name="days_since_install"
+        )
+        customer_revenue_data = pd.DataFrame(
+            matrix.cumulative_correlation(
+                matrix.value, days.to_numpy(), customers, chunk_size
+            ),
+            index=days,
+            columns=days,
+        )
+        return customer_revenue_data
+
+    @profiled
+    def _render_revenue_correlation(
+        self,
+        customer_revenue_data: pd.DataFrame,
+        days_limit: int,
+        optimization_window: int = 7,
+        interval_size: int = None,
+        chunk_size: int = 100000,
+    ):
+        interval_size, days_of_interest = self._correlation_days(
+            days_limit, optimization_window, interval_size
+        )
         mask = np.zeros_like(customer_revenue_data, dtype=bool)
         mask[np.tril_indices_from(mask)] = True
 
@@ -630,10 +1159,24 @@ class LTVexploratory:
         return fig, customer_revenue_data
 
     @staticmethod
-    def _classify_spend(x: float, spending_breaks: Dict[str, float]):
-        key = np.argmax(x <= np.array(list(spending_breaks.values())))
-        return list(spending_breaks.keys())[key]
+    def _classify_spend(
+        x: np.ndarray, spending_breaks: Dict[str, float]
+    ) -> np.ndarray:
+        """
+        Returns the spending class of each value: the first class (in the order of the breaks, which must be
+        sorted in ascending order) whose upper limit is greater or equal than the value. Values above all limits
+        (or missing) get the first class
+        """
+        labels = np.array(list(spending_breaks.keys()), dtype=object)
+        key = np.searchsorted(
+            np.array(list(spending_breaks.values()), dtype=np.float64),
+            x,
+            side="left",
+        )
+        return labels[np.where(key < len(labels), key, 0)]
 
+    @profiled
+    @cached
     def _group_users_by_spend(
         self,
         days_limit: int,
@@ -649,42 +1192,38 @@ class LTVexploratory:
             spending_breaks: dictionary, in which the keys defines the name of the class and the values the upper limit of the spending associated with the class. Lower limit is considered to be the lower limit of the previous class, else 0
             end_spending_breaks: dictionary, in which the keys defines the name of the class and the values the upper limit of the spending associated with the class. Lower limit is considered to be the lower limit of the previous class, else 0
         """
-        # Select only customers that are at least [days_limit] days old
-        end_events_date = self.joined_df[self.event_time_col].max()
-        data = self.joined_df[
-            (end_events_date -
-             self.joined_df[self.registration_time_col]).dt.days
-            >= days_limit
-        ].copy()
-
-        # Remove customers who never had a purchase and ensure all customers
-        # have the same opportunity window
-        data = data[
-            (data[self.event_time_col] -
-             data[self.registration_time_col]).dt.days
-            <= days_limit
-        ]
-
-        # Count how many purchase customers had (defined by value > 0) and then
-        # how many customers are in each place
-        data = data[data[self.value_col] > 0]
-        data["dsi"] = (
-            (data[self.event_time_col] -
-             data[self.registration_time_col]).dt.days
-        ).fillna(0)
-        data["early_revenue"] = data.apply(
-            lambda x: (x["dsi"] <= early_limit) * x[self.value_col], axis=1
-        )
-        data["late_revenue"] = data.apply(
-            lambda x: (x["dsi"] <= days_limit) * x[self.value_col], axis=1
-        )
-
-        data = (
-            data.groupby(self.uuid_col)[["early_revenue", "late_revenue"]]
-            .sum()
-            .reset_index()
+        return self._group_spend(
+            self._spend_by_customer(days_limit, early_limit),
+            spending_breaks,
+            end_spending_breaks,
         )
 
+    @profiled
+    def _spend_by_customer(self, days_limit: int, early_limit: int) -> pd.DataFrame:
+        """
+        Early (until early_limit) and late (until days_limit) revenue of each paying customer
+        """
+        # Select only customers that are at least [days_limit] days old and had
+        # a purchase until [days_limit] days after registration
+        data = self._customer_purchases(days_limit)
+        data = data.drop("count", axis=1).rename(columns={"sum": "late_revenue"})
+        matrix = self.revenue_matrix
+        data["early_revenue"] = matrix.row_totals(
+            matrix.revenue, min(early_limit, days_limit), cohort_days=days_limit
+        )[data[self.uuid_col]]
+        return data[[self.uuid_col, "early_revenue", "late_revenue"]]
+
+    @profiled
+    def _classify_customers(
+        self,
+        data: pd.DataFrame,
+        spending_breaks: Dict[str, float],
+        end_spending_breaks: Dict[str, float],
+    ) -> pd.DataFrame:
+        """
+        Adds the early and late spending class of each customer to the output of _spend_by_customer.
+        Missing spending breaks are filled with the default ones, see _print_spending_breaks
+        """
         # Adding default spending breaks if there was none.
         if len(spending_breaks) == 0:
             zero_mask = data["early_revenue"] != 0
@@ -698,7 +1237,6 @@ class LTVexploratory:
             ).round(2)
             spending_breaks["High spend"] = np.ceil(
                 data["early_revenue"].max())
-            print("Starting spending breaks:", spending_breaks)
 
         # Adding default end spending breaks if there was none.
         if len(end_spending_breaks) == 0:
@@ -713,7 +1251,6 @@ class LTVexploratory:
             ).round(2)
             end_spending_breaks["High spend"] = np.ceil(
                 data["late_revenue"].max())
-            print("Ending spending breaks:", end_spending_breaks)
 
         # Spending breaks needs to be sorted in ascending order
         sorted_spending_breaks = dict(
@@ -723,40 +1260,71 @@ class LTVexploratory:
             sorted(end_spending_breaks.items(), key=lambda x: x[1])
         )
 
-        data["early_class"] = data["early_revenue"].apply(
-            lambda x: self._classify_spend(x, sorted_spending_breaks)
+        data["early_class"] = self._classify_spend(
+            data["early_revenue"].to_numpy(), sorted_spending_breaks
         )
-        data["late_class"] = data["late_revenue"].apply(
-            lambda x: self._classify_spend(x, sorted_end_spending_breaks)
+        data["late_class"] = self._classify_spend(
+            data["late_revenue"].to_numpy(), sorted_end_spending_breaks
         )
+        return data
 
-        def summary(data: pd.DataFrame):
-            output = {}
-            output["customers"] = len(data)
-            output["cumulative_early_revenue"] = data["early_revenue"].sum()
-            output["average_cumulative_early_revenue"] = data["early_revenue"].mean()
-            output["cumulative_late_revenue"] = data["late_revenue"].sum()
-            output["average_cumulative_late_revenue"] = data["late_revenue"].mean()
-            return pd.Series(output)
+    @staticmethod
+    def _print_spending_breaks(
+        missing_breaks: bool,
+        missing_end_breaks: bool,
+        spending_breaks: Dict[str, float],
+        end_spending_breaks: Dict[str, float],
+    ) -> None:
+        """
+        Prints the default spending breaks, if they were missing before they were filled by _classify_customers.
+        It is called outside of the cached steps, so the output is the same whether the result was cached or not
+        """
+        if missing_breaks:
+            print("Starting spending breaks:", spending_breaks)
+        if missing_end_breaks:
+            print("Ending spending breaks:", end_spending_breaks)
 
+    @profiled
+    def _group_spend(
+        self,
+        data: pd.DataFrame,
+        spending_breaks: Dict[str, float],
+        end_spending_breaks: Dict[str, float],
+    ) -> pd.DataFrame:
+        """
+        Classifies customers by their early and late revenue and summarises each combination of classes
+        Inputs:
+            data: dataframe with the early_revenue and late_revenue of each paying customer
+            spending_breaks, end_spending_breaks: see _group_users_by_spend
+        """
+        data = self._classify_customers(data, spending_breaks, end_spending_breaks)
+        with self.profiler.stage("groupby", rows_in=len(data)) as stage:
+            summary = data.groupby(["early_class", "late_class"]).agg(
+                customers=(self.uuid_col, "size"),
+                cumulative_early_revenue=("early_revenue", "sum"),
+                average_cumulative_early_revenue=("early_revenue", "mean"),
+                cumulative_late_revenue=("late_revenue", "sum"),
+                average_cumulative_late_revenue=("late_revenue", "mean"),
+            )
+            stage.rows_out = len(summary)
+        # all statistics are floats, including the number of customers
+        summary["customers"] = summary["customers"].astype(np.float64)
         return (
-            data.groupby(["early_class", "late_class"])[
-                [self.uuid_col, "early_revenue", "late_revenue"]
-            ]
-            .apply(summary)
-            .sort_values(
+            summary.sort_values(
                 ["average_cumulative_early_revenue",
                     "average_cumulative_late_revenue"]
             )
             .reset_index()
         )
 
+    @profiled
     def plot_paying_customers_flow(
         self,
         days_limit: int,
         early_limit: int,
         spending_breaks: Dict[str, float],
         end_spending_breaks: Dict[str, float],
+        by: Union[str, List[str]] = None,
     ):
         """
         Plots the flow of customers from early spending class to late spending class
@@ -765,10 +1333,38 @@ class LTVexploratory:
             early_limit: number of days of the event since registration that is considered 'early'. Usually refers to optimization window of marketing platforms
             spending_breaks: dictionary, in which the keys defines the name of the class and the values the upper limit of the spending associated with the class. Lower limit is considered to be the lower limit of the previous class, else 0
             end_spending_breaks: dictionary, in which the keys defines the name of the class and the values the upper limit of the spending associated with the class. Lower limit is considered to be the lower limit of the previous class, else 0
+            by: segment features. If given, returns the customers of each segment grouped by early and late class instead of the plot,
+                see analysis_by_segment. Missing spending breaks are calculated for each segment
         """
+        if by is not None:
+            return self.analysis_by_segment(
+                "plot_paying_customers_flow",
+                by,
+                days_limit=days_limit,
+                early_limit=early_limit,
+                spending_breaks=spending_breaks,
+                end_spending_breaks=end_spending_breaks,
+            )
+        missing_breaks = len(spending_breaks) == 0, len(end_spending_breaks) == 0
         data = self._group_users_by_spend(
             days_limit, early_limit, spending_breaks, end_spending_breaks
         )
+        self._print_spending_breaks(*missing_breaks, spending_breaks, end_spending_breaks)
+        return self._render_paying_customers_flow(
+            data, days_limit, early_limit, spending_breaks, end_spending_breaks
+        )
+
+    @profiled
+    def _render_paying_customers_flow(
+        self,
+        data: pd.DataFrame,
+        days_limit: int,
+        early_limit: int,
+        spending_breaks: Dict[str, float],
+        end_spending_breaks: Dict[str, float],
+    ):
+        # the flow chart modifies the data, so a copy of the groups of customers is used
+        data = data.copy()
 
         # add combination of early and late classes that have no customers
         unique_classes = data["early_class"].unique()
@@ -776,9 +1372,10 @@ class LTVexploratory:
             data=list(product(unique_classes, unique_classes)),
             columns=["early_class", "late_class"],
         )
-        visualization_data = pd.merge(
-            skeleton_data, data, how="left", on=["early_class", "late_class"]
-        ).fillna(0.0)
+        with self.profiler.stage("merge", rows_in=len(data)):
+            visualization_data = pd.merge(
+                skeleton_data, data, how="left", on=["early_class", "late_class"]
+            ).fillna(0.0)
         # Categorize classes, so that they are able to be ordered
         visualization_data["early_class"] = pd.Categorical(
             visualization_data["early_class"],
@@ -849,6 +1446,7 @@ class LTVexploratory:
         else:
             return self._get_ecomm_ltv(users_flow_df)
 
+    @profiled
     def _get_mobile_ltv(self, users_flow_df) -> pd.Series:
         """
         For each combination of (early class, late class), find the largest LTV in each (early_class). This is the best case scenario LTV
@@ -868,6 +1466,7 @@ class LTVexploratory:
             "best_case_average_late_revenue"
         ]
 
+    @profiled
     def _get_ecomm_ltv(self, users_flow_df) -> pd.Series:
         """
         Ignore users with no revenue at the beginning. Do nothing on them
@@ -901,12 +1500,14 @@ class LTVexploratory:
             axis=1,
         )
 
+    @profiled
     def estimate_ltv_impact(
         self,
         days_limit: int,
         early_limit: int,
         spending_breaks: Dict[str, float],
         is_mobile: bool,
+        by: Union[str, List[str]] = None,
     ):
         """
         Estimate the impact of using a predicted LTV (pLTV) strategy for campaign optimization.
@@ -914,12 +1515,49 @@ class LTVexploratory:
         As a consequence, it describes an unrealistic scenario and should be used only to draw the upper boundary
 
         The calculation depends on whether the data refers to an ecommerce or a mobile/gaming company.
+        With [by] (segment features), returns the table of each segment before rounding instead, see analysis_by_segment
         """
+        if by is not None:
+            return self.analysis_by_segment(
+                "estimate_ltv_impact",
+                by,
+                days_limit=days_limit,
+                early_limit=early_limit,
+                spending_breaks=spending_breaks,
+                is_mobile=is_mobile,
+            )
+        # the default spending breaks of the early and late classes are kept to be printed
+        early_breaks, late_breaks = spending_breaks.copy(), spending_breaks.copy()
+        data = self._add_ltv_impact(
+            self._group_users_by_spend(days_limit, early_limit, early_breaks, late_breaks), is_mobile
+        )
+        missing_breaks = len(spending_breaks) == 0
+        self._print_spending_breaks(missing_breaks, missing_breaks, early_breaks, late_breaks)
+        return self._render_ltv_impact(
+            data, days_limit, early_limit, spending_breaks, is_mobile
+        )
+
+    @profiled
+    @cached
+    def _ltv_impact_data(
+        self,
+        days_limit: int,
+        early_limit: int,
+        spending_breaks: Dict[str, float],
+        is_mobile: bool,
+    ) -> pd.DataFrame:
         # Get users grouped by their early and late revenue
         data = self._group_users_by_spend(
             days_limit, early_limit, spending_breaks.copy(), spending_breaks.copy()
         )
+        return self._add_ltv_impact(data, is_mobile)
 
+    @profiled
+    def _add_ltv_impact(self, data: pd.DataFrame, is_mobile: bool) -> pd.DataFrame:
+        """
+        Adds the upper limit of the late revenue of each combination of early and late classes
+        to the output of _group_users_by_spend
+        """
         # Apply the average LTV of the highest-spending class to all spending
         # classes
         data["assumed_average_new_late_revenue"] = self._get_upper_limit_ltv(
@@ -931,9 +1569,18 @@ class LTVexploratory:
         data["abs_revenue_increase"] = (
             data["assumed_new_late_revenue"] - data["cumulative_late_revenue"]
         )
+        return data
 
-        abs_impact = np.sum(data["abs_revenue_increase"])
-        rel_impact = abs_impact / np.sum(data["cumulative_late_revenue"])
+    @profiled
+    def _render_ltv_impact(
+        self,
+        data: pd.DataFrame,
+        days_limit: int,
+        early_limit: int,
+        spending_breaks: Dict[str, float],
+        is_mobile: bool,
+    ) -> pd.DataFrame:
+        abs_impact, rel_impact = self._total_ltv_impact(data)
 
         output_txt = f"""
         By adopting a predicted LTV (pLTV) based strategy for your marketing campaigns, we estimate a maximum increase of {100*rel_impact:.1f}% in revenue.
@@ -943,6 +1590,343 @@ class LTVexploratory:
 
         return data.round(self.rounding_precision)
 
+    @staticmethod
+    def _total_ltv_impact(data: pd.DataFrame) -> Tuple[float, float]:
+        """
+        Absolute and relative increase of the late revenue, from the output of _add_ltv_impact
+        """
+        abs_impact = np.sum(data["abs_revenue_increase"])
+        rel_impact = abs_impact / np.sum(data["cumulative_late_revenue"])
+        return abs_impact, rel_impact
+
+    @profiled
+    def sweep_ltv_impact(
+        self,
+        days_limits: List[int],
+        early_limits: List[int],
+        spending_breaks: List[Dict[str, float]],
+        is_mobile: bool,
+    ) -> pd.DataFrame:
+        """
+        Estimates the impact of using a predicted LTV (pLTV) strategy, as in estimate_ltv_impact, for every combination
+        of late window, early window and spending breaks. The revenue of each customer until each of the windows is
+        calculated once, in a single pass over the data, and reused by all combinations
+        Inputs
+            - days_limits: values of days_limit (late window) to be tried
+            - early_limits: values of early_limit (early window) to be tried
+            - spending_breaks: list of spending breaks to be tried. An empty dictionary uses the default breaks of each window
+            - is_mobile: whether it relates to gaming/mobile app business. If not, assumes it is eCommerce
+        Returns a dataframe with one row per combination: days_limit, early_limit, spending_breaks (position in the list),
+        abs_impact and rel_impact
+        """
+        assert (
+            len(days_limits) > 0 and len(early_limits) > 0 and len(spending_breaks) > 0
+        ), "At least one value of days_limits, early_limits and spending_breaks is needed"
+
+        # cumulative revenue and purchases of the candidate customers (old enough for the shortest window and with a
+        # purchase within the longest one) until each day used by any of the windows
+        matrix = self.revenue_matrix
+        days = np.unique(
+            list(days_limits)
+            + [min(early_limit, days_limit) for days_limit in days_limits for early_limit in early_limits]
+        )
+        customers = np.flatnonzero(
+            matrix.cohort(min(days_limits))
+            & (matrix.first_day(matrix.purchases) <= max(days_limits))
+        )
+        revenue = matrix.cumulative(matrix.revenue, days, customers)
+        purchases = matrix.cumulative(matrix.purchases, days, customers)
+        customer_age = matrix.customer_age[customers]
+        column = {day: i for i, day in enumerate(days)}
+
+        output = []
+        for days_limit in days_limits:
+            # same customers as in _customer_purchases(days_limit)
+            paying = (customer_age >= days_limit) & (purchases[:, column[days_limit]] > 0)
+            for early_limit in early_limits:
+                data = pd.DataFrame(
+                    {
+                        self.uuid_col: customers[paying],
+                        "early_revenue": revenue[paying, column[min(early_limit, days_limit)]],
+                        "late_revenue": revenue[paying, column[days_limit]],
+                    }
+                )
+                for i, breaks in enumerate(spending_breaks):
+                    impact = self._add_ltv_impact(
+                        self._group_spend(data, breaks.copy(), breaks.copy()), is_mobile
+                    )
+                    abs_impact, rel_impact = self._total_ltv_impact(impact)
+                    output.append(
+                        {
+                            "days_limit": days_limit,
+                            "early_limit": early_limit,
+                            "spending_breaks": i,
+                            "abs_impact": abs_impact,
+                            "rel_impact": rel_impact,
+                        }
+                    )
+        return pd.DataFrame(output).round(self.rounding_precision)
+
+    @profiled
+    def estimate_ltv_impact_ci(
+        self,
+        days_limit: int,
+        early_limit: int,
+        spending_breaks: Dict[str, float],
+        is_mobile: bool,
+        n_bootstrap: int = 1000,
+        confidence_level: float = 0.95,
+        random_seed: int = 42,
+        chunk_size: int = 10000,
+    ) -> pd.DataFrame:
+        """
+        Bootstrap confidence intervals of the impact estimated by estimate_ltv_impact.
+        Each bootstrap sample weights every customer with a Poisson(1) draw instead of resampling the data, so the
+        statistics of the groups of early and late classes of all samples are calculated at once, as a product of the
+        (samples x customers) weights by the (customers x groups) class table. Customers are processed in chunks of
+        [chunk_size], so memory is bounded by O(n_bootstrap x chunk_size). The spending breaks are those of the full data
+        Inputs
+            - days_limit, early_limit, spending_breaks, is_mobile: see estimate_ltv_impact
+            - n_bootstrap: number of bootstrap samples
+            - confidence_level: coverage of the intervals, e.g. 0.95 for the 2.5% and 97.5% percentiles
+            - random_seed: seed of the weights. The same seed (and chunk_size) always gives the same intervals
+            - chunk_size: number of customers whose weights are held in memory at once
+        Returns a dataframe with one row per metric (abs_impact and rel_impact) and the columns estimate, lower and upper
+        """
+        assert 0 < confidence_level < 1, "confidence_level must be between 0 and 1"
+        # default spending breaks are calculated once, on the full data
+        early_breaks, late_breaks = spending_breaks.copy(), spending_breaks.copy()
+        data = self._classify_customers(
+            self._spend_by_customer(days_limit, early_limit), early_breaks, late_breaks
+        )
+        self._print_spending_breaks(len(spending_breaks) == 0, len(spending_breaks) == 0, early_breaks, late_breaks)
+        groups = data.groupby(["early_class", "late_class"])
+        group = groups.ngroup().to_numpy()
+        classes = groups.size().index.to_frame(index=False)
+        late_revenue = data["late_revenue"].to_numpy(dtype=np.float64)
+
+        # number of customers and late revenue of each group, in each bootstrap sample
+        rng = np.random.default_rng(random_seed)
+        customers = np.zeros((n_bootstrap, len(classes)))
+        revenue = np.zeros((n_bootstrap, len(classes)))
+        for start in range(0, len(data), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            weights = rng.poisson(1.0, size=(n_bootstrap, len(group[chunk]))).astype(
+                np.float64
+            )
+            one_hot = np.zeros((len(group[chunk]), len(classes)))
+            one_hot[np.arange(len(group[chunk])), group[chunk]] = 1.0
+            customers += weights @ one_hot
+            revenue += weights @ (one_hot * late_revenue[chunk, None])
+
+        abs_impact = self._bootstrap_ltv_impact(classes, customers, revenue, is_mobile)
+        samples = {
+            "abs_impact": abs_impact,
+            "rel_impact": abs_impact / revenue.sum(axis=1),
+        }
+        estimate = self._total_ltv_impact(
+            self._add_ltv_impact(self._group_spend(data, early_breaks, late_breaks), is_mobile)
+        )
+        tail = (1 - confidence_level) / 2
+        return pd.DataFrame(
+            {
+                "estimate": estimate,
+                "lower": [np.nanpercentile(samples[metric], 100 * tail) for metric in samples],
+                "upper": [np.nanpercentile(samples[metric], 100 * (1 - tail)) for metric in samples],
+            },
+            index=list(samples),
+        ).round(self.rounding_precision)
+
+    @staticmethod
+    def _bootstrap_ltv_impact(
+        classes: pd.DataFrame,
+        customers: np.ndarray,
+        revenue: np.ndarray,
+        is_mobile: bool,
+    ) -> np.ndarray:
+        """
+        Absolute impact of each bootstrap sample, applying the rules of _get_mobile_ltv and _get_ecomm_ltv to
+        all samples at once
+        Inputs
+            classes: early_class and late_class of each group
+            customers, revenue: (samples x groups) number of customers and late revenue of each group
+        """
+        impact = np.zeros(customers.shape[0])
+        present = customers > 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            average = np.where(present, revenue / customers, -np.inf)
+            for early_class in classes["early_class"].unique():
+                same_early = (classes["early_class"] == early_class).to_numpy()
+                if is_mobile:
+                    # all groups get the largest average late revenue of their early class
+                    best = average[:, same_early].max(axis=1, keepdims=True)
+                    increase = best * customers[:, same_early] - revenue[:, same_early]
+                    impact += np.where(present[:, same_early], increase, 0).sum(axis=1)
+                elif early_class != "No spend":
+                    # low spending groups get the average late revenue of the others of their early class
+                    low = same_early & (classes["late_class"] == "Low spend").to_numpy()
+                    others = same_early & ~low
+                    best = revenue[:, others].sum(axis=1) / customers[:, others].sum(axis=1)
+                    increase = best[:, None] * customers[:, low] - revenue[:, low]
+                    impact += np.where(
+                        present[:, low] & np.isfinite(best)[:, None], increase, 0
+                    ).sum(axis=1)
+        return impact
+
+    @profiled
+    def run_all(
+        self,
+        config: Dict[str, Dict[str, object]],
+        n_jobs: int = None,
+        render: bool = False,
+        trace_path: str = None,
+    ) -> Dict[str, object]:
+        """
+        Calculates the data of several analyses at once, in parallel worker processes that read the prepared
+        data from shared memory. The plots are created afterwards, in this process, only if requested
+        Inputs
+            - config: dictionary with the name of each analysis to run (the name of its method, e.g. 'plot_revenue_pareto')
+                and the inputs of the method, e.g. {'summary': {}, 'plot_revenue_pareto': {'days_limit': 60}}
+            - n_jobs: number of worker processes. If None, the number of cpus. With 1, all analyses run in this process
+            - render: if False, returns the data of each analysis: the dataframe of the plot methods (for plot_paying_customers_flow,
+                the customers grouped by early and late class; for estimate_ltv_impact, the table before rounding) and the
+                statistics printed by summary. If True, returns exactly what each method returns
+            - trace_path: if given, the run is profiled and its stages (including those of the workers) are written to
+                this file in the Chrome Trace Event format, see save_trace
+        """
+        if trace_path is not None:
+            with self.profiling():
+                output = self.run_all(config, n_jobs=n_jobs, render=render)
+            self.save_trace(trace_path)
+            return output
+
+        unknown = [name for name in config if name not in self.ANALYSES]
+        assert (
+            len(unknown) == 0
+        ), f"The analyses {unknown} are not known. Use any of {list(self.ANALYSES)}"
+        params = {name: dict(config[name] or {}) for name in config}
+        for name in ["plot_paying_customers_flow", "estimate_ltv_impact"]:
+            # the spending breaks are modified when they are missing, so each step gets its own copy
+            for breaks in ["spending_breaks", "end_spending_breaks"]:
+                if breaks in params.get(name, {}):
+                    params[name][breaks] = dict(params[name][breaks])
+
+        tasks = [
+            (name, self.ANALYSES[name][0], dict(params[name])) for name in params
+        ]
+        data = {}
+        if self.result_cache is not None:
+            # cached results are read here, so only the other analyses run in the worker processes,
+            # which store their results in the cache
+            data = {
+                name: getattr(self, method)(**inputs)
+                for name, method, inputs in tasks
+                if self.result_cache.contains(
+                    result_key(self, getattr(type(self), method), (), inputs)[0]
+                )
+            }
+            tasks = [task for task in tasks if task[0] not in data]
+        data.update(run_parallel(self, tasks, n_jobs=n_jobs))
+        if not render:
+            return data
+        return {
+            name: getattr(self, self.ANALYSES[name][1])(data[name], **params[name])
+            for name in params
+        }
+
+    def _segment_groups(self, by: List[str]) -> Tuple[pd.DataFrame, List[np.ndarray]]:
+        """
+        Groups the customers by the values of the segment features [by] in one pass. Returns the values of each
+        segment (missing values are kept as a segment) and the sorted codes of the customers of each segment
+        """
+        segment = np.zeros(self.prepared.n_customers, dtype=np.int64)
+        for col in by:
+            # missing values get the code after the last category
+            n_categories = len(self.prepared.segments[col].categories)
+            codes = self.prepared.segments[col].codes
+            segment = segment * (n_categories + 1) + np.where(codes < 0, n_categories, codes)
+        keys, inverse, counts = np.unique(segment, return_inverse=True, return_counts=True)
+        order = np.argsort(inverse, kind="stable")
+        customers = np.split(order, np.cumsum(counts)[:-1]) if len(keys) > 0 else []
+        values = pd.DataFrame(
+            {
+                col: self.prepared.segments[col][[group[0] for group in customers]]
+                for col in by
+            },
+        )
+        return values, customers
+
+    def _segment_data(
+        self, name: str, customers: np.ndarray, params: Dict[str, object]
+    ) -> object:
+        """
+        Data of the analysis [name] for the subset of [customers] (sorted customer codes)
+        """
+        segment_ltv = self._from_prepared(self.prepared.select(customers), **self._settings())
+        segment_ltv.profiler = self.profiler
+        # the results of analysis_by_segment are cached, not those of each segment
+        segment_ltv.result_cache = None
+        return getattr(segment_ltv, self.ANALYSES[name][0])(**params)
+
+    @profiled
+    @cached(ignore=["n_jobs"])
+    def analysis_by_segment(
+        self,
+        name: str,
+        by: Union[str, List[str]],
+        n_jobs: int = None,
+        **params,
+    ) -> pd.DataFrame:
+        """
+        Calculates the data of an analysis for each segment, i.e. each combination of values of the segment features [by]
+        (which must be in segment_feature_cols), and returns them in one long-format dataframe with the segment features as
+        the first columns. The customers are grouped in one pass and the data of each segment is prepared from the shared
+        revenue matrix, without validating or joining the input data again
+        Inputs
+            - name: name of the analysis (of its method, e.g. 'plot_revenue_pareto'), see ANALYSES
+            - by: segment feature or list of segment features
+            - n_jobs: number of worker processes. If None, the segments run in this process when there are less than
+                MIN_PARALLEL_SEGMENTS of them, and in a process per cpu otherwise
+            - params: inputs of the analysis, e.g. days_limit=60
+        The data of each segment is the one returned by run_all (render=False), with the (named) index as columns. The statistics
+        of summary only include those of the customers, as the statistics of the events are not kept per customer
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        assert name in self.ANALYSES, f"The analysis {name} is not known. Use any of {list(self.ANALYSES)}"
+        unknown = [col for col in by if col not in self.segment_feature_cols]
+        assert (
+            len(by) > 0 and len(unknown) == 0
+        ), f"by must be a non-empty list of segment_feature_cols {self.segment_feature_cols}, not {by}"
+
+        values, customers = self._segment_groups(by)
+        if n_jobs is None and len(customers) < self.MIN_PARALLEL_SEGMENTS:
+            n_jobs = 1
+        # the spending breaks are modified when they are missing, so each segment gets its own copy
+        data = run_parallel(
+            self,
+            [
+                (i, "_segment_data", {"name": name, "customers": group, "params": copy.deepcopy(params)})
+                for i, group in enumerate(customers)
+            ],
+            n_jobs=n_jobs,
+        )
+
+        frames = []
+        for i in range(len(customers)):
+            frame = data[i]
+            if isinstance(frame, dict):
+                frame = pd.DataFrame([frame])
+            else:
+                frame = frame.reset_index(drop=all(level is None for level in frame.index.names))
+            frame.columns = [str(col) if not isinstance(col, str) else col for col in frame.columns]
+            for col in reversed(by):
+                frame.insert(0, col, values[col].iloc[i])
+            frames.append(frame)
+        if len(frames) == 0:
+            return pd.DataFrame(columns=by)
+        return pd.concat(frames, ignore_index=True)
+
+    @profiled
     def download_data(
         self,
         df: pd.DataFrame,
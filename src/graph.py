@@ -5,6 +5,7 @@
 
 """Module providing a class for rendering graphs"""
 
+import contextlib
 from typing import Dict, List, Tuple
 
 import matplotlib
@@ -17,6 +18,7 @@ import plotly.graph_objects as go
 import seaborn as sns
 from matplotlib.ticker import FuncFormatter, PercentFormatter
 from src.aux import cumsum, drop_duplicates, lag
+from src.profiling import Profiler
 
 
 class Graph:
@@ -890,26 +892,28 @@ class InteractiveChart:
         return fig
 
 
-def save_plot(fig, file_path: str, dpi: int = 200) -> None:
+def save_plot(fig, file_path: str, dpi: int = 200, profiler: Profiler = None) -> None:
     """
     Save figure in the defined location
     Inputs
         fig: Either a [plotly.graph_objs._figure.Figure] or [seaborn.axisgrid.FacetGrid],
         file_path: string containing path and name of the file it should be save as. Ex: images/my_image.png or /Users/Documents/my_image.jpeg
         dpi: dots per inches. Only for static images
+        profiler: if given, the export is measured as its stage 'save_plot' (see LTVexploratory.profile)
     """
-    if isinstance(fig, sns.axisgrid.FacetGrid):
-        fig.savefig(file_path, dpi=dpi)
-    elif isinstance(fig, plotly.graph_objs._figure.Figure):
-        # assumes image display of 4k (3840 x 2160) pixels and (24.5 x 14.6) inches.
-        current_dpi = 2160 / 14.6
-        rescaled_height = fig.layout.height * dpi / current_dpi
-        rescaled_width = fig.layout.width * dpi / current_dpi
-        fig.write_image(file_path, height=rescaled_height,
-                        width=rescaled_width)
-    elif isinstance(fig, matplotlib.figure.Figure):
-        fig.savefig(file_path, bbox_inches="tight", dpi=dpi)
-    else:
-        raise TypeError(
-            f"Input [fig] is of type {type(fig)} is not a valid type. It must be either seaborn.axisgrid.FacetGrid or plotly.graph_objs._figure.Figure"
-        )
+    with (profiler.stage("save_plot") if profiler is not None else contextlib.nullcontext()):
+        if isinstance(fig, sns.axisgrid.FacetGrid):
+            fig.savefig(file_path, dpi=dpi)
+        elif isinstance(fig, plotly.graph_objs._figure.Figure):
+            # assumes image display of 4k (3840 x 2160) pixels and (24.5 x 14.6) inches.
+            current_dpi = 2160 / 14.6
+            rescaled_height = fig.layout.height * dpi / current_dpi
+            rescaled_width = fig.layout.width * dpi / current_dpi
+            fig.write_image(file_path, height=rescaled_height,
+                            width=rescaled_width)
+        elif isinstance(fig, matplotlib.figure.Figure):
+            fig.savefig(file_path, bbox_inches="tight", dpi=dpi)
+        else:
+            raise TypeError(
+                f"Input [fig] is of type {type(fig)} is not a valid type. It must be either seaborn.axisgrid.FacetGrid or plotly.graph_objs._figure.Figure"
+            )
@@ -0,0 +1,169 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Module providing the execution of several analyses in parallel worker processes"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+from src.prepared import PreparedData, RevenueMatrix
+
+
+# arrays of the revenue matrix shared with the workers
+MATRIX_ARRAYS = RevenueMatrix.ARRAYS
+
+# state of each worker process: the analysis object rebuilt over the shared memory
+_worker_shared_memory = None
+_worker_ltv = None
+
+
+def share_arrays(
+    arrays: Dict[str, np.ndarray]
+) -> Tuple[SharedMemory, Dict[str, Tuple[int, str, Tuple[int, ...]]]]:
+    """
+    Copies numpy arrays into a single block of shared memory. Returns the block and its layout,
+    i.e. the offset, dtype and shape of each array, which is what other processes need to attach to it
+    """
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        # keep every array aligned to 8 bytes
+        offset = -(-offset // 8) * 8
+        layout[name] = (offset, array.dtype.str, array.shape)
+        offset += array.nbytes
+    shared_memory = SharedMemory(create=True, size=max(offset, 1))
+    for name, array in arrays.items():
+        view = _view(shared_memory, layout[name])
+        view[...] = array
+    return shared_memory, layout
+
+
+def attach_arrays(
+    name: str, layout: Dict[str, Tuple[int, str, Tuple[int, ...]]]
+) -> Tuple[SharedMemory, Dict[str, np.ndarray]]:
+    """
+    Attaches to a block of shared memory created by share_arrays and returns read-only views of its arrays
+    """
+    shared_memory = SharedMemory(name=name)
+    arrays = {}
+    for array_name, array_layout in layout.items():
+        arrays[array_name] = _view(shared_memory, array_layout)
+        arrays[array_name].flags.writeable = False
+    return shared_memory, arrays
+
+
+def _view(
+    shared_memory: SharedMemory, array_layout: Tuple[int, str, Tuple[int, ...]]
+) -> np.ndarray:
+    offset, dtype, shape = array_layout
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shared_memory.buf, offset=offset)
+
+
+def share_prepared(
+    prepared: PreparedData,
+) -> Tuple[SharedMemory, Dict[str, Tuple[int, str, Tuple[int, ...]]], Dict[str, object]]:
+    """
+    Places the arrays of the prepared data in shared memory. Returns the block, its layout and
+    the (small) remaining information needed to rebuild the prepared data
+    """
+    arrays = {name: getattr(prepared.matrix, name) for name in MATRIX_ARRAYS}
+    arrays["registration_time"] = prepared.registration_time
+    for col, segment in prepared.segments.items():
+        arrays[f"segment:{col}"] = segment.codes
+    shared_memory, layout = share_arrays(arrays)
+    meta = {
+        "segment_categories": {
+            col: segment.categories for col, segment in prepared.segments.items()
+        },
+        "end_events_date": prepared.end_events_date,
+        "stats": prepared.stats,
+        # the fingerprint, if calculated, is not calculated again by each worker
+        "fingerprint": prepared._fingerprint,
+    }
+    return shared_memory, layout, meta
+
+
+def prepared_from_arrays(
+    arrays: Dict[str, np.ndarray], meta: Dict[str, object]
+) -> PreparedData:
+    """
+    Rebuilds the prepared data over the arrays of share_prepared, without copying them.
+    The customer-ids are not shared, as the analyses only use the customer codes
+    """
+    matrix = RevenueMatrix(**{name: arrays[name] for name in MATRIX_ARRAYS})
+    segments = {
+        col: pd.Categorical.from_codes(arrays[f"segment:{col}"], categories=categories)
+        for col, categories in meta["segment_categories"].items()
+    }
+    prepared = PreparedData(
+        uuids=None,
+        registration_time=arrays["registration_time"],
+        segments=segments,
+        matrix=matrix,
+        end_events_date=meta["end_events_date"],
+        stats=meta["stats"],
+    )
+    prepared._fingerprint = meta["fingerprint"]
+    return prepared
+
+
+def _init_worker(
+    cls: type,
+    settings: Dict[str, object],
+    name: str,
+    layout: Dict[str, Tuple[int, str, Tuple[int, ...]]],
+    meta: Dict[str, object],
+) -> None:
+    global _worker_shared_memory, _worker_ltv
+    _worker_shared_memory, arrays = attach_arrays(name, layout)
+    _worker_ltv = cls._from_prepared(prepared_from_arrays(arrays, meta), **settings)
+
+
+def _run_worker(method: str, params: Dict[str, object]) -> Tuple[object, List[Dict[str, object]]]:
+    # the stages recorded by the worker (if profiling) are sent back with the output
+    output = getattr(_worker_ltv, method)(**params)
+    records = _worker_ltv.profiler.records
+    _worker_ltv.profiler.reset()
+    return output, records
+
+
+def run_parallel(
+    ltv, tasks: List[Tuple[str, str, Dict[str, object]]], n_jobs: int = None
+) -> Dict[str, object]:
+    """
+    Runs methods of an analysis object in a pool of worker processes. The prepared data of the object is
+    placed once in shared memory, so that workers read it instead of receiving a copy of it
+    Inputs
+        - ltv: object with the prepared data and a profiler, which must implement _settings and _from_prepared
+        - tasks: list of (key, name of the method, inputs of the method)
+        - n_jobs: number of worker processes. If None, the number of cpus. With 1, tasks run in this process
+    Returns the output of each task by its key
+    """
+    n_jobs = min(n_jobs or os.cpu_count() or 1, max(len(tasks), 1))
+    if n_jobs == 1:
+        return {key: getattr(ltv, method)(**params) for key, method, params in tasks}
+
+    shared_memory, layout, meta = share_prepared(ltv.prepared)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_jobs,
+            initializer=_init_worker,
+            initargs=(type(ltv), ltv._settings(), shared_memory.name, layout, meta),
+        ) as executor:
+            futures = {
+                key: executor.submit(_run_worker, method, params)
+                for key, method, params in tasks
+            }
+            output = {}
+            for key, future in futures.items():
+                output[key], records = future.result()
+                ltv.profiler.records += records
+            return output
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
@@ -0,0 +1,1034 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Module providing the columnar representation of the data used by the analyses"""
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pandas.api.types import union_categoricals
+from src.accumulators import CorrelationAccumulator
+
+
+NANOSECONDS_PER_DAY = 24 * 60 * 60 * 10**9
+# value used for integer day offsets that cannot be calculated (e.g. missing timestamps)
+MISSING_DAYS = np.iinfo(np.int32).min
+# approximate memory used to process one event row: encoded arrays, masks and the pandas chunk itself
+BYTES_PER_EVENT = 256
+# version of the files written by PreparedData.save
+STATE_VERSION = 2
+
+
+def _as_nanoseconds(values: pd.Series) -> np.ndarray:
+    """
+    Returns a datetime column as int64 nanoseconds since epoch. Missing values (NaT) are mapped
+    to the minimum int64 value
+    """
+    return pd.DatetimeIndex(values).as_unit("ns").asi8
+
+
+def _days_between(start_ns: np.ndarray, end_ns: np.ndarray) -> np.ndarray:
+    """
+    Number of full days between two arrays of timestamps (in nanoseconds), rounded down as in
+    pd.Timedelta.days. Pairs where any of the timestamps is missing get MISSING_DAYS
+    """
+    missing = (start_ns == pd.NaT.value) | (end_ns == pd.NaT.value)
+    days = np.floor_divide(end_ns - start_ns, NANOSECONDS_PER_DAY)
+    return np.where(missing, MISSING_DAYS, days).astype(np.int32)
+
+
+def _as_timestamp(nanoseconds: int, tz: object = None) -> pd.Timestamp:
+    """Timestamp from nanoseconds since epoch, converted to the timezone [tz] if defined"""
+    if tz is None:
+        return pd.Timestamp(nanoseconds)
+    return pd.Timestamp(nanoseconds, tz="UTC").tz_convert(tz)
+
+
+def _min_timestamp(a: pd.Timestamp, b: pd.Timestamp) -> pd.Timestamp:
+    """Earliest of two timestamps, ignoring missing values"""
+    return b if pd.isnull(a) else a if pd.isnull(b) else min(a, b)
+
+
+def _max_timestamp(a: pd.Timestamp, b: pd.Timestamp) -> pd.Timestamp:
+    """Latest of two timestamps, ignoring missing values"""
+    return b if pd.isnull(a) else a if pd.isnull(b) else max(a, b)
+
+
+def _json_default(value: object) -> object:
+    """
+    Tagged json form of the values of the meta file of PreparedData.save that json does not support:
+    timestamps, indexes, small dataframes and numpy values. Read back by _json_object
+    """
+    if value is pd.NaT:
+        return {"__timestamp__": None}
+    if isinstance(value, pd.Timestamp):
+        return {"__timestamp__": value.isoformat(), "tz": None if value.tz is None else str(value.tz)}
+    if isinstance(value, pd.Index):
+        return {"__index__": value.tolist()}
+    if isinstance(value, pd.DataFrame):
+        return {"__frame__": value.to_dict(orient="list"), "columns": value.columns.tolist()}
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} values are not supported in the meta file")
+
+
+def _json_object(value: Dict[str, object]) -> object:
+    """
+    Value of a json object written with _json_default
+    """
+    if "__timestamp__" in value:
+        if value["__timestamp__"] is None:
+            return pd.NaT
+        timestamp = pd.Timestamp(value["__timestamp__"])
+        return timestamp if value["tz"] is None else timestamp.tz_convert(value["tz"])
+    if "__index__" in value:
+        return pd.Index(value["__index__"])
+    if "__frame__" in value:
+        return pd.DataFrame(value["__frame__"], columns=value["columns"])
+    return value
+
+
+def _empty_entries() -> Tuple[np.ndarray, ...]:
+    """Entries of a matrix without any event"""
+    return (
+        np.zeros(0, dtype=np.int32),
+        np.zeros(0, dtype=np.int32),
+        np.zeros(0),
+        np.zeros(0, dtype=np.int32),
+        np.zeros(0),
+    )
+
+
+def _aggregate_entries(
+    customer: np.ndarray,
+    day: np.ndarray,
+    revenue: np.ndarray,
+    purchases: np.ndarray,
+    value: np.ndarray,
+) -> Tuple[np.ndarray, ...]:
+    """
+    Sums [revenue], [purchases] and [value] of all rows with the same (customer, day), returning the
+    aggregated entries sorted by customer and day. Rows can be events or entries aggregated before,
+    which makes the aggregation mergeable across chunks of data
+    """
+    customer = customer.astype(np.int64)
+    day = day.astype(np.int64)
+    min_day, max_day = (day.min(), day.max()) if len(day) > 0 else (0, 0)
+    order = np.argsort(customer * (max_day - min_day + 1) + (day - min_day), kind="stable")
+    customer, day = customer[order], day[order]
+    starts = np.flatnonzero(
+        np.diff(customer, prepend=-1) | np.diff(day, prepend=min_day - 1)
+    )
+    return (
+        customer[starts].astype(np.int32),
+        day[starts].astype(np.int32),
+        np.add.reduceat(revenue[order], starts),
+        np.add.reduceat(purchases[order], starts),
+        np.add.reduceat(value[order], starts),
+    )
+
+
+class RevenueMatrix:
+    """
+    Sparse matrix (CSR layout) of customers (rows) by days since registration (columns), aggregating
+    all events of a customer on the same day. Rows are the customer codes of the prepared data and,
+    within each row, entries are sorted by day. Each entry holds:
+        - revenue: sum of the values of purchases (events with value > 0)
+        - purchases: number of purchases
+        - value: sum of the values of all events
+    Together with the age of each customer, this is enough to answer any cohort based analysis as
+    a slice (days <= N) of the matrix, without going back to the event level data.
+    """
+
+    # arrays that hold the matrix, i.e. the inputs of the constructor
+    ARRAYS = ["indptr", "days", "revenue", "purchases", "value", "customer_age", "rows"]
+
+    def __init__(
+        self,
+        indptr: np.ndarray,
+        days: np.ndarray,
+        revenue: np.ndarray,
+        purchases: np.ndarray,
+        value: np.ndarray,
+        customer_age: np.ndarray,
+        rows: np.ndarray = None,
+    ) -> None:
+        self.indptr = indptr
+        self.days = days
+        self.revenue = revenue
+        self.purchases = purchases
+        self.value = value
+        self.customer_age = customer_age
+        # row of each entry, used to aggregate entries by customer
+        self.rows = (
+            rows
+            if rows is not None
+            else np.repeat(np.arange(self.n_customers, dtype=np.int32), np.diff(indptr))
+        )
+
+    @property
+    def n_customers(self) -> int:
+        return len(self.indptr) - 1
+
+    @classmethod
+    def from_entries(
+        cls,
+        customer: np.ndarray,
+        day: np.ndarray,
+        revenue: np.ndarray,
+        purchases: np.ndarray,
+        value: np.ndarray,
+        customer_age: np.ndarray,
+    ) -> "RevenueMatrix":
+        """
+        Builds the matrix from (customer, day) rows, summing the rows that fall in the same entry
+        """
+        customer, day, revenue, purchases, value = _aggregate_entries(
+            customer, day, revenue, purchases, value
+        )
+        counts = np.bincount(customer, minlength=len(customer_age))
+        return cls(
+            indptr=np.r_[0, np.cumsum(counts)],
+            days=day,
+            revenue=revenue,
+            purchases=purchases,
+            value=value,
+            customer_age=customer_age,
+        )
+
+    def add_entries(
+        self,
+        customer: np.ndarray,
+        day: np.ndarray,
+        revenue: np.ndarray,
+        purchases: np.ndarray,
+        value: np.ndarray,
+        customer_age: np.ndarray,
+    ) -> "RevenueMatrix":
+        """
+        Matrix with new entries, sorted by customer and day and without repeated (customer, day) as returned by
+        _aggregate_entries. Entries of an existing (customer, day) are added to it and the others are inserted in
+        place, so the matrix is copied once but its entries are not sorted again
+        """
+        # entries are sorted by this key, as they are sorted by row and then by day
+        def key(rows: np.ndarray, days: np.ndarray) -> np.ndarray:
+            return (rows.astype(np.int64) << 32) | (days.astype(np.int64) - MISSING_DAYS)
+
+        new_keys = key(customer, day)
+        position = np.searchsorted(key(self.rows, self.days), new_keys)
+        found = position < len(self.days)
+        found[found] = key(self.rows[position[found]], self.days[position[found]]) == new_keys[found]
+        inserted = ~found
+
+        def merge(data: np.ndarray, new_data: np.ndarray) -> np.ndarray:
+            data = data.copy()
+            data[position[found]] += new_data[found]
+            return np.insert(data, position[inserted], new_data[inserted])
+
+        counts = np.bincount(customer[inserted], minlength=self.n_customers)
+        return RevenueMatrix(
+            indptr=self.indptr + np.r_[0, np.cumsum(counts)],
+            days=np.insert(self.days, position[inserted], day[inserted]),
+            revenue=merge(self.revenue, revenue),
+            purchases=merge(self.purchases, purchases),
+            value=merge(self.value, value),
+            customer_age=customer_age,
+            rows=np.insert(self.rows, position[inserted], customer[inserted]),
+        )
+
+    def add_customers(self, customer_age: np.ndarray) -> "RevenueMatrix":
+        """
+        Matrix with new customers (rows) without entries, of age [customer_age]
+        """
+        return RevenueMatrix(
+            indptr=np.r_[self.indptr, np.full(len(customer_age), self.indptr[-1])],
+            days=self.days,
+            revenue=self.revenue,
+            purchases=self.purchases,
+            value=self.value,
+            customer_age=np.concatenate([self.customer_age, customer_age]),
+            rows=self.rows,
+        )
+
+    def select(self, customers: np.ndarray) -> "RevenueMatrix":
+        """
+        Matrix with only the rows of [customers] (sorted customer codes), which become customers 0..n-1
+        """
+        lengths = np.diff(self.indptr)[customers]
+        indptr = np.r_[0, np.cumsum(lengths)]
+        entries = np.repeat(self.indptr[customers] - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return RevenueMatrix(
+            indptr=indptr,
+            days=self.days[entries],
+            revenue=self.revenue[entries],
+            purchases=self.purchases[entries],
+            value=self.value[entries],
+            customer_age=self.customer_age[customers],
+        )
+
+    def cohort(self, days_limit: int) -> np.ndarray:
+        """
+        Mask of customers that are at least [days_limit] days old, i.e. that had the opportunity to generate
+        revenue for [days_limit] days after registration
+        """
+        return self.customer_age >= days_limit
+
+    def row_totals(
+        self, data: np.ndarray, days_limit: int, cohort_days: int = None
+    ) -> np.ndarray:
+        """
+        Sum of the entries of [data] until [days_limit] days since registration for each customer.
+        Customers younger than [cohort_days] (default: days_limit) get 0
+        Inputs
+            data: one of the entry arrays of the matrix (revenue, purchases or value)
+            days_limit: last day since registration to be included in the sum
+            cohort_days: minimum age of the customers to be included
+        """
+        cohort_days = days_limit if cohort_days is None else cohort_days
+        mask = (self.days <= days_limit) & self.cohort(cohort_days)[self.rows]
+        return np.bincount(
+            self.rows[mask], weights=data[mask], minlength=self.n_customers
+        )
+
+    def cumulative(
+        self, data: np.ndarray, days: np.ndarray, customers: np.ndarray
+    ) -> np.ndarray:
+        """
+        Dense matrix with the cumulative sum of [data] of the selected customers (rows) until each of
+        the days in [days] (columns). Only the entries of the rows between the first and the last
+        selected customer are read, so selecting customers in sorted chunks reads each entry once.
+        Inputs
+            data: one of the entry arrays of the matrix (revenue, purchases or value)
+            days: sorted array of days since registration
+            customers: codes of the customers to be included, in the order of the output rows
+        """
+        if len(customers) == 0:
+            return np.zeros((0, len(days)))
+        first, last = customers.min(), customers.max() + 1
+        entries = slice(self.indptr[first], self.indptr[last])
+        position = np.full(last - first, -1, dtype=np.int64)
+        position[customers - first] = np.arange(len(customers))
+        row = position[self.rows[entries] - first]
+        # first output column to which each entry contributes
+        column = np.searchsorted(days, self.days[entries], side="left")
+        mask = (row >= 0) & (column < len(days))
+        output = np.bincount(
+            row[mask] * len(days) + column[mask],
+            weights=data[entries][mask],
+            minlength=len(customers) * len(days),
+        ).reshape(len(customers), len(days))
+        return np.cumsum(output, axis=1)
+
+    def cumulative_correlation(
+        self,
+        data: np.ndarray,
+        days: np.ndarray,
+        customers: np.ndarray,
+        chunk_size: int = 100000,
+    ) -> np.ndarray:
+        """
+        Correlation matrix between the cumulative sums of [data] until each of the days in [days], across
+        the selected customers. Customers are streamed in chunks of [chunk_size], so memory is bounded by
+        O(chunk_size x len(days)) and each entry of the matrix is read only once.
+        Inputs
+            data: one of the entry arrays of the matrix (revenue, purchases or value)
+            days: sorted array of days since registration
+            customers: sorted codes of the customers to be included
+            chunk_size: number of customers processed at once
+        """
+        accumulator = CorrelationAccumulator(len(days))
+        for start in range(0, len(customers), chunk_size):
+            accumulator.update(
+                self.cumulative(data, days, customers[start:start + chunk_size])
+            )
+        return accumulator.correlation()
+
+    def first_day(self, data: np.ndarray) -> np.ndarray:
+        """
+        First day since registration with a non-zero entry in [data] for each customer.
+        Customers without any non-zero entry get the maximum int32 value
+        """
+        output = np.full(self.n_customers, np.iinfo(np.int32).max, dtype=np.int32)
+        entries = np.flatnonzero(data)
+        rows, first = np.unique(self.rows[entries], return_index=True)
+        output[rows] = self.days[entries[first]]
+        return output
+
+
+class DatasetStats(dict):
+    """
+    Statistics of the customers and events data, computed in the same pass that prepares the data: date ranges,
+    distinct customers, number of events, list of event types and missing values of each column. It is a dictionary
+    (e.g. stats['events']) with a few derived statistics and a text description, which is what summary prints
+    """
+
+    @property
+    def registration_years(self) -> float:
+        return (self["registration_end"] - self["registration_start"]).days / 365
+
+    @property
+    def event_years(self) -> float:
+        return (self["event_end"] - self["event_start"]).days / 365
+
+    @property
+    def events_per_customer(self) -> float:
+        return self["events"] / self["event_customers"] if self["event_customers"] > 0 else np.nan
+
+    def describe(self) -> str:
+        customers = f"""
+    **Customer Data Table**
+    - Date start:    {self["registration_start"]}
+    - Date end:      {self["registration_end"]}
+    - Period:        {self.registration_years:.2f} years
+    - Total Customers: {self["customers"]:,d} customers.
+    - Total Events: {self["customer_rows"]:,d} events.
+    - Missing values: {self["customer_null_counts"]}
+    """
+        events = f"""
+    **Event Data Table**
+    - Date start:    {self["event_start"]}
+    - Date end:      {self["event_end"]}
+    - Period:        {self.event_years:.2f} years
+    - Total Customers: {self["event_customers"]:,d} customers.
+    - Total Events: {self["events"]:,d} events.
+    - Unique Event Types: {self["unique_event_types"]}.
+    - Event list: {self["event_list"]}
+    - Average Events per Customer: {self.events_per_customer:.2f} events/customer.
+    - Missing values: {self["event_null_counts"]}
+    """
+        return customers + "\n" + events
+
+
+class EventsAggregator:
+    """
+    Reduces events data, received in chunks of any size, into mergeable per-customer aggregates:
+    the entries of the RevenueMatrix and the statistics used to describe the data. Only the aggregates
+    are kept in memory, so the events data can be much bigger than the available memory.
+    Partial entries of the chunks are merged whenever they take more than [memory_budget] bytes.
+    """
+
+    def __init__(
+        self,
+        uuids: pd.Index,
+        registration_ns: np.ndarray,
+        uuid_col: str,
+        event_time_col: str,
+        event_name_col: str,
+        value_col: str,
+        memory_budget: int,
+    ) -> None:
+        self.uuids = uuids
+        self.registration_ns = registration_ns
+        self.uuid_col = uuid_col
+        self.event_time_col = event_time_col
+        self.event_name_col = event_name_col
+        self.value_col = value_col
+        self.memory_budget = memory_budget
+
+        self.has_events = np.zeros(len(uuids), dtype=bool)
+        self.has_timed_events = np.zeros(len(uuids), dtype=bool)
+        self.unknown_uuids = pd.Index([])
+        self.events = 0
+        self.null_counts = {col: 0 for col in [uuid_col, event_time_col, event_name_col, value_col]}
+        self.event_start = pd.NaT
+        self.event_end = pd.NaT
+        self.first_event_names = []
+        self.chunks = 0
+        self.entries = []
+        self.entries_size = 0
+        self.merged_size = 0
+        # customer-ids as an arrow array, to encode arrow record batches
+        self.arrow_uuids = None
+
+    # state of the aggregator other than the customers and the entries, see state
+    STATE_ARRAYS = ["has_events", "has_timed_events"]
+    STATE = [
+        "uuid_col",
+        "event_time_col",
+        "event_name_col",
+        "value_col",
+        "memory_budget",
+        "unknown_uuids",
+        "events",
+        "null_counts",
+        "event_start",
+        "event_end",
+        "first_event_names",
+        "chunks",
+    ]
+
+    def state(self) -> Tuple[Dict[str, np.ndarray], Dict[str, object]]:
+        """
+        Arrays and (small) remaining information needed to aggregate more events after the entries were taken,
+        together with the customers, see from_state
+        """
+        return (
+            {name: getattr(self, name) for name in self.STATE_ARRAYS},
+            {name: getattr(self, name) for name in self.STATE},
+        )
+
+    @classmethod
+    def from_state(
+        cls,
+        uuids: pd.Index,
+        registration_ns: np.ndarray,
+        arrays: Dict[str, np.ndarray],
+        state: Dict[str, object],
+    ) -> "EventsAggregator":
+        """
+        Rebuilds an aggregator from the output of state, without entries
+        """
+        aggregator = cls.__new__(cls)
+        aggregator.uuids = uuids
+        aggregator.registration_ns = registration_ns
+        for name in cls.STATE_ARRAYS:
+            # these arrays are updated in place
+            setattr(aggregator, name, np.array(arrays[name]))
+        for name in cls.STATE:
+            setattr(aggregator, name, state[name])
+        aggregator.entries = []
+        aggregator.entries_size = 0
+        aggregator.merged_size = 0
+        aggregator.arrow_uuids = None
+        return aggregator
+
+    def add_customers(self, uuids: pd.Index, registration_ns: np.ndarray) -> None:
+        """
+        Adds new customers after the known ones, so that events of the next chunks can be encoded against them
+        """
+        self.uuids = self.uuids.append(uuids)
+        self.registration_ns = np.concatenate([self.registration_ns, registration_ns])
+        self.has_events = np.r_[self.has_events, np.zeros(len(uuids), dtype=bool)]
+        self.has_timed_events = np.r_[self.has_timed_events, np.zeros(len(uuids), dtype=bool)]
+        self.arrow_uuids = None
+
+    def add(self, data_events: Union[pd.DataFrame, pa.RecordBatch]) -> None:
+        """
+        Encodes a chunk of events (dataframe or arrow record batch) against the known customers and aggregates it
+        """
+        if isinstance(data_events, pa.RecordBatch):
+            self._add_batch(data_events)
+            return
+        # customers of the events. Events of unknown customers are discarded,
+        # like in a left join of customers and events data
+        event_customer = self.uuids.get_indexer(data_events[self.uuid_col])
+        unknown_uuids = data_events.loc[event_customer < 0, self.uuid_col]
+        self.null_counts[self.uuid_col] += int(unknown_uuids.isna().sum())
+        self._add_columns(
+            event_customer,
+            unknown_uuids.dropna().unique(),
+            _as_nanoseconds(data_events[self.event_time_col]),
+            getattr(data_events[self.event_time_col].dtype, "tz", None),
+            data_events[self.event_name_col].to_numpy(),
+            data_events[self.value_col].to_numpy(dtype=np.float32, na_value=np.nan),
+        )
+
+    def _add_batch(self, batch: pa.RecordBatch) -> None:
+        """
+        Encodes and aggregates an arrow record batch using arrow compute kernels, without converting it
+        to a dataframe first
+        """
+        if self.arrow_uuids is None:
+            self.arrow_uuids = pa.array(self.uuids.to_numpy(), type=pa.string())
+        uuid = batch.column(self.uuid_col).cast(pa.string())
+        event_customer = pc.index_in(uuid, value_set=self.arrow_uuids)
+        self.null_counts[self.uuid_col] += uuid.null_count
+        event_time = batch.column(self.event_time_col)
+        self._add_columns(
+            event_customer.fill_null(-1).to_numpy(),
+            pc.unique(uuid.filter(pc.is_null(event_customer))).drop_null().to_numpy(zero_copy_only=False),
+            event_time.cast(pa.timestamp("ns", event_time.type.tz)).cast(pa.int64()).fill_null(pd.NaT.value).to_numpy(),
+            event_time.type.tz,
+            batch.column(self.event_name_col).to_numpy(zero_copy_only=False),
+            batch.column(self.value_col).cast(pa.float32()).to_numpy(zero_copy_only=False),
+        )
+
+    def _add_columns(
+        self,
+        event_customer: np.ndarray,
+        unknown_uuids: np.ndarray,
+        event_ns: np.ndarray,
+        tz: object,
+        event_name: np.ndarray,
+        value: np.ndarray,
+    ) -> None:
+        """
+        Aggregates a chunk of events, already split in columns
+        Inputs
+            event_customer: code of the customer of each event, -1 if the customer is unknown
+            unknown_uuids: distinct customer-ids of the events of unknown customers
+            event_ns: time of each event, in nanoseconds since epoch (minimum int64 if missing)
+            tz: timezone of the time of the events
+            event_name: name of each event
+            value: float32 value of each event
+        """
+        self.null_counts[self.event_time_col] += int((event_ns == pd.NaT.value).sum())
+        self.null_counts[self.event_name_col] += int(pd.isna(event_name).sum())
+        self.null_counts[self.value_col] += int(np.isnan(value).sum())
+        known = event_customer >= 0
+        self.has_events[event_customer[known]] = True
+        self.unknown_uuids = self.unknown_uuids.union(unknown_uuids)
+
+        timed = np.flatnonzero(known & (event_ns != pd.NaT.value))
+        event_customer = event_customer[timed]
+        self.has_timed_events[event_customer] = True
+        self.events += len(timed)
+        if len(timed) > 0:
+            self.event_start = _min_timestamp(
+                self.event_start, _as_timestamp(event_ns[timed].min(), tz)
+            )
+            self.event_end = _max_timestamp(
+                self.event_end, _as_timestamp(event_ns[timed].max(), tz)
+            )
+
+        # keep the first occurrence of each event name in the order of the left join
+        # (i.e. by customer and then by position in the events data)
+        self.first_event_names.append(
+            pd.DataFrame(
+                {
+                    "name": event_name[timed],
+                    "customer": event_customer,
+                    "chunk": self.chunks,
+                    "row": timed,
+                }
+            )
+            .sort_values(["customer", "row"], kind="stable")
+            .drop_duplicates("name")
+        )
+        self.chunks += 1
+
+        # drop events which can't be placed in time relative to the registration
+        days_since_registration = _days_between(
+            self.registration_ns[event_customer], event_ns[timed]
+        )
+        valid = days_since_registration != MISSING_DAYS
+        value = value[timed][valid]
+        is_purchase = value > 0
+        value = np.nan_to_num(value.astype(np.float64))
+        entries = _aggregate_entries(
+            event_customer[valid],
+            days_since_registration[valid],
+            np.where(is_purchase, value, 0.0),
+            is_purchase.astype(np.int32),
+            value,
+        )
+        self.entries.append(entries)
+        self.entries_size += sum(array.nbytes for array in entries)
+        if self.entries_size - self.merged_size > self.memory_budget:
+            self._merge_entries()
+
+    def _merge_entries(self) -> None:
+        """
+        Merges the partial entries of all chunks received so far
+        """
+        if len(self.entries) == 0:
+            self.entries = [_empty_entries()]
+        entries = _aggregate_entries(
+            *[np.concatenate(arrays) for arrays in zip(*self.entries)]
+        )
+        self.entries = [entries]
+        self.entries_size = self.merged_size = sum(array.nbytes for array in entries)
+
+    def stats(self) -> Dict[str, object]:
+        """
+        Statistics of the events data aggregated so far
+        """
+        event_list = []
+        if len(self.first_event_names) > 0:
+            event_list = list(
+                pd.concat(self.first_event_names)
+                .sort_values(["customer", "chunk", "row"], kind="stable")
+                .drop_duplicates("name")["name"]
+            )
+        return {
+            "event_start": self.event_start,
+            "event_end": self.event_end,
+            "event_customers": int(self.has_timed_events.sum()),
+            "events": self.events,
+            "event_list": event_list,
+            "unique_event_types": int(pd.notna(event_list).sum()),
+            "customers_with_events": int(self.has_events.sum()),
+            "unknown_event_customers": len(self.unknown_uuids),
+            "event_null_counts": dict(self.null_counts),
+        }
+
+    def take_entries(self) -> Tuple[np.ndarray, ...]:
+        """
+        Merged entries of the events aggregated since the last call. They are released, while the statistics
+        keep covering all events, so that the aggregator can be used again for new events
+        """
+        self._merge_entries()
+        entries = self.entries[0]
+        self.entries = []
+        self.entries_size = self.merged_size = 0
+        return entries
+
+    def matrix(self, customer_age: np.ndarray) -> RevenueMatrix:
+        """
+        RevenueMatrix with all the events aggregated so far
+        """
+        return RevenueMatrix.from_entries(*self.take_entries(), customer_age=customer_age)
+
+
+class PreparedData:
+    """
+    Columnar store of the customers and events data, built once and shared by all analyses.
+    Customers are dictionary-encoded into integer codes (their position in [uuids]) and events are
+    reduced, one chunk at a time, into a RevenueMatrix of customers by days since registration.
+
+    Customers
+        - uuids: distinct customer-ids. The code of a customer is its position in this index
+        - registration_time: registration timestamp (datetime64[ns]) of each customer
+        - customer_age: full days between the registration of the customer and the last event in the data
+        - segments: categorical value of each segment feature for each customer
+    Events
+        - matrix: revenue, purchases and value of each customer per day since registration, only for
+          events of known customers where both timestamps are defined
+        - stats: statistics of the customers and events data, e.g. date ranges and number of events
+        - aggregator: the EventsAggregator that built the matrix (if any), kept to add new customers and events
+          incrementally, see append_customers and append_events
+    """
+
+    def __init__(
+        self,
+        uuids: pd.Index,
+        registration_time: np.ndarray,
+        segments: Dict[str, pd.Categorical],
+        matrix: RevenueMatrix,
+        end_events_date: pd.Timestamp,
+        stats: DatasetStats,
+        aggregator: EventsAggregator = None,
+    ) -> None:
+        self.uuids = uuids
+        self.registration_time = registration_time
+        self.segments = segments
+        self.matrix = matrix
+        self.end_events_date = end_events_date
+        self.stats = stats
+        self.aggregator = aggregator
+        self._fingerprint = None
+
+    @property
+    def n_customers(self) -> int:
+        return self.matrix.n_customers
+
+    @property
+    def customer_age(self) -> np.ndarray:
+        return self.matrix.customer_age
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory (in bytes) of the customers (customer-ids, registration times and segments) and of the revenue matrix
+        """
+        arrays = [getattr(self.matrix, name) for name in RevenueMatrix.ARRAYS] + [self.registration_time]
+        arrays += [segment.codes for segment in self.segments.values()]
+        return int(self.uuids.memory_usage(deep=True)) + sum(array.nbytes for array in arrays)
+
+    def fingerprint(self) -> str:
+        """
+        Hash of the data that the analyses read (revenue matrix, segments, last event date and statistics), calculated
+        once and again after new data is appended. Stores with the same fingerprint give the same results
+        """
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            arrays = [getattr(self.matrix, name) for name in RevenueMatrix.ARRAYS if name != "rows"]
+            for col, segment in self.segments.items():
+                digest.update(repr((col, segment.categories.tolist())).encode())
+                arrays.append(segment.codes)
+            for array in arrays:
+                digest.update(array.dtype.str.encode())
+                digest.update(np.ascontiguousarray(array).data)
+            digest.update(repr((self.end_events_date, dict(self.stats))).encode())
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
+
+    def select(self, customers: np.ndarray) -> "PreparedData":
+        """
+        Store with only the customers of [customers] (sorted customer codes) and their events, e.g. one segment.
+        The last event date is kept, so the age of each customer does not change. Only the statistics of the
+        customers are recalculated: the events statistics are aggregated before the customers are known, so they
+        are not available for a subset, and events of unknown customers do not belong to any subset
+        """
+        matrix = self.matrix.select(customers)
+        registration_time = self.registration_time[customers]
+        registration = pd.DatetimeIndex(registration_time)
+        event_customers = int(np.count_nonzero(np.diff(matrix.indptr)))
+        stats = DatasetStats(
+            registration_start=registration.min(),
+            registration_end=registration.max(),
+            customers=len(customers),
+            event_customers=event_customers,
+            customers_with_events=event_customers,
+            unknown_event_customers=0,
+        )
+        return PreparedData(
+            uuids=self.uuids[customers] if self.uuids is not None else None,
+            registration_time=registration_time,
+            segments={col: segment[customers] for col, segment in self.segments.items()},
+            matrix=matrix,
+            end_events_date=self.end_events_date,
+            stats=stats,
+        )
+
+    @classmethod
+    def from_frames(
+        cls,
+        data_customers: pd.DataFrame,
+        data_events: pd.DataFrame,
+        uuid_col: str,
+        registration_time_col: str,
+        event_time_col: str,
+        event_name_col: str,
+        value_col: str,
+        segment_feature_cols: List[str],
+        memory_budget: int,
+    ) -> "PreparedData":
+        """
+        Builds the store from the customers and events dataframes, processing the events in
+        slices that fit in [memory_budget] bytes
+        """
+        chunk_size = max(1, memory_budget // BYTES_PER_EVENT)
+        return cls.from_chunks(
+            data_customers,
+            (
+                data_events.iloc[start:start + chunk_size]
+                for start in range(0, max(1, len(data_events)), chunk_size)
+            ),
+            uuid_col=uuid_col,
+            registration_time_col=registration_time_col,
+            event_time_col=event_time_col,
+            event_name_col=event_name_col,
+            value_col=value_col,
+            segment_feature_cols=segment_feature_cols,
+            memory_budget=memory_budget,
+        )
+
+    @classmethod
+    def from_chunks(
+        cls,
+        data_customers: pd.DataFrame,
+        event_chunks: Iterable[Union[pd.DataFrame, pa.RecordBatch]],
+        uuid_col: str,
+        registration_time_col: str,
+        event_time_col: str,
+        event_name_col: str,
+        value_col: str,
+        segment_feature_cols: List[str],
+        memory_budget: int,
+    ) -> "PreparedData":
+        """
+        Builds the store from the customers dataframe and an iterable of events dataframes or arrow record batches, using only
+        vectorised operations. Each customer is kept once (first registration found), and events whose
+        customer-id is not in the customers data are discarded, which is equivalent to a left join of
+        customers and events. Only one chunk of events is in memory at a time
+        """
+        # customers table: one row per customer
+        customer_rows = ~data_customers[[uuid_col, registration_time_col]].duplicated()
+        first_rows = ~data_customers[uuid_col].duplicated() & data_customers[uuid_col].notna()
+        customers = data_customers.loc[first_rows, [uuid_col, registration_time_col] + segment_feature_cols]
+        uuids = pd.Index(customers[uuid_col].to_numpy(), name=uuid_col)
+        registration_ns = _as_nanoseconds(customers[registration_time_col])
+        segments = {
+            col: pd.Categorical(customers[col].to_numpy()) for col in segment_feature_cols
+        }
+
+        # events: aggregated chunk by chunk
+        aggregator = EventsAggregator(
+            uuids,
+            registration_ns,
+            uuid_col=uuid_col,
+            event_time_col=event_time_col,
+            event_name_col=event_name_col,
+            value_col=value_col,
+            memory_budget=memory_budget,
+        )
+        for chunk in event_chunks:
+            aggregator.add(chunk)
+
+        # the registration dates of distinct rows have the same range as those of all rows, and
+        # the distinct (non-missing) customer-ids are the first rows of each customer
+        stats = DatasetStats(
+            registration_start=data_customers[registration_time_col].min(),
+            registration_end=data_customers[registration_time_col].max(),
+            customers=len(uuids),
+            customer_rows=int(customer_rows.sum()),
+            customer_null_counts={
+                col: int(data_customers[col].isna().sum()) for col in [uuid_col, registration_time_col]
+            },
+            **aggregator.stats(),
+        )
+        end_events_date = pd.Timestamp(stats["event_end"])
+        customer_age = _days_between(
+            registration_ns, np.full(len(uuids), end_events_date.value, dtype=np.int64)
+        )
+        return cls(
+            uuids=uuids,
+            registration_time=registration_ns.view("datetime64[ns]"),
+            segments=segments,
+            matrix=aggregator.matrix(customer_age),
+            end_events_date=end_events_date,
+            stats=stats,
+            aggregator=aggregator,
+        )
+
+    def append_customers(
+        self,
+        data_customers: pd.DataFrame,
+        uuid_col: str,
+        registration_time_col: str,
+        segment_feature_cols: List[str],
+    ) -> int:
+        """
+        Adds the customers of [data_customers] that are not known yet, in place and without going through the
+        known customers or events again. As when the store is built, the first registration of each customer is kept.
+        Returns the number of customers added
+        """
+        assert self.aggregator is not None, "Only data prepared from the customers and events data can be appended to"
+        customer_rows = ~data_customers[[uuid_col, registration_time_col]].duplicated()
+        known = self.uuids.get_indexer(data_customers[uuid_col])
+        # rows with the (first) registration of a known customer were already counted
+        repeated = (known >= 0) & (
+            _as_nanoseconds(data_customers[registration_time_col]) == self.registration_time.view(np.int64)[known]
+        )
+        first_rows = ~data_customers[uuid_col].duplicated() & data_customers[uuid_col].notna() & (known < 0)
+        customers = data_customers.loc[first_rows, [uuid_col, registration_time_col] + segment_feature_cols]
+        uuids = pd.Index(customers[uuid_col].to_numpy(), name=uuid_col)
+        registration_ns = _as_nanoseconds(customers[registration_time_col])
+
+        self.aggregator.add_customers(uuids, registration_ns)
+        self.uuids = self.aggregator.uuids
+        self.registration_time = np.concatenate([self.registration_time, registration_ns.view("datetime64[ns]")])
+        self.segments = {
+            col: union_categoricals([segment, pd.Categorical(customers[col].to_numpy())])
+            for col, segment in self.segments.items()
+        }
+        self.matrix = self.matrix.add_customers(
+            _days_between(registration_ns, np.full(len(uuids), self.end_events_date.value, dtype=np.int64))
+        )
+        self.stats = DatasetStats(
+            self.stats,
+            registration_start=_min_timestamp(self.stats["registration_start"], data_customers[registration_time_col].min()),
+            registration_end=_max_timestamp(self.stats["registration_end"], data_customers[registration_time_col].max()),
+            customers=len(self.uuids),
+            customer_rows=self.stats["customer_rows"] + int((customer_rows & ~repeated).sum()),
+            customer_null_counts={
+                col: count + int(data_customers[col].isna().sum())
+                for col, count in self.stats["customer_null_counts"].items()
+            },
+        )
+        self._fingerprint = None
+        return len(uuids)
+
+    def append_events(self, event_chunks: Iterable[Union[pd.DataFrame, pa.RecordBatch]]) -> int:
+        """
+        Adds events (an iterable of dataframes or arrow record batches) in place. Only the new events are encoded and
+        aggregated, and their entries are then merged into the matrix. If the last event date moves forward, the age
+        of the customers is updated, so newly matured customers enter the cohorts of the analyses.
+        Events of unknown customers are discarded, so new customers must be appended before their events.
+        Returns the number of events added
+        """
+        assert self.aggregator is not None, "Only data prepared from the customers and events data can be appended to"
+        events = self.aggregator.events
+        for chunk in event_chunks:
+            self.aggregator.add(chunk)
+        stats = DatasetStats(self.stats, **self.aggregator.stats())
+        end_events_date = pd.Timestamp(stats["event_end"])
+        customer_age = self.matrix.customer_age
+        if end_events_date != self.end_events_date:
+            customer_age = _days_between(
+                self.registration_time.view(np.int64),
+                np.full(self.n_customers, end_events_date.value, dtype=np.int64),
+            )
+        self.matrix = self.matrix.add_entries(*self.aggregator.take_entries(), customer_age=customer_age)
+        self.end_events_date = end_events_date
+        self.stats = stats
+        self._fingerprint = None
+        return self.aggregator.events - events
+
+    def save(self, path: str) -> None:
+        """
+        Writes the store to the directory [path]: each array in its own .npy file, the customer-ids in an Arrow IPC file
+        and the remaining (small) information in a json file. See load
+        """
+        os.makedirs(path, exist_ok=True)
+        arrays = {name: getattr(self.matrix, name) for name in RevenueMatrix.ARRAYS}
+        arrays["registration_time"] = self.registration_time
+        for i, segment in enumerate(self.segments.values()):
+            arrays[f"segment-{i}"] = segment.codes
+        meta = {
+            "version": STATE_VERSION,
+            "uuids_name": None if self.uuids is None else self.uuids.name,
+            "segment_categories": {col: segment.categories for col, segment in self.segments.items()},
+            "end_events_date": self.end_events_date,
+            "stats": self.stats,
+            "fingerprint": self.fingerprint(),
+            "aggregator": None,
+        }
+        if self.aggregator is not None:
+            aggregator_arrays, meta["aggregator"] = self.aggregator.state()
+            arrays.update({f"aggregator-{name}": array for name, array in aggregator_arrays.items()})
+
+        for name, array in arrays.items():
+            np.save(os.path.join(path, f"{name}.npy"), array)
+        if self.uuids is not None:
+            table = pa.table({"uuid": pa.array(self.uuids.to_numpy(), type=pa.string())})
+            with pa.OSFile(os.path.join(path, "uuids.arrow"), "wb") as file:
+                with pa.ipc.new_file(file, table.schema) as writer:
+                    writer.write_table(table)
+        with open(os.path.join(path, "meta.json"), "w") as file:
+            json.dump(meta, file, default=_json_default)
+
+    @classmethod
+    def load(cls, path: str) -> "PreparedData":
+        """
+        Reads a store written by save. The arrays and the customer-ids are memory-mapped and not read: their pages are
+        loaded by the operating system when used and shared by all processes that load the same files
+        """
+        assert os.path.exists(
+            os.path.join(path, "meta.json")
+        ), f"{path} has no meta.json: it is not a store written by PreparedData.save of version {STATE_VERSION}"
+        with open(os.path.join(path, "meta.json")) as file:
+            meta = json.load(file, object_hook=_json_object)
+        assert (
+            meta["version"] == STATE_VERSION
+        ), f"The data in {path} was written with version {meta['version']} of the format, but only version {STATE_VERSION} can be read"
+
+        def load_array(name: str) -> np.ndarray:
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r").view(np.ndarray)
+
+        uuids = None
+        if os.path.exists(os.path.join(path, "uuids.arrow")):
+            table = pa.ipc.open_file(pa.memory_map(os.path.join(path, "uuids.arrow"))).read_all()
+            uuids = pd.Index(pd.arrays.ArrowStringArray(table.column("uuid")), name=meta["uuids_name"])
+        registration_time = load_array("registration_time")
+        aggregator = None
+        if meta["aggregator"] is not None:
+            aggregator = EventsAggregator.from_state(
+                uuids,
+                registration_time.view(np.int64),
+                {name: load_array(f"aggregator-{name}") for name in EventsAggregator.STATE_ARRAYS},
+                meta["aggregator"],
+            )
+        prepared = cls(
+            uuids=uuids,
+            registration_time=registration_time,
+            segments={
+                col: pd.Categorical.from_codes(load_array(f"segment-{i}"), categories=categories)
+                for i, (col, categories) in enumerate(meta["segment_categories"].items())
+            },
+            matrix=RevenueMatrix(**{name: load_array(name) for name in RevenueMatrix.ARRAYS}),
+            end_events_date=meta["end_events_date"],
+            stats=DatasetStats(meta["stats"]),
+            aggregator=aggregator,
+        )
+        # the fingerprint is saved, so loading does not read all the data to calculate it
+        prepared._fingerprint = meta["fingerprint"]
+        return prepared
@@ -0,0 +1,240 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Module providing an opt-in profiler of the stages of the analyses"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List
+
+import pandas as pd
+
+
+class _Stage:
+    """
+    Measurements of one execution of a stage. [rows_in] and [rows_out] can be set while the stage runs
+    """
+
+    def __init__(self, profiler: "Profiler", name: str, rows_in: int = None) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+    def __enter__(self) -> "_Stage":
+        profiler = self.profiler
+        self.parent = profiler.stack[-1] if len(profiler.stack) > 0 else None
+        self.depth = len(profiler.stack)
+        # the peak of traced memory is reset at the start of each stage, so the running peak of the
+        # enclosing stage is saved before
+        current, peak = tracemalloc.get_traced_memory()
+        if self.parent is not None:
+            self.parent.peak = max(self.parent.peak, peak)
+        tracemalloc.reset_peak()
+        self.start_memory = current
+        self.peak = current
+        profiler.stack.append(self)
+        self.start_time = time.time()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        wall = time.perf_counter() - self.start_wall
+        cpu = time.process_time() - self.start_cpu
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        if self.parent is not None:
+            self.parent.peak = max(self.parent.peak, self.peak)
+        tracemalloc.reset_peak()
+        self.profiler.stack.pop()
+        self.profiler.records.append(
+            {
+                "stage": self.name,
+                "parent": self.parent.name if self.parent is not None else None,
+                "depth": self.depth,
+                "start": self.start_time,
+                "wall_seconds": wall,
+                "cpu_seconds": cpu,
+                "rows_in": self.rows_in,
+                "rows_out": self.rows_out,
+                "peak_memory_mb": (self.peak - self.start_memory) / 2**20,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+            }
+        )
+
+
+class _NullStage:
+    """
+    Stage used when profiling is off: it measures nothing and ignores the rows that are set
+    """
+
+    rows_in = None
+    rows_out = None
+
+    def __enter__(self) -> "_NullStage":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        return None
+
+    def __setattr__(self, name: str, value: object) -> None:
+        return None
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profiler:
+    """
+    Records the wall time, CPU time, rows in/out and peak allocated memory (traced by tracemalloc) of each
+    stage of the analyses. Stages can be nested, and the peak memory of a stage includes its inner stages.
+    When it is not enabled, a stage is a shared object that does nothing, so the overhead is a function call
+    """
+
+    COLUMNS = [
+        "stage",
+        "parent",
+        "depth",
+        "start",
+        "wall_seconds",
+        "cpu_seconds",
+        "rows_in",
+        "rows_out",
+        "peak_memory_mb",
+        "pid",
+        "tid",
+    ]
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = False
+        self.records: List[Dict[str, object]] = []
+        self.stack: List[_Stage] = []
+        self._started_tracing = False
+        if enabled:
+            self.enable()
+
+    def enable(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self.enabled = True
+
+    def disable(self) -> None:
+        if self._started_tracing and len(self.stack) == 0:
+            tracemalloc.stop()
+            self._started_tracing = False
+        self.enabled = False
+
+    def stage(self, name: str, rows_in: int = None):
+        """
+        Context manager measuring a stage, e.g. with profiler.stage('groupby', rows_in=len(data)) as stage
+        """
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, rows_in)
+
+    def table(self) -> pd.DataFrame:
+        """
+        One row per execution of a stage, in the order in which the stages started
+        """
+        return (
+            pd.DataFrame(self.records, columns=self.COLUMNS)
+            .sort_values("start", kind="stable")
+            .reset_index(drop=True)
+        )
+
+    def reset(self) -> None:
+        self.records = []
+
+    def chrome_trace(self) -> Dict[str, object]:
+        """
+        The recorded stages as spans in the Chrome Trace Event format, which can be opened in chrome://tracing
+        or ui.perfetto.dev. Stages of other processes (e.g. workers of run_all) are shown in their own rows
+        """
+        events = []
+        for pid in sorted({record["pid"] for record in self.records}):
+            events.append(
+                {
+                    "name": "process_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "args": {"name": "main" if pid == os.getpid() else f"worker {pid}"},
+                }
+            )
+        for record in self.records:
+            events.append(
+                {
+                    "name": record["stage"],
+                    "cat": record["parent"] or "report",
+                    "ph": "X",
+                    "ts": record["start"] * 10**6,
+                    "dur": record["wall_seconds"] * 10**6,
+                    "pid": record["pid"],
+                    "tid": record["tid"],
+                    "args": {
+                        key: record[key]
+                        for key in ["cpu_seconds", "rows_in", "rows_out", "peak_memory_mb"]
+                    },
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save_chrome_trace(self, path: str) -> None:
+        """
+        Writes the recorded stages to a json file in the Chrome Trace Event format
+        """
+        with open(path, "w") as file:
+            json.dump(self.chrome_trace(), file)
+
+    @contextmanager
+    def session(self) -> Iterator["Profiler"]:
+        """
+        Enables the profiler while the context is open, restoring its previous state afterwards
+        """
+        enabled = self.enabled
+        self.enable()
+        try:
+            yield self
+        finally:
+            if not enabled:
+                self.disable()
+
+
+def count_rows(data: object) -> int:
+    """
+    Number of rows of a dataframe (or of the dataframe in a (figure, dataframe) output), else None
+    """
+    if isinstance(data, tuple) and len(data) == 2:
+        data = data[1]
+    return len(data) if isinstance(data, (pd.DataFrame, pd.Series)) else None
+
+
+def profiled(method: Callable) -> Callable:
+    """
+    Decorator of methods of objects with a [profiler], measuring each call as a stage named after the method.
+    Rows in are the rows of the first dataframe received, else the entries of the prepared data (if any).
+    Rows out are the rows of the dataframe returned
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not self.profiler.enabled:
+            return method(self, *args, **kwargs)
+        rows_in = next(
+            (count_rows(arg) for arg in args if isinstance(arg, pd.DataFrame)), None
+        )
+        if rows_in is None and getattr(self, "prepared", None) is not None:
+            rows_in = len(self.prepared.matrix.days)
+        with self.profiler.stage(method.__name__, rows_in=rows_in) as stage:
+            output = method(self, *args, **kwargs)
+            stage.rows_out = count_rows(output)
+        return output
+
+    return wrapper
@@ -0,0 +1,329 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Module providing readers of events data stored in files"""
+import os
+from typing import BinaryIO, Callable, Iterator, List, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+EVENT_FILE_SUFFIXES = (".parquet", ".csv", ".csv.gz")
+# fixed formats tried to parse the time columns read as text. When several of them parse the same share of the sample
+# to different times (e.g. month-first and day-first dates without days above 12), the format must be given
+TIME_FORMATS = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y/%m/%d",
+    "%Y%m%d%H%M%S",
+    "%Y%m%d",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y",
+    "%d/%m/%Y %H:%M:%S",
+    "%d/%m/%Y",
+    "%d.%m.%Y",
+]
+# formats of digits only, which match only values of their exact width (otherwise epoch times could match them)
+COMPACT_TIME_FORMATS = ["%Y%m%d%H%M%S", "%Y%m%d"]
+# units of epoch times, and the years [start, end) of the epoch times accepted for the detected unit
+EPOCH_UNITS = ["s", "ms", "us", "ns"]
+EPOCH_YEARS = (1990, 2100)
+TIME_SAMPLE_ROWS = 1000
+# share of the sample that a format must parse to be used for the whole column
+MIN_PARSED_SHARE = 0.9
+
+
+def list_event_files(path: str) -> List[str]:
+    """
+    Returns all parquet and csv files inside the directory [path] and its sub-directories, sorted by path.
+    If [path] is a file, returns only it
+    """
+    if os.path.isfile(path):
+        return [path]
+    files = [
+        os.path.join(root, name)
+        for root, _, names in os.walk(path)
+        for name in names
+        if name.endswith(EVENT_FILE_SUFFIXES)
+    ]
+    if len(files) == 0:
+        raise ValueError(f"No parquet or csv files were found in {path}")
+    return sorted(files)
+
+
+def read_event_files(
+    path: str,
+    uuid_col: str,
+    event_time_col: str,
+    event_name_col: str,
+    value_col: str,
+    chunk_rows: int,
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads the events data from a file or directory of parquet/csv files, yielding one chunk of at most
+    [chunk_rows] rows at a time. Only the columns used by the analyses are read.
+    Customer-ids and event names are read as strings and the event time is parsed as datetime
+    """
+    columns = [uuid_col, event_time_col, event_name_col, value_col]
+    for file in list_event_files(path):
+        if file.endswith(".parquet"):
+            for batch in pq.ParquetFile(file).iter_batches(
+                batch_size=chunk_rows, columns=columns
+            ):
+                yield batch.to_pandas(coerce_temporal_nanoseconds=True)
+        else:
+            yield from pd.read_csv(
+                file,
+                usecols=columns,
+                dtype={uuid_col: str, event_name_col: str},
+                parse_dates=[event_time_col],
+                chunksize=chunk_rows,
+            )
+
+
+def _date_filter(column: str, date_range: Tuple[str, str]) -> ds.Expression:
+    """
+    Filter expression selecting the rows where [column] is in [date_range] = (start, end), with start
+    inclusive and end exclusive. Any of the limits can be None. Returns None if there is no limit
+    """
+    start, end = date_range if date_range is not None else (None, None)
+    expressions = []
+    if start is not None:
+        expressions.append(ds.field(column) >= pd.Timestamp(start))
+    if end is not None:
+        expressions.append(ds.field(column) < pd.Timestamp(end))
+    if len(expressions) == 0:
+        return None
+    return expressions[0] if len(expressions) == 1 else expressions[0] & expressions[1]
+
+
+def read_customers_dataset(
+    dataset: ds.Dataset,
+    uuid_col: str,
+    registration_time_col: str,
+    segment_feature_cols: List[str],
+    date_range: Tuple[str, str] = None,
+) -> pd.DataFrame:
+    """
+    Reads the customers data from an arrow dataset. Only the columns used by the analyses are read and
+    the registration [date_range] filter is pushed down to the scan, so that files, partitions and row
+    groups outside of it are skipped
+    """
+    return dataset.to_table(
+        columns=[uuid_col, registration_time_col] + segment_feature_cols,
+        filter=_date_filter(registration_time_col, date_range),
+    ).to_pandas(coerce_temporal_nanoseconds=True)
+
+
+def scan_events_dataset(
+    dataset: ds.Dataset,
+    uuid_col: str,
+    event_time_col: str,
+    event_name_col: str,
+    value_col: str,
+    chunk_rows: int,
+    date_range: Tuple[str, str] = None,
+) -> Iterator[pa.RecordBatch]:
+    """
+    Scans the events data of an arrow dataset, yielding record batches of at most [chunk_rows] rows.
+    Only the columns used by the analyses are read and the event [date_range] filter is pushed down
+    to the scan. Batches are not converted to dataframes
+    """
+    scanner = dataset.scanner(
+        columns=[uuid_col, event_time_col, event_name_col, value_col],
+        filter=_date_filter(event_time_col, date_range),
+        batch_size=chunk_rows,
+    )
+    for batch in scanner.to_batches():
+        if batch.num_rows > 0:
+            yield batch
+
+
+def _epoch_range(unit: str) -> Tuple[float, float]:
+    """
+    Epoch times (in [unit]) of the start of the first and last of the EPOCH_YEARS
+    """
+    return tuple((pd.Timestamp(year=year, month=1, day=1) - pd.Timestamp(0)) / pd.Timedelta(1, unit) for year in EPOCH_YEARS)
+
+
+def _epoch_unit(sample: pa.ChunkedArray) -> str:
+    """
+    Unit in which the numbers of [sample] are epoch times in the EPOCH_YEARS, or None if there is none
+    """
+    numbers = pd.to_numeric(sample.to_pandas(), errors="coerce")
+    for unit in EPOCH_UNITS:
+        start, end = _epoch_range(unit)
+        if ((numbers >= start) & (numbers < end)).mean() >= MIN_PARSED_SHARE:
+            return unit
+    return None
+
+
+def _parse_epoch(values: pa.ChunkedArray, unit: str) -> pa.ChunkedArray:
+    """
+    Parses epoch times in [unit]. Values that are not numbers or outside of the EPOCH_YEARS become null
+    """
+    try:
+        numbers = values.cast(pa.float64())
+    except pa.ArrowInvalid:
+        numbers = pa.chunked_array([pa.array(pd.to_numeric(values.to_pandas(), errors="coerce"), type=pa.float64())])
+    start, end = _epoch_range(unit)
+    numbers = pc.if_else(
+        pc.and_(pc.greater_equal(numbers, start), pc.less(numbers, end)), numbers, pa.scalar(None, pa.float64())
+    )
+    return pc.round(numbers).cast(pa.int64()).cast(pa.timestamp(unit)).cast(pa.timestamp("ns"))
+
+
+def _parse_format(values: pa.ChunkedArray, time_format: str) -> pa.ChunkedArray:
+    """
+    Parses times with a strptime [time_format]. Values that do not match it become null
+    """
+    parsed = pc.strptime(values, format=time_format, unit="ns", error_is_null=True)
+    if time_format in COMPACT_TIME_FORMATS:
+        width = len(pd.Timestamp(0).strftime(time_format))
+        parsed = pc.if_else(pc.equal(pc.utf8_length(values), width), parsed, pa.scalar(None, pa.timestamp("ns")))
+    return parsed
+
+
+def _detect_format(sample: pa.ChunkedArray) -> str:
+    """
+    The one of the TIME_FORMATS that parses the largest share of [sample] (at least MIN_PARSED_SHARE), or None.
+    Raises a ValueError if several formats parse that share to different times
+    """
+    parsed = {time_format: _parse_format(sample, time_format) for time_format in TIME_FORMATS}
+    shares = {time_format: 1 - times.null_count / len(sample) for time_format, times in parsed.items()}
+    best = max(shares.values())
+    if best < MIN_PARSED_SHARE:
+        return None
+    formats = [time_format for time_format, share in shares.items() if share == best]
+    if any(not parsed[time_format].equals(parsed[formats[0]]) for time_format in formats[1:]):
+        raise ValueError(
+            f"The times (e.g. {sample[0]}) match the formats {formats}, which give different dates. "
+            "Pass the format of the times as time_format"
+        )
+    return formats[0]
+
+
+def _naive_utc(times: pd.Series) -> pa.ChunkedArray:
+    """
+    Times parsed by pandas with utc=True, as timestamps (ns) in UTC without time zone
+    """
+    return pa.chunked_array([pa.array(times.dt.tz_localize(None), type=pa.timestamp("ns"))])
+
+
+def parse_times(values: pa.ChunkedArray, time_format: str = None) -> pa.ChunkedArray:
+    """
+    Parses a column of times read as text into timestamps (ns) in UTC without time zone. The format is
+    [time_format] (a strptime format) if given, otherwise it is detected on a sample of the values (it must
+    parse at least MIN_PARSED_SHARE of them) and then applied to the whole column:
+        - one of the fixed TIME_FORMATS, parsed by arrow
+        - epoch times (numbers) in the EPOCH_YEARS, with the unit (s, ms, us or ns) given by their magnitude
+        - ISO 8601 times, also with fractional seconds or time zones
+    Values that do not match the format become null, with a warning. If no format is detected, the format is
+    inferred by pandas for each value, which is much slower
+    """
+    sample = values.drop_null().slice(0, TIME_SAMPLE_ROWS)
+    if len(sample) == 0:
+        return values.cast(pa.timestamp("ns"))
+    time_format = _detect_format(sample) if time_format is None else time_format
+    if time_format is not None:
+        parsed = _parse_format(values, time_format)
+    elif _epoch_unit(sample) is not None:
+        time_format = f"epoch ({_epoch_unit(sample)})"
+        parsed = _parse_epoch(values, _epoch_unit(sample))
+    elif pd.to_datetime(sample.to_pandas(), format="ISO8601", errors="coerce", utc=True).notna().mean() >= MIN_PARSED_SHARE:
+        time_format = "ISO8601"
+        try:
+            parsed = values.cast(pa.timestamp("ns"))
+        except pa.ArrowInvalid:
+            # times with zone offsets are converted to UTC
+            parsed = _naive_utc(pd.to_datetime(values.to_pandas(), format="ISO8601", errors="coerce", utc=True))
+    else:
+        return _naive_utc(pd.to_datetime(values.to_pandas(), errors="coerce", utc=True))
+    failed = parsed.null_count - values.null_count
+    if failed > 0:
+        print(f"Warning: {failed} times could not be parsed with the format {time_format} and are null")
+    return parsed
+
+
+def read_table_file(
+    source: BinaryIO,
+    file_name: str,
+    string_cols: List[str],
+    time_cols: List[str],
+    numeric_cols: List[str],
+    block_size: int = 16 * 2**20,
+    progress: Callable[[float], None] = None,
+    time_format: str = None,
+) -> pd.DataFrame:
+    """
+    Reads only the given columns of a .csv, .csv.gz or .parquet file (e.g. an upload) with declared types, with the
+    multi-threaded arrow readers. Time columns of csv files are read as text and parsed with parse_times.
+    Strings are returned as string[pyarrow] columns
+    Inputs
+        - source: binary file object
+        - file_name: name of the file, used to detect its format
+        - string_cols, time_cols, numeric_cols: columns read as strings, timestamps and float64
+        - block_size: bytes of csv (after decompression) read at a time
+        - progress: function called with the share of the file read (between 0 and 1) after each block
+        - time_format: strptime format of the time columns read as text (detected by default, see parse_times)
+    """
+    columns = string_cols + time_cols + numeric_cols
+    source.seek(0, os.SEEK_END)
+    size = max(source.tell(), 1)
+    source.seek(0)
+    batches = []
+    if file_name.endswith(".parquet"):
+        parquet_file = pq.ParquetFile(source)
+        rows = max(parquet_file.metadata.num_rows, 1)
+        read_rows = 0
+        for batch in parquet_file.iter_batches(columns=columns):
+            batches.append(batch)
+            read_rows += batch.num_rows
+            if progress is not None:
+                progress(min(read_rows / rows, 1.0))
+    else:
+        stream = pa.input_stream(source, compression="gzip" if file_name.endswith(".gz") else None)
+        reader = pcsv.open_csv(
+            stream,
+            read_options=pcsv.ReadOptions(block_size=block_size),
+            convert_options=pcsv.ConvertOptions(
+                include_columns=columns,
+                strings_can_be_null=True,
+                column_types={
+                    **{col: pa.string() for col in string_cols + time_cols},
+                    **{col: pa.float64() for col in numeric_cols},
+                },
+            ),
+        )
+        for batch in reader:
+            batches.append(batch)
+            if progress is not None:
+                progress(min(source.tell() / size, 1.0))
+    table = pa.Table.from_batches(batches) if len(batches) > 0 else pa.table(
+        {col: pa.array([], pa.string()) for col in columns}
+    )
+
+    arrays = {}
+    for col in columns:
+        array = table.column(col)
+        if col in time_cols:
+            array = parse_times(array, time_format) if pa.types.is_string(array.type) else array.cast(pa.timestamp("ns"))
+        elif col in numeric_cols:
+            array = array.cast(pa.float64())
+        else:
+            array = array.cast(pa.string())
+        arrays[col] = array
+    if progress is not None:
+        progress(1.0)
+    # strings stay in arrow memory (string[pyarrow]) instead of becoming python objects
+    return pa.table(arrays).to_pandas(
+        coerce_temporal_nanoseconds=True, types_mapper={pa.string(): pd.StringDtype("pyarrow")}.get
+    )
@@ -0,0 +1,190 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Module providing an on-disk cache of the dataframes returned by the analyses"""
+import functools
+import hashlib
+import inspect
+import json
+import os
+import uuid
+from typing import Callable, Dict, Iterable, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+# part of every key, to be changed whenever the results of the analyses change for the same inputs
+CACHE_VERSION = 2
+# parquet metadata with the inputs of the call after it ran, see ResultCache.put
+INPUTS_METADATA = b"ltv_inputs"
+CACHE_SUFFIX = ".parquet"
+
+
+def _json_value(value: object) -> object:
+    """Numpy arrays as lists, numpy scalars as python numbers and anything else as text, for json"""
+    return value.tolist() if hasattr(value, "tolist") else str(value)
+
+
+class ResultCache:
+    """
+    Directory of parquet files, one per result, named by a hash of the data and of the call that returned it
+    (content-addressed), so a result is reused by any process that runs the same analysis on the same data.
+    The least recently used results are deleted whenever the files take more than [max_size_mb] MB
+    """
+
+    def __init__(self, path: str, max_size_mb: float = 1024) -> None:
+        assert max_size_mb > 0, f"max_size_mb must be positive, not {max_size_mb}"
+        self.path = path
+        self.max_size = int(max_size_mb * 2**20)
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(fingerprint: str, name: str, inputs: Dict[str, object]) -> str:
+        """
+        Key of the result of the method [name] with [inputs] on the data with [fingerprint].
+        Dictionaries are keyed by their content, in any order
+        """
+        call = json.dumps([CACHE_VERSION, fingerprint, name, inputs], sort_keys=True, default=_json_value)
+        return hashlib.blake2b(call.encode(), digest_size=16).hexdigest()
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key + CACHE_SUFFIX)
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self._file(key))
+
+    def get(self, key: str) -> Tuple[pd.DataFrame, Dict[str, object]]:
+        """
+        Returns the result with [key] and the inputs of the call after it ran, or (None, None) if it is not cached
+        """
+        file = self._file(key)
+        try:
+            table = pq.read_table(file)
+            # the modification time is the time of last use, see _evict
+            os.utime(file)
+        except FileNotFoundError:
+            return None, None
+        inputs = json.loads(table.schema.metadata[INPUTS_METADATA])
+        return table.to_pandas(), inputs
+
+    def put(self, key: str, data: pd.DataFrame, inputs: Dict[str, object]) -> None:
+        """
+        Stores a result and the inputs of the call after it ran (some methods fill their dictionary inputs).
+        Dictionary inputs are stored as lists of (key, value) pairs, which keep their order
+        """
+        file = self._file(key)
+        if os.path.exists(file):
+            return
+        table = pa.Table.from_pandas(data)
+        table = table.replace_schema_metadata(
+            {
+                **table.schema.metadata,
+                INPUTS_METADATA: json.dumps(
+                    {name: list(value.items()) if isinstance(value, dict) else value for name, value in inputs.items()},
+                    sort_keys=True,
+                    default=_json_value,
+                ),
+            }
+        )
+        # written under a temporary name, so other processes never read a partial file
+        temporary = f"{file}.{uuid.uuid4().hex}.tmp"
+        pq.write_table(table, temporary)
+        os.replace(temporary, file)
+        self._evict()
+
+    def _entries(self) -> Iterable[Tuple[float, int, str]]:
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(CACHE_SUFFIX):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield stat.st_mtime, stat.st_size, entry.path
+
+    @property
+    def size(self) -> int:
+        """
+        Size of the cached results, in bytes
+        """
+        return sum(size for _, size, _ in self._entries())
+
+    def _evict(self) -> None:
+        """
+        Deletes the least recently used results until the results take at most max_size bytes
+        """
+        entries = sorted(self._entries())
+        size = sum(size for _, size, _ in entries)
+        for _, file_size, file in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+
+    def clear(self) -> None:
+        """
+        Deletes all cached results
+        """
+        for _, _, file in list(self._entries()):
+            os.remove(file)
+
+
+def result_key(
+    ltv, method: Callable, args: tuple, kwargs: Dict[str, object], ignore: Iterable[str] = ()
+) -> Tuple[str, Dict[str, object]]:
+    """
+    Key of the result of a call of [method] of [ltv] with [args] (without self) and [kwargs], and the inputs of the call by name,
+    including the default values, so that equivalent calls get the same key
+    """
+    inputs = _call_inputs(method, (ltv,) + tuple(args), kwargs, ignore)
+    return ltv.result_cache.key(ltv.prepared.fingerprint(), method.__name__, inputs), inputs
+
+
+def _call_inputs(method: Callable, args: tuple, kwargs: Dict[str, object], ignore: Iterable[str]) -> Dict[str, object]:
+    bound = inspect.signature(method).bind(*args, **kwargs)
+    bound.apply_defaults()
+    arguments = dict(bound.arguments)
+    arguments.pop("self")
+    # arguments collected by **kwargs are kept as inputs
+    for name, parameter in inspect.signature(method).parameters.items():
+        if parameter.kind == inspect.Parameter.VAR_KEYWORD:
+            arguments.update(arguments.pop(name, {}))
+    return {name: value for name, value in arguments.items() if name not in ignore}
+
+
+def cached(method: Callable = None, ignore: Iterable[str] = ()) -> Callable:
+    """
+    Decorator of methods of LTVexploratory that return a dataframe. When a result cache is set
+    (see LTVexploratory.set_result_cache), the result is read from the cache if the same method was called
+    with the same inputs on the same data, and stored in the cache otherwise.
+    Inputs in [ignore] do not change the result (e.g. the number of processes) and are not part of the key
+    """
+    if method is None:
+        return functools.partial(cached, ignore=ignore)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = getattr(self, "result_cache", None)
+        if cache is None:
+            return method(self, *args, **kwargs)
+        key, inputs = result_key(self, method, args, kwargs, ignore)
+        output, cached_inputs = cache.get(key)
+        if output is not None:
+            # dictionary inputs get the values that the method left in them
+            for name, value in inputs.items():
+                if isinstance(value, dict) and isinstance(cached_inputs.get(name), list):
+                    value.clear()
+                    value.update((key, item) for key, item in cached_inputs[name])
+            return output
+        output = method(self, *args, **kwargs)
+        if isinstance(output, pd.DataFrame):
+            cache.put(key, output, inputs)
+        return output
+
+    return wrapper
@@ -2,11 +2,21 @@
 
 # This source code is licensed under the BSD-style license found in the
 # LICENSE file in the root directory of this source tree.
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Tuple
 import pandas as pd
 import numpy as np
 from src.synth_scenarios import BaseScenario, IAPAppScenario
 
 
+# number of shards of get_data_parallel. The output depends on it, but not on the number of processes
+DEFAULT_SHARDS = 64
+
+# generator of the data in each worker process of get_data_parallel
+_worker_synthetic_data = None
+
+
 class LTVSyntheticData():
     def __init__(self,
                  n_users: int = 100000,
@@ -15,7 +25,8 @@ class LTVSyntheticData():
                  start_date: str = '2020-01-01',
                  end_date: str = '2022-12-31',
                  synthetic_scenario: BaseScenario = None,
-                 random_seed: int = None
+                 random_seed: int = None,
+                 event_sampling: str = 'daily'
                  ) -> None:
         """
         Inputs
@@ -27,7 +38,12 @@ class LTVSyntheticData():
             - synthetic_scenario: the type of scenario to generate the data for. Takes BaseScenario instance as input or name of the scenario.
                 Default scenario: IAPAppScenario
             - random_seed: random seed of the pseud-random number generator used in the synthetic_scenario
+            - event_sampling: how revenue events are generated.
+                'daily': every day of every customer is evaluated, which needs a row per customer and day in the date range
+                'direct': the days with purchases of converted customers are sampled directly, with the same distribution,
+                          so only rows with revenue are allocated. Recommended for more than ~100k customers
         """
+        assert event_sampling in ['daily', 'direct'], f"event_sampling must be 'daily' or 'direct', not {event_sampling}"
         # Base Parameters
         self.n_users = n_users
         self.registration_event_name = registration_event_name
@@ -41,22 +57,90 @@ class LTVSyntheticData():
         self.synthetic_scenario = synthetic_scenario if synthetic_scenario is not None else IAPAppScenario(
             n_users, start_date, end_date, random_seed)
         self.event_name = event_name if event_name is not None else 'iap_purchase'
+        self.event_sampling = event_sampling
+        self.random_seed = random_seed
 
     def get_customers_data(self):
         """
         Get dataframe containing base costumer data, such as their user id, country, device, and download method for the app
         """
-        customer_data = self._get_base_user_ids()
+        self.customer_data = self._get_customers_batch(0, self.n_users)
+        return self.customer_data
+
+    def get_events_data(self):
+        return self._get_events_batch(self.customer_data)
+
+    def iter_batches(self, batch_size: int = 100000) -> Iterator[Tuple[pd.DataFrame, pd.DataFrame]]:
+        """
+        Generates the customers and events data in batches of [batch_size] customers, so that memory depends only on the
+        size of the batch. Yields a tuple (customers, events) per batch, with the same columns as get_customers_data and
+        get_events_data. Customer ids continue from one batch to the next, as if all customers were generated at once.
+        The random numbers are drawn in a different order, so the data is statistically equivalent, but not identical,
+        to the data generated at once
+        """
+        for start in range(0, self.n_users, batch_size):
+            customer_data = self._get_customers_batch(start, min(batch_size, self.n_users - start))
+            yield customer_data, self._get_events_batch(customer_data)
+
+    def get_data_parallel(self, n_shards: int = DEFAULT_SHARDS, n_jobs: int = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Generates the customers and events data in a pool of worker processes. The customers are split into [n_shards]
+        consecutive shards and each shard draws from its own stream of random numbers, spawned from random_seed or, if it is
+        None, from a number drawn from the generator of the synthetic_scenario (so a seeded scenario is enough).
+        For a given seed and number of shards the output is identical, whatever the number of processes.
+        The data is statistically equivalent, but not identical, to that of get_customers_data and get_events_data
+        Inputs
+            - n_shards: number of shards of customers
+            - n_jobs: number of worker processes. If None, the number of cpus. With 1, shards are generated in this process
+        Returns the customers and events data
+        """
+        assert n_shards > 0, f"n_shards must be positive, not {n_shards}"
+        entropy = self.random_seed if self.random_seed is not None else int(self.synthetic_scenario.rng.integers(2**63))
+        seeds = np.random.SeedSequence(entropy).spawn(n_shards)
+        bounds = [i * self.n_users // n_shards for i in range(n_shards + 1)]
+        shards = [(bounds[i], bounds[i + 1] - bounds[i], seeds[i]) for i in range(n_shards)]
+        n_jobs = min(n_jobs or os.cpu_count() or 1, n_shards)
+        if n_jobs == 1:
+            output = [self._get_shard(*shard) for shard in shards]
+        else:
+            # the generator is sent once to each worker, instead of once per shard
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(self,)) as executor:
+                output = list(executor.map(_generate_shard, *zip(*shards)))
+        self.customer_data = pd.concat([customers for customers, _ in output], ignore_index=True)
+        events_data = pd.concat([events for _, events in output], ignore_index=True)
+        return self.customer_data, events_data
+
+    def _get_shard(self, start: int, n_users: int, seed: np.random.SeedSequence) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Customers and events data of the customers [start + 1] to [start + n_users], drawn from the random numbers of [seed]
+        """
+        rng = self.synthetic_scenario.rng
+        self.synthetic_scenario.set_rng(np.random.default_rng(seed))
+        try:
+            customer_data = self._get_customers_batch(start, n_users)
+            return customer_data, self._get_events_batch(customer_data)
+        finally:
+            self.synthetic_scenario.set_rng(rng)
+
+    def _get_customers_batch(self, start: int, n_users: int) -> pd.DataFrame:
+        """
+        Customers data of the customers [start + 1] to [start + n_users]
+        """
+        customer_data = self._get_base_user_ids(start, n_users)
         customer_data = self._set_registration_event(
             customer_data, self.registration_event_name)  # create registration_name column
         customer_data = self._set_demographic_properties(
             customer_data)  # create and give demographic data
-        self.customer_data = customer_data
         return customer_data
 
-    def get_events_data(self):
+    def _get_events_batch(self, customer_data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Events data of the customers in [customer_data]
+        """
+        if self.event_sampling == 'direct':
+            return self._get_sampled_events_data(customer_data)
 
-        events_data = self.customer_data.copy()
+        events_data = customer_data.copy()
         # store the which are demographic features to drop later
         demographic_cols = [col for col in events_data if col != 'UUID']
         # add dates
@@ -67,17 +151,27 @@ class LTVSyntheticData():
         events_data['event_name'] = self.event_name
         # generate revenue events
         events_data = self.synthetic_scenario.get_revenue_events(
-            self.customer_data, events_data)
+            customer_data, events_data)
         # remove information already present in customer data
         events_data = events_data.drop(demographic_cols, axis=1)
         return events_data
 
-    def _get_base_user_ids(self):
+    def _get_sampled_events_data(self, customer_data: pd.DataFrame) -> pd.DataFrame:
+        """
+        Revenue events sampled directly for each converted customer, without a row per customer and day
+        """
+        events_data = self.synthetic_scenario.sample_revenue_events(customer_data)
+        events_data['event_name'] = self.event_name
+        return events_data[['UUID', 'event_date', 'days_since_registration', 'event_name', 'value']]
+
+    def _get_base_user_ids(self, start: int = 0, n_users: int = None):
         """
-        Generate a sequence of 1 to N numbers representing the unique user ID, where N is the number of users
+        Generate a sequence of 1 to N numbers representing the unique user ID, where N is the number of users.
+        With [start] and [n_users], generates only the ids [start + 1] to [start + n_users]
         """
+        n_users = n_users if n_users is not None else self.n_users
         return pd.DataFrame({'UUID': np.linspace(
-            1, self.n_users, num=self.n_users).astype(str)})
+            start + 1, start + n_users, num=n_users).astype(str)})
 
     @staticmethod
     def _set_registration_event(
@@ -89,7 +183,7 @@ class LTVSyntheticData():
     def _set_demographic_properties(
             self, customer_data: pd.DataFrame) -> pd.DataFrame:
 
-        demography_data = self.synthetic_scenario.get_demography_data()
+        demography_data = self.synthetic_scenario.get_demography_data(len(customer_data))
         return pd.concat([customer_data, demography_data], axis=1)
 
     def _set_dates(self, events_data: pd.DataFrame) -> None:
@@ -105,3 +199,12 @@ class LTVSyntheticData():
             axis=1)
         return output_data[output_data['event_date']
                            >= output_data['registration_date']]
+
+
+def _init_worker(synthetic_data: LTVSyntheticData) -> None:
+    global _worker_synthetic_data
+    _worker_synthetic_data = synthetic_data
+
+
+def _generate_shard(start: int, n_users: int, seed: np.random.SeedSequence) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    return _worker_synthetic_data._get_shard(start, n_users, seed)
@@ -4,7 +4,13 @@
 # LICENSE file in the root directory of this source tree.
 import pandas as pd
 import numpy as np
-from src.event_generator import BinomialEventGenerator, ParetoEventGenerator
+from src.event_generator import (
+    BinomialEventGenerator,
+    CategoricalFeature,
+    EventGenerator,
+    NumericFeature,
+    ParetoEventGenerator,
+)
 
 
 class BaseScenario():
@@ -35,6 +41,15 @@ class BaseScenario():
     def get_default_demography_properties(self) -> pd.DataFrame:
         raise NotImplementedError
 
+    def set_rng(self, rng: np.random.Generator) -> None:
+        """
+        Replaces the pseudo-random number generator of the scenario and of all its event generators
+        """
+        self.rng = rng
+        for value in vars(self).values():
+            if isinstance(value, EventGenerator):
+                value.rng = rng
+
     def _get_conversion_prob(
             self,
             customer_data: pd.DataFrame) -> pd.DataFrame:
@@ -95,8 +110,8 @@ class BaseScenario():
         data = pd.merge(data, events_data)
         # create probabilty based on exponential distribution. Given PDF(x) =
         # lambda*exp(-lambda*x), E[PDF(x)] = 1/lambda
-        data['event_probability'] = data.apply(lambda x: self.event_decay_scale / x['total_revenue_events'] * np.exp(-(
-            self.event_decay_scale / x['total_revenue_events']) * x['days_since_registration']), axis=1)
+        decay = self.event_decay_scale / data['total_revenue_events']
+        data['event_probability'] = decay * np.exp(-decay * data['days_since_registration'])
         # probability of making a purchase conditional to returning
         data['events_number'] = self._get_conditional_purchase_prob(
             data, data['total_revenue_events'])
@@ -114,34 +129,100 @@ class BaseScenario():
                          axis=1)
         return data
 
+    def sample_revenue_events(
+            self,
+            customer_data: pd.DataFrame,
+            block_size: int = 16) -> pd.DataFrame:
+        """
+        Generates the same revenue events as get_revenue_events, but without evaluating every day of every customer.
+        Steps 1), 2) and 5) are the same. Steps 3) and 4) are replaced by sampling directly the days with at least one purchase:
+        the number of purchases in day d is Binomial(n, p_d), with n the total number of revenue events and p_d decaying
+        exponentially with d, so it is non-zero with probability q_d = 1 - (1 - p_d)^n, which also decays with d.
+        Candidate days are drawn with geometric jumps of probability q_0 (the largest) and each candidate is kept with probability
+        q_d / q_0, which is exactly an independent Bernoulli(q_d) trial per day. The number of purchases of a kept day is then
+        sampled from the binomial conditioned on being positive. Only rows with revenue are allocated.
+        Inputs
+            - customer_data: customers and their demographic data, as in get_revenue_events
+            - block_size: number of candidate days drawn at once for each customer
+        Returns the customer data of each revenue event, plus the columns event_date, days_since_registration and value
+        """
+        data = customer_data.copy()
+        data['converted'] = self._get_conversion_prob(data)
+        data = data[data['converted'] == 1].reset_index(drop=True)
+        data['total_revenue_events'] = self._get_conditional_purchases(data)
+
+        # number of trials (as np.random.Generator.binomial truncates it) and decay rate of each customer
+        trials = np.floor(data['total_revenue_events'].to_numpy()).astype(np.int64)
+        decay = self.event_decay_scale / data['total_revenue_events'].to_numpy()
+        horizon = (pd.Timestamp(self.date_end) - data['registration_date']).dt.days.to_numpy()
+        first_day_prob = -np.expm1(trials * np.log1p(-decay))
+
+        # candidate days of each customer, drawn in blocks of geometric jumps until the end of the date range
+        customers, days = [], []
+        position = np.full(len(data), -1, dtype=np.int64)
+        active = np.flatnonzero(horizon >= 0)
+        while len(active) > 0:
+            jumps = self.rng.geometric(first_day_prob[active, None], size=(len(active), block_size))
+            candidate_days = position[active, None] + np.cumsum(jumps, axis=1)
+            inside = candidate_days <= horizon[active, None]
+            customers.append(np.broadcast_to(active[:, None], inside.shape)[inside])
+            days.append(candidate_days[inside])
+            position[active] = candidate_days[:, -1]
+            active = active[candidate_days[:, -1] <= horizon[active]]
+        customer = np.concatenate(customers) if len(customers) > 0 else np.zeros(0, dtype=np.int64)
+        day = np.concatenate(days) if len(days) > 0 else np.zeros(0, dtype=np.int64)
+
+        # keep each candidate day with probability q_d / q_0
+        probability = decay[customer] * np.exp(-decay[customer] * day)
+        day_prob = -np.expm1(trials[customer] * np.log1p(-probability))
+        kept = self.rng.random(len(day)) * first_day_prob[customer] < day_prob
+        customer, day, probability, day_prob = customer[kept], day[kept], probability[kept], day_prob[kept]
+        order = np.lexsort((day, customer))
+        customer, day, probability, day_prob = customer[order], day[order], probability[order], day_prob[order]
+
+        # positive binomial: the position of the first success is a geometric truncated to the number of trials,
+        # and the remaining trials are a regular binomial
+        first_success = np.ceil(
+            np.log1p(-self.rng.random(len(day)) * day_prob) / np.log1p(-probability))
+        first_success = np.clip(first_success, 1, trials[customer]).astype(np.int64)
+        events_number = 1 + self.rng.binomial(trials[customer] - first_success, probability)
+
+        data = data.iloc[customer].reset_index(drop=True)
+        data['days_since_registration'] = day
+        data['event_date'] = data['registration_date'] + pd.to_timedelta(day, unit='D')
+        data['event_value'] = self._get_conditional_purchase_value(data)
+        data['value'] = data['converted'] * events_number * data['event_value']
+        return data.drop(['converted', 'event_value', 'total_revenue_events'], axis=1)
+
 
 class BaseAppScenario(BaseScenario):
     """
     Base scenario for mobile app
     """
 
-    def get_demography_data(self) -> pd.DataFrame:
+    def get_demography_data(self, n_users: int = None) -> pd.DataFrame:
         """
-        Sets demography of the users to resemble that of mobile app.
+        Sets demography of the users (by default, n_users of the scenario) to resemble that of mobile app.
         Adds to each user the following characteristics
             - country: country associated to first even
             - device: devices (ios or android) used in first event
             - download_method: whether customer was on wifi or mobile data when first logged in
             - registration_date: when was the first login of the customer
         """
+        n_users = n_users if n_users is not None else self.n_users
         return pd.DataFrame(
             {
                 'country': self.rng.choice(
                     [
-                        'US', 'CA', 'GB', 'BR', 'IN', 'ES', 'FR'], size=self.n_users, p=[
+                        'US', 'CA', 'GB', 'BR', 'IN', 'ES', 'FR'], size=n_users, p=[
                         0.2, 0.1, 0.05, 0.15, 0.3, 0.1, 0.1], replace=True), 'device': self.rng.choice(
                     [
-                        'ios', 'android'], size=self.n_users, p=[
+                        'ios', 'android'], size=n_users, p=[
                         0.4, 0.6], replace=True), 'download_method': self.rng.choice(
                     [
-                        'wifi', 'mobile_data'], size=self.n_users, p=[
+                        'wifi', 'mobile_data'], size=n_users, p=[
                         0.7, 0.3], replace=True), 'registration_date': self.rng.choice(
-                    self.date_range, size=self.n_users, replace=True), })
+                    self.date_range, size=n_users, replace=True), })
 
 
 class IAPAppScenario(BaseAppScenario):
@@ -159,25 +240,25 @@ class IAPAppScenario(BaseAppScenario):
 
         self.conv_event_gen = BinomialEventGenerator(
             {
-                'country': lambda x: {'US': 0.5, 'CA': 0.3, 'GB': 0.2, 'BR': 0.1, 'IN': -0.2, 'ES': 0, 'FR': 0.1}.get(x, 0),
-                'device': lambda x: 0.5 if x == 'ios' else 0,
-                'download_method': lambda x: 0 if x == 'wifi' else -1
+                'country': CategoricalFeature({'US': 0.5, 'CA': 0.3, 'GB': 0.2, 'BR': 0.1, 'IN': -0.2, 'ES': 0, 'FR': 0.1}, default=0),
+                'device': CategoricalFeature({'ios': 0.5}, default=0),
+                'download_method': CategoricalFeature({'wifi': 0}, default=-1)
             },
             baseline=-3,  # around 4.7%
             seed=self.rng
         )
         self.cond_purchases_quantity_gen = self.cond_purchase_value_gen = ParetoEventGenerator(
             {
-                'country': lambda x: {'US': 2, 'CA': 1, 'GB': 1.2, 'BR': -2, 'IN': -1.5, 'ES': 0, 'FR': 0.0}.get(x, 0),
-                'device': lambda x: 2 if x == 'ios' else 0,
-                'download_method': lambda x: 2 if x == 'wifi' else 0
+                'country': CategoricalFeature({'US': 2, 'CA': 1, 'GB': 1.2, 'BR': -2, 'IN': -1.5, 'ES': 0, 'FR': 0.0}, default=0),
+                'device': CategoricalFeature({'ios': 2}, default=0),
+                'download_method': CategoricalFeature({'wifi': 2}, default=0)
             },
             baseline=5,  # we expect as baseline 5 purchases
             seed=self.rng
         )
         self.cond_purchase_event_gen = BinomialEventGenerator(
             {
-                'event_probability': lambda x: x
+                'event_probability': NumericFeature()
             },
             seed=self.rng,
             logit_output=False
@@ -185,9 +266,9 @@ class IAPAppScenario(BaseAppScenario):
 
         self.cond_purchase_value_gen = ParetoEventGenerator(
             {
-                'country': lambda x: {'US': 2, 'CA': 1, 'GB': 1.2, 'BR': -2, 'IN': -1.5, 'ES': 0, 'FR': 0.0}.get(x, 0),
-                'device': lambda x: 2 if x == 'ios' else 0,
-                'total_revenue_events': lambda x: np.log(x)
+                'country': CategoricalFeature({'US': 2, 'CA': 1, 'GB': 1.2, 'BR': -2, 'IN': -1.5, 'ES': 0, 'FR': 0.0}, default=0),
+                'device': CategoricalFeature({'ios': 2}, default=0),
+                'total_revenue_events': NumericFeature(np.log)
             },
             baseline=10,  # we put the expected value at 5. It *must* always be over 1
             seed=self.rng
@@ -0,0 +1,90 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Module providing writers of synthetic data to partitioned files"""
+import os
+import shutil
+from typing import Dict
+
+import pandas as pd
+from src.synth_data import LTVSyntheticData
+
+
+FILE_FORMATS = {"parquet": ".parquet", "csv.gz": ".csv.gz"}
+# time column of each table and name of the (hive) partition derived from it
+PARTITIONS = {
+    "customers": ("registration_date", "registration_month"),
+    "events": ("event_date", "event_month"),
+}
+
+
+def _write_partitioned(
+    data: pd.DataFrame, path: str, table: str, batch: int, file_format: str, partition: bool
+) -> None:
+    """
+    Writes one batch of a table into [path]/[table], one file per month when [partition] is True, in
+    hive-style directories (e.g. events/event_month=2020-01/part-00000.parquet). The partition column
+    is only present in the directory names, as readers of hive datasets add it back
+    """
+    time_col, partition_col = PARTITIONS[table]
+    if partition:
+        groups = data.groupby(data[time_col].dt.strftime("%Y-%m"), sort=True)
+        directories = [
+            (os.path.join(path, table, f"{partition_col}={month}"), group) for month, group in groups
+        ]
+    else:
+        directories = [(os.path.join(path, table), data)]
+    for directory, group in directories:
+        os.makedirs(directory, exist_ok=True)
+        file_path = os.path.join(directory, f"part-{batch:05d}{FILE_FORMATS[file_format]}")
+        if file_format == "parquet":
+            group.to_parquet(file_path, index=False)
+        else:
+            group.to_csv(file_path, index=False, compression="gzip")
+
+
+def write_synthetic_data(
+    synthetic_data: LTVSyntheticData,
+    path: str,
+    batch_size: int = 100000,
+    file_format: str = "parquet",
+    partition: bool = True,
+    overwrite: bool = False,
+) -> Dict[str, object]:
+    """
+    Generates the synthetic customers and events data in batches of [batch_size] customers and writes each batch
+    to disk before generating the next one, so that memory depends on the batch size and not on the number of customers.
+    The customers are written to [path]/customers and the events to [path]/events, which can be read with
+    LTVexploratory.from_parquet (parquet) or LTVexploratory.from_files (events in csv.gz)
+    Inputs
+        - synthetic_data: generator of the data
+        - path: output directory
+        - batch_size: number of customers generated and written at a time
+        - file_format: 'parquet' or 'csv.gz'
+        - partition: whether to partition the files by month of registration (customers) and of event (events)
+        - overwrite: whether to delete the customers and events data already in [path]. If False and there is
+            data in [path], raises a ValueError
+    Returns the paths of the customers and events data and the number of rows written to each
+    """
+    assert file_format in FILE_FORMATS, f"file_format must be one of {list(FILE_FORMATS)}, not {file_format}"
+    assert batch_size > 0, f"batch_size must be positive, not {batch_size}"
+    for table in PARTITIONS:
+        table_path = os.path.join(path, table)
+        if os.path.exists(table_path):
+            if not overwrite:
+                raise ValueError(f"{table_path} already exists. Use overwrite=True to replace it")
+            shutil.rmtree(table_path)
+
+    rows = {table: 0 for table in PARTITIONS}
+    for batch, (customers, events) in enumerate(synthetic_data.iter_batches(batch_size)):
+        for table, data in [("customers", customers), ("events", events)]:
+            _write_partitioned(data, path, table, batch, file_format, partition)
+            rows[table] += len(data)
+    return {
+        "customers_path": os.path.join(path, "customers"),
+        "events_path": os.path.join(path, "events"),
+        "customers_rows": rows["customers"],
+        "events_rows": rows["events"],
+    }
@@ -0,0 +1,49 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Fixtures shared by the tests: a small synthetic dataset and the analysis of it"""
+import os
+import sys
+
+import matplotlib
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+from src import LTVexploratory  # noqa: E402
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+# columns of the synthetic dataset (LTVSyntheticData with n_users=5000 and random_seed=42)
+COLUMNS = {
+    "uuid_col": "UUID",
+    "registration_time_col": "registration_date",
+    "event_time_col": "event_date",
+    "event_name_col": "event_name",
+    "value_col": "value",
+}
+
+
+@pytest.fixture(scope="session")
+def customers() -> pd.DataFrame:
+    return pd.read_parquet(os.path.join(DATA_DIR, "customers.parquet"))
+
+
+@pytest.fixture(scope="session")
+def events() -> pd.DataFrame:
+    return pd.read_parquet(os.path.join(DATA_DIR, "events.parquet"))
+
+
+@pytest.fixture
+def ltv(customers: pd.DataFrame, events: pd.DataFrame) -> LTVexploratory:
+    return LTVexploratory(customers, events, **COLUMNS, rounding_precision=1)
+
+
+@pytest.fixture(autouse=True)
+def close_figures():
+    yield
+    plt.close("all")
@@ -0,0 +1,50 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Tests of the outputs of the analyses against those of the analyses before the revenue matrix"""
+import os
+from typing import Callable, Dict
+
+import pandas as pd
+import pytest
+from src import LTVexploratory
+
+from conftest import COLUMNS, DATA_DIR
+
+# data of each analysis of the synthetic dataset, as written to data/baseline by the analyses that joined the
+# customers and events data (before the revenue matrix was shared by all analyses)
+BASELINE_CALLS: Dict[str, Callable[[LTVexploratory], object]] = {
+    "customers_intersection": lambda ltv: ltv.plot_customers_intersection(),
+    "purchases_distribution": lambda ltv: ltv.plot_purchases_distribution(days_limit=60, truncate_share=0.999),
+    "revenue_pareto": lambda ltv: ltv.plot_revenue_pareto(days_limit=60),
+    "customers_histogram": lambda ltv: ltv.plot_customers_histogram_per_conversion_day(days_limit=60),
+    "revenue_correlation": lambda ltv: ltv.plot_early_late_revenue_correlation(days_limit=70),
+    "paying_customers_flow": lambda ltv: ltv.plot_paying_customers_flow(60, 7, {}, {}),
+    "ltv_impact": lambda ltv: ltv.estimate_ltv_impact(60, 7, {}, True),
+}
+
+
+def output_data(output: object) -> pd.DataFrame:
+    """
+    Dataframe of the output of an analysis (the plot methods return the figure and the dataframe), as stored in data/baseline
+    """
+    data = output[1] if isinstance(output, tuple) else output
+    return data.reset_index(drop=True).rename(columns=str)
+
+
+@pytest.mark.parametrize("name", list(BASELINE_CALLS))
+def test_analysis_matches_baseline(ltv: LTVexploratory, name: str):
+    expected = pd.read_parquet(os.path.join(DATA_DIR, "baseline", f"{name}.parquet"))
+    pd.testing.assert_frame_equal(output_data(BASELINE_CALLS[name](ltv)), expected, check_dtype=False, check_names=False, rtol=1e-6)
+
+
+def test_days_limit_does_not_depend_on_previous_calls(customers: pd.DataFrame, events: pd.DataFrame, ltv: LTVexploratory):
+    # the revenue matrix is built once and shared, so previous calls with other limits must not change the outputs
+    for days_limit in [30, 90, 60]:
+        ltv.plot_revenue_pareto(days_limit=days_limit)
+        ltv.plot_purchases_distribution(days_limit=days_limit)
+    fresh = LTVexploratory(customers, events, **COLUMNS, rounding_precision=1)
+    for call in [BASELINE_CALLS["revenue_pareto"], BASELINE_CALLS["purchases_distribution"]]:
+        pd.testing.assert_frame_equal(output_data(call(ltv)), output_data(call(fresh)))
@@ -0,0 +1,97 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Tests of the incremental refresh of an analysis, which must give the same results as preparing all the data again"""
+import copy
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+from src import LTVexploratory
+
+from conftest import COLUMNS
+
+SEGMENT_FEATURE_COLS = ["country", "device"]
+# inputs of the analyses compared after the refresh
+CONFIG = {
+    "summary": {},
+    "plot_customers_intersection": {},
+    "plot_purchases_distribution": {"days_limit": 60},
+    "plot_revenue_pareto": {"days_limit": 60},
+    "plot_customers_histogram_per_conversion_day": {"days_limit": 60},
+    "plot_early_late_revenue_correlation": {"days_limit": 70},
+    "plot_paying_customers_flow": {"days_limit": 60, "early_limit": 7, "spending_breaks": {}, "end_spending_breaks": {}},
+    "estimate_ltv_impact": {"days_limit": 60, "early_limit": 7, "spending_breaks": {}, "is_mobile": True},
+}
+
+
+def revenue_entries(ltv: LTVexploratory) -> pd.DataFrame:
+    """
+    Entries of the revenue matrix by customer-id, which do not depend on the order in which customers were added
+    (nor on the type of array of the customer-ids)
+    """
+    matrix = ltv.revenue_matrix
+    return (
+        pd.DataFrame(
+            {
+                "uuid": np.asarray(ltv.prepared.uuids[matrix.rows], dtype=object),
+                "day": matrix.days,
+                "revenue": matrix.revenue,
+                "purchases": matrix.purchases,
+                "customer_age": matrix.customer_age[matrix.rows],
+            }
+        )
+        .sort_values(["uuid", "day"])
+        .reset_index(drop=True)
+    )
+
+
+def assert_same_analysis(full: LTVexploratory, refreshed: LTVexploratory):
+    expected = full.run_all(copy.deepcopy(CONFIG), n_jobs=1)
+    output = refreshed.run_all(copy.deepcopy(CONFIG), n_jobs=1)
+    for name in CONFIG:
+        if isinstance(expected[name], pd.DataFrame):
+            pd.testing.assert_frame_equal(output[name], expected[name])
+        else:
+            assert dict(output[name]) == dict(expected[name]), name
+    pd.testing.assert_frame_equal(revenue_entries(refreshed), revenue_entries(full))
+    assert refreshed.prepared.stats == full.prepared.stats
+    for col in SEGMENT_FEATURE_COLS:
+        by_uuid = [pd.Series(ltv.prepared.segments[col], index=ltv.prepared.uuids).sort_index() for ltv in [refreshed, full]]
+        pd.testing.assert_series_equal(*by_uuid)
+
+
+@pytest.mark.parametrize("as_batches", [False, True])
+def test_daily_appends_equal_full_rebuild(customers: pd.DataFrame, events: pd.DataFrame, as_batches: bool):
+    time_col, event_time_col = COLUMNS["registration_time_col"], COLUMNS["event_time_col"]
+    days = pd.date_range(end=events[event_time_col].max().normalize(), periods=30)
+    refreshed = LTVexploratory(
+        customers[customers[time_col] < days[0]],
+        events[events[event_time_col] < days[0]],
+        **COLUMNS,
+        segment_feature_cols=SEGMENT_FEATURE_COLS,
+    )
+    # the cube is built before the refresh, so it must be built again with the new data
+    refreshed.cohort_cube
+    for day in days:
+        next_day = day + pd.Timedelta(days=1)
+        refreshed.append_customers(customers[(customers[time_col] >= day) & (customers[time_col] < next_day)])
+        new_events = events[(events[event_time_col] >= day) & (events[event_time_col] < next_day)]
+        if as_batches:
+            new_events = pa.Table.from_pandas(new_events, preserve_index=False).to_batches(max_chunksize=10)
+        refreshed.append_events(new_events)
+    # customers registered after the last event
+    refreshed.append_customers(customers[customers[time_col] >= days[-1] + pd.Timedelta(days=1)])
+
+    full = LTVexploratory(customers, events, **COLUMNS, segment_feature_cols=SEGMENT_FEATURE_COLS)
+    assert_same_analysis(full, refreshed)
+    pd.testing.assert_frame_equal(refreshed.cohort_cube.cohort_curve(30), full.cohort_cube.cohort_curve(30))
+
+
+def test_known_customers_are_not_added_again(customers: pd.DataFrame, events: pd.DataFrame):
+    ltv = LTVexploratory(customers, events, **COLUMNS)
+    assert ltv.append_customers(customers.iloc[:100]) == 0
+    assert ltv.prepared.n_customers == customers[COLUMNS["uuid_col"]].nunique()
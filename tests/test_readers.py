@@ -0,0 +1,66 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Tests of the detection of the format of times read as text"""
+from typing import List
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+from src.readers import parse_times
+
+
+def parse(values: List[str], time_format: str = None) -> List[pd.Timestamp]:
+    return list(pd.Series(parse_times(pa.chunked_array([values], type=pa.string()), time_format).to_pandas()))
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["2023-01-31 10:20:30", "2023-02-01 00:00:00"],
+        ["2023/01/31 10:20:30", "2023/02/01 00:00:00"],
+        ["20230131102030", "20230201000000"],
+        ["01/31/2023 10:20:30", "02/01/2023 00:00:00"],
+        ["31/01/2023 10:20:30", "01/02/2023 00:00:00"],
+        ["31.01.2023", "01.02.2023"],
+        ["2023-01-31T10:20:30.000", "2023-02-01T00:00:00.000"],
+    ],
+)
+def test_detects_format(values: List[str]):
+    times = parse(values)
+    assert times[0].date() == pd.Timestamp("2023-01-31").date()
+    assert times[1] == pd.Timestamp("2023-02-01")
+
+
+def test_rejects_ambiguous_format():
+    # month-first and day-first give different dates when no day is above 12
+    with pytest.raises(ValueError, match="time_format"):
+        parse(["01/02/2023", "03/04/2023"])
+
+
+def test_ambiguous_format_can_be_given():
+    assert parse(["01/02/2023", "03/04/2023"], "%d/%m/%Y") == [pd.Timestamp("2023-02-01"), pd.Timestamp("2023-04-03")]
+
+
+@pytest.mark.parametrize("unit", ["s", "ms", "us", "ns"])
+def test_detects_epoch_unit(unit: str):
+    times = [pd.Timestamp("2023-01-31 10:20:30"), pd.Timestamp("2001-09-09 01:46:40")]
+    values = [str((time - pd.Timestamp(0)) // pd.Timedelta(1, unit)) for time in times]
+    assert parse(values) == times
+
+
+def test_converts_time_zones_to_utc():
+    assert parse(["2023-01-31T10:20:30+02:00", "2023-01-31T10:20:30Z"]) == [
+        pd.Timestamp("2023-01-31 08:20:30"),
+        pd.Timestamp("2023-01-31 10:20:30"),
+    ]
+
+
+def test_values_not_matching_the_format_are_null(capsys: pytest.CaptureFixture):
+    values = ["2023-01-31"] * 19 + ["not a time", None]
+    times = parse(values)
+    assert times[:19] == [pd.Timestamp("2023-01-31")] * 19
+    assert pd.isna(times[19]) and pd.isna(times[20])
+    assert "1 times could not be parsed" in capsys.readouterr().out
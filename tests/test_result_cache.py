@@ -0,0 +1,110 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Tests of the on-disk cache of the data of the analyses"""
+import os
+from typing import List
+
+import matplotlib.pyplot as plt
+import pandas as pd
+import pytest
+from src import LTVexploratory
+from src.result_cache import ResultCache
+
+from conftest import COLUMNS
+
+
+def frame(n: int) -> pd.DataFrame:
+    return pd.DataFrame({"value": range(n)})
+
+
+def cached_keys(cache: ResultCache) -> List[str]:
+    return sorted(name[: -len(".parquet")] for name in os.listdir(cache.path))
+
+
+def test_hit_and_miss(tmp_path: str):
+    cache = ResultCache(str(tmp_path))
+    key = cache.key("data", "method", {"days_limit": 60})
+    assert not cache.contains(key)
+    assert cache.get(key) == (None, None)
+
+    cache.put(key, frame(3), {"days_limit": 60, "breaks": {"b": 2, "a": 1}})
+    assert cache.contains(key)
+    data, inputs = cache.get(key)
+    pd.testing.assert_frame_equal(data, frame(3))
+    # dictionaries are stored as (key, value) pairs, in their order
+    assert inputs == {"days_limit": 60, "breaks": [["b", 2], ["a", 1]]}
+
+
+def test_key_depends_on_data_method_and_inputs():
+    key = ResultCache.key("data", "method", {"days_limit": 60, "breaks": {"a": 1, "b": 2}})
+    # dictionaries are keyed by their content, in any order
+    assert key == ResultCache.key("data", "method", {"breaks": {"b": 2, "a": 1}, "days_limit": 60})
+    assert key != ResultCache.key("other data", "method", {"days_limit": 60, "breaks": {"a": 1, "b": 2}})
+    assert key != ResultCache.key("data", "other method", {"days_limit": 60, "breaks": {"a": 1, "b": 2}})
+    assert key != ResultCache.key("data", "method", {"days_limit": 30, "breaks": {"a": 1, "b": 2}})
+
+
+def test_evicts_least_recently_used(tmp_path: str):
+    cache = ResultCache(str(tmp_path))
+    keys = [cache.key("data", "method", {"n": n}) for n in range(4)]
+    for age, key in zip([30, 20, 10], keys[:3]):
+        cache.put(key, frame(100), {})
+        os.utime(os.path.join(cache.path, key + ".parquet"), (0, 1e9 - age))
+    # room for three results and a half
+    cache.max_size = int(cache.size / 3 * 3.5)
+    # reading the oldest result makes the second one the least recently used
+    cache.get(keys[0])
+    cache.put(keys[3], frame(100), {})
+    assert cached_keys(cache) == sorted([keys[0], keys[2], keys[3]])
+    assert cache.size <= cache.max_size
+
+    cache.clear()
+    assert cached_keys(cache) == [] and cache.size == 0
+
+
+@pytest.fixture
+def cached_ltv(customers: pd.DataFrame, events: pd.DataFrame, tmp_path: str) -> LTVexploratory:
+    ltv = LTVexploratory(customers, events, **COLUMNS)
+    ltv.set_result_cache(os.path.join(tmp_path, "cache"))
+    return ltv
+
+
+def test_analyses_skip_cached_results(cached_ltv: LTVexploratory, customers: pd.DataFrame, events: pd.DataFrame):
+    _, expected = LTVexploratory(customers, events, **COLUMNS).plot_revenue_pareto(60)
+    _, miss = cached_ltv.plot_revenue_pareto(60)
+    with cached_ltv.profiling():
+        _, hit = cached_ltv.plot_revenue_pareto(60)
+    pd.testing.assert_frame_equal(miss, expected)
+    pd.testing.assert_frame_equal(hit, expected)
+    # the data step was read from the cache, without running its stages
+    assert "_customer_purchases" not in set(cached_ltv.profile["stage"])
+
+
+def test_hits_print_the_same_as_misses(cached_ltv: LTVexploratory, capsys: pytest.CaptureFixture):
+    def run() -> str:
+        breaks, end_breaks = {}, {}
+        cached_ltv.plot_customers_histogram_per_conversion_day(days_limit=90)
+        cached_ltv.plot_paying_customers_flow(60, 7, breaks, end_breaks)
+        cached_ltv.estimate_ltv_impact(60, 7, {}, True)
+        plt.close("all")
+        assert len(breaks) == 4 and len(end_breaks) == 4
+        return capsys.readouterr().out
+
+    miss = run()
+    assert "first 60 days" in miss and "Starting spending breaks" in miss and "Ending spending breaks" in miss
+    assert run() == miss
+
+
+def test_new_data_is_not_read_from_the_cache(cached_ltv: LTVexploratory, customers: pd.DataFrame, events: pd.DataFrame):
+    new_events = events[COLUMNS["event_time_col"]] >= events[COLUMNS["event_time_col"]].max() - pd.Timedelta(days=90)
+    ltv = LTVexploratory(customers, events[~new_events], **COLUMNS)
+    ltv.set_result_cache(cached_ltv.result_cache.path)
+    _, before = ltv.plot_purchases_distribution(60)
+    ltv.append_events(events[new_events])
+    _, after = ltv.plot_purchases_distribution(60)
+    _, expected = cached_ltv.plot_purchases_distribution(60)
+    pd.testing.assert_frame_equal(after, expected)
+    assert not before.equals(after)
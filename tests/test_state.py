@@ -0,0 +1,94 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+
+# This source code is licensed under the BSD-style license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""Tests of saving the prepared data of an analysis with save_state and opening it again with load_state"""
+import copy
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from src import LTVexploratory
+
+from conftest import COLUMNS
+from test_append import CONFIG, SEGMENT_FEATURE_COLS, revenue_entries
+
+
+def with_time_zone(data: pd.DataFrame, col: str, time_zone: str) -> pd.DataFrame:
+    data = data.copy()
+    if time_zone is not None:
+        data[col] = data[col].dt.tz_localize(time_zone)
+    return data
+
+
+@pytest.fixture(params=[None, "Europe/Stockholm"])
+def time_zone(request: pytest.FixtureRequest) -> str:
+    return request.param
+
+
+@pytest.fixture
+def saved(customers: pd.DataFrame, events: pd.DataFrame, time_zone: str) -> LTVexploratory:
+    return LTVexploratory(
+        with_time_zone(customers, COLUMNS["registration_time_col"], time_zone),
+        with_time_zone(events, COLUMNS["event_time_col"], time_zone),
+        **COLUMNS,
+        segment_feature_cols=SEGMENT_FEATURE_COLS,
+    )
+
+
+def test_round_trip(saved: LTVexploratory, tmp_path: str, time_zone: str):
+    saved.cohort_cube
+    saved.save_state(os.path.join(tmp_path, "state"))
+    loaded = LTVexploratory.load_state(os.path.join(tmp_path, "state"))
+
+    assert loaded.data_customers is None and loaded.data_events is None
+    assert loaded.prepared.fingerprint() == saved.prepared.fingerprint()
+    assert loaded.prepared.stats == saved.prepared.stats
+    assert str(loaded.prepared.stats["event_end"].tz) == str(time_zone)
+    assert loaded.prepared.end_events_date == saved.prepared.end_events_date
+    assert loaded.prepared.end_events_date.tz == saved.prepared.end_events_date.tz
+    pd.testing.assert_frame_equal(revenue_entries(loaded), revenue_entries(saved))
+
+    expected = saved.run_all(copy.deepcopy(CONFIG), n_jobs=1)
+    output = loaded.run_all(copy.deepcopy(CONFIG), n_jobs=1)
+    for name in CONFIG:
+        if isinstance(expected[name], pd.DataFrame):
+            pd.testing.assert_frame_equal(output[name], expected[name])
+        else:
+            assert dict(output[name]) == dict(expected[name]), name
+
+    # the arrays of the prepared data and of the cube are memory-mapped
+    assert isinstance(loaded.revenue_matrix.revenue.base, np.memmap)
+    assert isinstance(loaded._cohort_cube.revenue.base, np.memmap)
+    for name in loaded.cohort_cube.ARRAYS:
+        np.testing.assert_array_equal(getattr(loaded.cohort_cube, name), getattr(saved.cohort_cube, name))
+    assert loaded.cohort_cube.end_events_date == saved.cohort_cube.end_events_date
+
+
+def test_appends_after_loading(customers: pd.DataFrame, events: pd.DataFrame, tmp_path: str, time_zone: str):
+    time_col = COLUMNS["registration_time_col"]
+    customers = with_time_zone(customers, time_col, time_zone)
+    events = with_time_zone(events, COLUMNS["event_time_col"], time_zone)
+    cutoff = events[COLUMNS["event_time_col"]].max() - pd.Timedelta(days=30)
+    old_events = events[COLUMNS["event_time_col"]] < cutoff
+    LTVexploratory(
+        customers[customers[time_col] < cutoff], events[old_events], **COLUMNS, segment_feature_cols=SEGMENT_FEATURE_COLS
+    ).save_state(os.path.join(tmp_path, "state"))
+
+    loaded = LTVexploratory.load_state(os.path.join(tmp_path, "state"))
+    loaded.append_customers(customers[customers[time_col] >= cutoff])
+    loaded.append_events(events[~old_events])
+    full = LTVexploratory(customers, events, **COLUMNS, segment_feature_cols=SEGMENT_FEATURE_COLS)
+    pd.testing.assert_frame_equal(revenue_entries(loaded), revenue_entries(full))
+    assert loaded.prepared.stats == full.prepared.stats
+
+
+def test_does_not_overwrite_unless_asked(saved: LTVexploratory, tmp_path: str):
+    path = os.path.join(tmp_path, "state")
+    saved.save_state(path)
+    with pytest.raises(ValueError, match="overwrite"):
+        saved.save_state(path)
+    saved.save_state(path, overwrite=True)
+    assert LTVexploratory.load_state(path).prepared.fingerprint() == saved.prepared.fingerprint()